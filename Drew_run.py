@@ -13,6 +13,7 @@ wheel_dict = static_params['wheel']
 etl_dict = static_params['etl']
 stage_dict = static_params['stage']
 image_wells = static_params['image_wells'] ## Default option for this is "no"
+simulation_dict = static_params.get('simulation', {})  # simulated hardware, off by default
 
 
 # ------ Set user-defined paramters ------ #
@@ -116,6 +117,10 @@ laserObj = lsmfx.laser(laser_dict)
 wheelObj = lsmfx.wheel(wheel_dict)
 etlObj = lsmfx.etl(etl_dict)
 stageObj = lsmfx.stage(stage_dict)
+simulationObj = lsmfx.simulation(simulation_dict)
 
 # Begin scanning
-lsmfx.scan3D(experimentObj, cameraObj, daqObj, laserObj, wheelObj, etlObj, stageObj, image_wells)
\ No newline at end of file
+# (guarded so compression worker processes can import this file)
+if __name__ == '__main__':
+    lsmfx.scan3D(experimentObj, cameraObj, daqObj, laserObj, wheelObj, etlObj, stageObj, image_wells,
+                 simulationObj)
\ No newline at end of file
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+"""
+Order in which scan3D visits tiles and channels
+
+A policy turns the z / y tile grid and the channels into a list of
+(j, k, ch) = (z tile, y tile, channel) to acquire one after the other.
+The setup a tile is written to only depends on (j, k, ch), so data.h5,
+data.xml and the Zarr store are the same whatever the order.
+
+    channel_innermost   z -> y -> channel (original order), the filter
+                        wheel turns at every tile
+    channel_outermost   z -> channel -> y, one filter change per
+                        channel and z plane
+    serpentine          as channel_outermost, with y running back and
+                        forth so the stage does not return to the
+                        first y tile after every pass
+
+With bidirectional scanning every other tile of the order is scanned
+from the end of X back to the start, where the previous scan left the
+stage (reversed_setups). Its frames are stored in acquisition order and
+the direction is recorded with the setup (data.h5, data.xml, Zarr).
+
+A pass can acquire several channels: all of them with interleaved
+acquisition (interleave.py), two with dual camera acquisition
+(camera_loop.py). ch then counts passes instead of channels.
+
+predict() estimates the scan time of an order from a cost model of the
+stage, filter wheel and laser switching times.
+
+"""
+
+policies = ('channel_innermost', 'channel_outermost', 'serpentine')
+
+# cost model, s and mm/s
+costs = {'wheel': 1.0,         # one filter change
+         'laser': 0.05,        # laser current change
+         'x_velocity': 1.0,    # stage velocities between tiles, as
+         'y_velocity': 1.0,    # set by tile_transition.stage_to_tile
+         'z_velocity': 0.1,
+         'acceleration': 0.1,  # added to every stage move
+         'overhead': 0.3}      # DAQ write, camera start, ...
+
+
+def acquisition_order(policy, zTiles, yTiles, nWavelengths):
+    """
+    Return the list of (j, k, ch) to acquire, for policy (see policies).
+    """
+    if policy == 'channel_innermost':
+        return [(j, k, ch)
+                for j in range(zTiles)
+                for k in range(yTiles)
+                for ch in range(nWavelengths)]
+
+    elif policy == 'channel_outermost':
+        return [(j, k, ch)
+                for j in range(zTiles)
+                for ch in range(nWavelengths)
+                for k in range(yTiles)]
+
+    elif policy == 'serpentine':
+        order = []
+        forward = True
+        for j in range(zTiles):
+            for ch in range(nWavelengths):
+                ks = range(yTiles) if forward else range(yTiles - 1, -1, -1)
+                order += [(j, k, ch) for k in ks]
+                forward = not forward
+        return order
+
+    else:
+        raise Exception('invalid acquisition order!')
+
+
+def reversed_setups(order, zTiles, yTiles, bidirectional, channels=1):
+    """
+    Return the sorted setups (tile + zTiles*yTiles*ch) scanned in the
+    reverse X direction: every other tile of order if bidirectional.
+    When a pass acquires several channels (interleaved or dual camera
+    acquisition) the ch of order counts passes, and pass ch acquires
+    channels ch*channels to ch*channels + channels - 1.
+    """
+    if not bidirectional:
+        return []
+    return sorted(k + yTiles*j + zTiles*yTiles*(ch*channels + c)
+                  for n, (j, k, ch) in enumerate(order) if n % 2 == 1
+                  for c in range(channels))
+
+
+def predict(order, scan, experiment, costs=costs, bidirectional=False):
+    """
+    Predicted scan time (s) of order, and the time spent between tiles.
+
+    The stage returns X to the start of the scan (unless bidirectional)
+    and moves Y / Z while the filter wheel and the laser are set
+    (tile_transition), so a transition takes as long as the slowest of
+    them.
+
+    Parameters
+    ----------
+
+    order
+        list of (j, k, ch), see acquisition_order
+
+    scan
+        lsmfx.scan, for xLength and scanSpeed
+
+    experiment
+        lsmfx.experiment, for yWidth and zWidth
+    """
+    acquisition = scan.xLength/scan.scanSpeed
+    transitions = 0.0
+    wheel_changes = 0
+    last = None
+    for j, k, ch in order:
+        if bidirectional:
+            stage = 0.0
+        else:
+            stage = scan.xLength/costs['x_velocity'] + costs['acceleration']
+        wheel = 0.0
+        laser = 0.0
+        if last is not None:
+            lj, lk, lch = last
+            if lk != k:
+                stage = max(stage, abs(k - lk)*experiment.yWidth /
+                            costs['y_velocity'] + costs['acceleration'])
+            if lj != j:
+                stage = max(stage, abs(j - lj)*experiment.zWidth /
+                            costs['z_velocity'] + costs['acceleration'])
+            if lch != ch:
+                wheel = costs['wheel']
+                wheel_changes += 1
+            if lch != ch or lj != j:
+                laser = costs['laser']
+        transitions += max(stage, wheel, laser) + costs['overhead']
+        last = (j, k, ch)
+    return len(order)*acquisition + transitions, transitions, wheel_changes
+
+
+def print_predictions(scan, experiment, selected=None, costs=costs,
+                      bidirectional=False, channels=1):
+    """
+    Print the predicted scan time of every policy, for passes of
+    channels channels each (see reversed_setups).
+    """
+    print('Acquisition order (predicted scan time / time between tiles / '
+          'filter changes):')
+    for policy in policies:
+        order = acquisition_order(policy, scan.zTiles, scan.yTiles,
+                                  scan.nWavelengths // channels)
+        total, transitions, wheel_changes = predict(order, scan, experiment,
+                                                    costs, bidirectional)
+        print(('  * ' if policy == selected else '    ') +
+              '%-18s %8.3f h %8.1f s %5d' % (policy, total/3600.0,
+                                             transitions, wheel_changes))
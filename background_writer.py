@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+"""
+Producer / consumer writing for the scan3D frame loop
+
+The camera loop fills one of N preallocated ring buffers and hands full
+ones to a writer thread over a bounded queue, so saving a block no longer
+stalls frame retrieval. The writer thread returns each buffer to the pool
+once it has been written.
+
+annotate(idx, attrs) goes through the same queue, so the frame accounting
+of a setup (camera_loop.FrameStats) reaches the file after its frames.
+
+"""
+import numpy as np
+import queue
+import threading
+import time as timer
+
+
+
+def close_writers(writers, reraise=True):
+    """
+    Close every writer of writers, also when closing one of them raises
+    (BackgroundWriter.close re-raises the error of its thread). The first
+    error is raised once all of them are closed, or only printed if
+    reraise is False, e.g. while another error is propagating.
+    """
+    error = None
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as e:
+            print('Error closing ' + type(writer).__name__ + ': ' + repr(e))
+            if error is None:
+                error = e
+    if error is not None and reraise:
+        raise error
+
+class BackgroundWriter(object):
+    """
+    Runs writer.write(block, idx, ind1, ind2) on a separate thread.
+
+    Parameters
+    ----------
+
+    writer
+        any object with write(img_3d, idx, ind1, ind2), annotate(idx,
+        attrs) and close(), e.g. h5_writer.H5Writer. It is only used from the writer thread
+        and is closed by close().
+
+    shape
+        shape of one ring buffer, (blockSize, Y, X)
+
+    n_buffers
+        number of preallocated ring buffers (2 = double buffering). The
+        queue of full buffers is bounded by the same number, so at most
+        n_buffers blocks are ever held in memory.
+    """
+
+    def __init__(self, writer, shape, n_buffers=2, dtype=np.uint16):
+
+        self.writer = writer
+        self.n_buffers = n_buffers
+
+        self.free = queue.Queue()
+        for b in range(n_buffers):
+            self.free.put(np.zeros(shape, dtype=dtype))
+        self.full = queue.Queue(maxsize=n_buffers)
+
+        self.error = None
+        self.closed = False
+
+        # counters
+        self.blocks_written = 0
+        self.frames_written = 0
+        self.frames_queued = 0
+        self.max_queue_depth = 0
+        self.write_time = 0.0  # s spent in writer.write
+        self.producer_wait = 0.0  # s the camera loop waited for a buffer
+        self.lag = 0.0  # s from submit to written, last block
+        self.max_lag = 0.0
+
+        self.thread = threading.Thread(target=self._run,
+                                       name='BackgroundWriter',
+                                       daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_buffer(self):
+        """
+        Return an empty ring buffer, waiting for the writer to release one
+        if all of them are queued. Time spent waiting here is time the
+        camera loop was held up by disk I/O.
+        """
+        self._check()
+        start = timer.perf_counter()
+        buffer = self.free.get()
+        self.producer_wait += timer.perf_counter() - start
+        return buffer
+
+    def submit(self, buffer, n, idx, ind1, ind2):
+        """
+        Queue the first n frames of buffer to be written as frames
+        ind1 - ind2 of setup idx. The buffer must not be touched again
+        until it comes back from get_buffer.
+        """
+        self._check()
+        self.full.put((buffer, n, idx, ind1, ind2, timer.perf_counter()))
+        self.frames_queued += n
+        self.max_queue_depth = max(self.max_queue_depth, self.full.qsize())
+
+    def annotate(self, idx, attrs):
+        """
+        Queue writer.annotate(idx, attrs), done after the blocks already
+        submitted have been written.
+        """
+        self._check()
+        self.full.put((None, 0, idx, attrs, None, timer.perf_counter()))
+
+    def queue_depth(self):
+        """
+        Number of full buffers waiting for the writer.
+        """
+        return self.full.qsize()
+
+    def frames_behind(self):
+        """
+        Number of frames handed to the writer but not written yet.
+        """
+        return self.frames_queued - self.frames_written
+
+    def stats(self):
+        return {'blocks_written': self.blocks_written,
+                'frames_written': self.frames_written,
+                'queue_depth': self.queue_depth(),
+                'max_queue_depth': self.max_queue_depth,
+                'frames_behind': self.frames_behind(),
+                'lag': self.lag,
+                'max_lag': self.max_lag,
+                'write_time': self.write_time,
+                'producer_wait': self.producer_wait}
+
+    def print_stats(self):
+        print('Writer queue depth: ' + str(self.queue_depth()) + '/' +
+              str(self.n_buffers) + ' (max ' + str(self.max_queue_depth) +
+              '), frames behind: ' + str(self.frames_behind()) +
+              ', lag: ' + str(round(self.lag, 3)) + ' s (max ' +
+              str(round(self.max_lag, 3)) + ' s), camera loop waited ' +
+              str(round(self.producer_wait, 3)) + ' s')
+
+    def close(self):
+        """
+        Write everything still queued, stop the thread and close the
+        writer. Re-raises the first error hit on the writer thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.full.put(None)
+            self.thread.join()
+            self.writer.close()
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('BackgroundWriter failed') from self.error
+        if self.closed:
+            raise RuntimeError('BackgroundWriter is closed')
+
+    def _run(self):
+        while True:
+            item = self.full.get()
+            if item is None:
+                break
+            buffer, n, idx, ind1, ind2, submitted = item
+            try:
+                # after an error keep draining so the producer never blocks
+                if self.error is None and buffer is None:
+                    # annotate, ind1 holds the attributes
+                    self.writer.annotate(idx, ind1)
+                elif self.error is None:
+                    start = timer.perf_counter()
+                    self.writer.write(buffer[0:n], idx, ind1, ind2)
+                    end = timer.perf_counter()
+                    self.write_time += end - start
+                    self.lag = end - submitted
+                    self.max_lag = max(self.max_lag, self.lag)
+                    self.blocks_written += 1
+                    self.frames_written += n
+            except BaseException as e:
+                self.error = e
+            finally:
+                if buffer is not None:
+                    self.free.put(buffer)
+
+
+class SharedWriter(object):
+    """
+    One file writer used by several BackgroundWriters, e.g. one per
+    camera. The writes of the BackgroundWriter threads are serialized
+    and the file writer is closed when the last of them is closed.
+
+    Parameters
+    ----------
+
+    writer
+        H5Writer, ZarrWriter, ...
+
+    users
+        number of BackgroundWriters sharing writer
+    """
+
+    def __init__(self, writer, users):
+        self.writer = writer
+        self.users = users
+        self.lock = threading.Lock()
+
+    def write(self, img_3d, idx, ind1, ind2):
+        with self.lock:
+            self.writer.write(img_3d, idx, ind1, ind2)
+
+    def annotate(self, idx, attrs):
+        with self.lock:
+            self.writer.annotate(idx, attrs)
+
+    def close(self):
+        with self.lock:
+            self.users -= 1
+            if self.users == 0:
+                self.writer.close()
@@ -0,0 +1,76 @@
+"""
+Per-frame CPU time of the frame loop with a simulated camera: the old
+full-width readout + crop copy against the ROI-exact PcoCamera adapter,
+frame by frame and in batches.
+
+    python -m benchmarks.bench_camera --frames 2000 --Y 256 --X 2048
+
+"""
+import argparse
+import time as timer
+import types
+import numpy as np
+
+from hardware.simulated import SimulatedCamera
+from hardware.pco_camera import PcoCamera, legacy_roi
+
+
+def run(frames, Y, X, blockSize):
+    camera = types.SimpleNamespace(number=0, X=X, Y=Y, expTime=1.0,
+                                   triggerMode='auto sequence',
+                                   acquireMode='auto', timestamp='off',
+                                   frameTimeout=2.0)
+    ring_buffer = np.zeros((blockSize, Y, X), dtype=np.uint16)
+
+    # old loop: full width readout, crop and copy
+    cam = SimulatedCamera(realtime=False)
+    cam.configuration = {'exposure time': camera.expTime*1.0e-3,
+                         'roi': legacy_roi(Y)}
+    cam.record(number_of_images=frames)
+    cam.start()
+    start = timer.process_time()
+    for n in range(frames):
+        cam.wait_for_next_image(n)
+        temp = cam.image(n)[0]
+        ring_buffer[n % blockSize] = \
+            temp[2:Y + 2, 1024 - int(X / 2):1024 - int(X / 2) + X]
+    legacy = timer.process_time() - start
+
+    # adapter, one frame per call
+    cam = PcoCamera(camera, SimulatedCamera(realtime=False))
+    cam.record(frames)
+    cam.start()
+    start = timer.process_time()
+    for n in range(frames):
+        cam.wait_for_next_image(n)
+        cam.read_into(n, ring_buffer[n % blockSize])
+    single = timer.process_time() - start
+
+    # adapter, all ready frames up to the end of the block per call
+    cam = PcoCamera(camera, SimulatedCamera(realtime=False))
+    cam.record(frames)
+    cam.start()
+    start = timer.process_time()
+    n = 0
+    while n < frames:
+        cam.wait_for_next_image(n)
+        counter = n % blockSize
+        n += cam.read_batch(n, ring_buffer[counter:
+                                           counter + min(blockSize - counter,
+                                                         frames - n)])
+    batch = timer.process_time() - start
+
+    for name, seconds in (('crop copy', legacy),
+                          ('PcoCamera.read_into', single),
+                          ('PcoCamera.read_batch', batch)):
+        print('%-22s %8.1f us/frame CPU' % (name, seconds/frames*1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    parser.add_argument('--blockSize', type=int, default=512)
+    args = parser.parse_args()
+    run(args.frames, args.Y, args.X, args.blockSize)
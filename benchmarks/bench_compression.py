@@ -0,0 +1,92 @@
+"""
+Chunks-per-second benchmark for chunk compression: each available codec
+encoding serially and in a process pool, and H5Writer end to end with the
+HDF5 filter pipeline against direct chunk writes from the pool.
+
+    python -m benchmarks.bench_compression --workers 8
+
+B3D is only benchmarked when its HDF5 filter (32016) is installed.
+
+"""
+import argparse
+import concurrent.futures
+import os
+import tempfile
+import time as timer
+
+import h5py
+
+import compression
+from h5_writer import h5init, H5Writer
+from benchmarks.common import geometry, synthetic_block, report
+
+
+def available_codecs():
+    codecs = [compression.GzipCodec()]
+    for make in (compression.ZstdCodec, compression.BloscCodec):
+        try:
+            codecs.append(make())
+        except ImportError:
+            print('skipping ' + make.name + ' (not installed)')
+    if h5py.h5z.filter_avail(32016):
+        codecs.append(compression.B3DCodec(1.0, 1))
+    else:
+        print('skipping b3d (filter 32016 not available)')
+    return codecs
+
+
+def chunks_of(block, chunks):
+    c1, c2, c3 = chunks
+    return [block[0:c1, y:y + c2, x:x + c3].copy()
+            for y in range(0, block.shape[1], c2)
+            for x in range(0, block.shape[2], c3)]
+
+
+def run(workers, frames, Y, X):
+    camera, scan, experiment = geometry(nFrames=frames, Y=Y, X=X, yTiles=1,
+                                        quantSigma=1.0)
+    chunk_shape = (int(scan.chunkSize1), int(scan.chunkSize2),
+                   int(scan.chunkSize3))
+    block = synthetic_block(scan.blockSize, Y, X).view('int16')
+    chunks = chunks_of(block, chunk_shape)
+
+    for codec in available_codecs():
+        start = timer.time()
+        size = sum(len(codec.encode(c)) for c in chunks)
+        report(codec.name + ' serial', timer.time() - start, len(chunks),
+               'chunks')
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            list(pool.map(compression._encode, [codec]*workers,
+                          chunks[0:workers]))  # start the workers
+            start = timer.time()
+            list(pool.map(compression._encode, [codec]*len(chunks), chunks))
+            report(codec.name + ' pool x' + str(workers),
+                   timer.time() - start, len(chunks), 'chunks')
+        print('    ratio ' + str(round(block[0:chunk_shape[0]].nbytes/size, 2)))
+
+    # end to end, gzip so the filter pipeline path exists everywhere
+    camera.codec = 'gzip'
+    block = synthetic_block(scan.blockSize, Y, X)
+    n_blocks = frames // scan.blockSize
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (0, workers):
+            dest = os.path.join(tmp, 'data' + str(n) + '.h5')
+            h5init(dest, camera, scan, experiment)
+            start = timer.time()
+            with H5Writer(dest, compression_workers=n) as writer:
+                for b in range(n_blocks):
+                    writer.write(block, 0, b*scan.blockSize,
+                                 (b + 1)*scan.blockSize)
+            name = 'filter pipeline' if n == 0 else 'direct chunks x' + str(n)
+            report('H5Writer ' + name, timer.time() - start, n_blocks,
+                   'blocks')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--frames', type=int, default=2048)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    args = parser.parse_args()
+    run(args.workers, args.frames, args.Y, args.X)
@@ -0,0 +1,52 @@
+"""
+Benchmark h5write (reopens data.h5 for every block) against the
+persistent H5Writer session.
+
+    python -m benchmarks.bench_h5_writer --frames 2048 --tiles 4
+
+"""
+import argparse
+import os
+import tempfile
+import time as timer
+
+from h5_writer import h5init, h5write, H5Writer
+from benchmarks.common import geometry, synthetic_block, report
+
+
+def run(frames, tiles, Y, X):
+    camera, scan, experiment = geometry(nFrames=frames, Y=Y, X=X,
+                                        yTiles=tiles)
+    block = synthetic_block(scan.blockSize, Y, X)
+    n_blocks = frames // scan.blockSize
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        dest = os.path.join(tmp, 'h5write.h5')
+        h5init(dest, camera, scan, experiment)
+        start = timer.time()
+        for idx in range(tiles):
+            for b in range(n_blocks):
+                h5write(dest, block, idx, b*scan.blockSize,
+                        (b + 1)*scan.blockSize)
+        report('h5write', timer.time() - start, tiles*n_blocks, 'blocks')
+
+        dest = os.path.join(tmp, 'writer.h5')
+        h5init(dest, camera, scan, experiment)
+        start = timer.time()
+        with H5Writer(dest) as writer:
+            for idx in range(tiles):
+                for b in range(n_blocks):
+                    writer.write(block, idx, b*scan.blockSize,
+                                 (b + 1)*scan.blockSize)
+        report('H5Writer', timer.time() - start, tiles*n_blocks, 'blocks')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=2048)
+    parser.add_argument('--tiles', type=int, default=4)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    args = parser.parse_args()
+    run(args.frames, args.tiles, args.Y, args.X)
@@ -0,0 +1,57 @@
+"""
+Benchmark scan startup for growing mosaics: h5init (declares the layout
+only) against creating every setup up front, as h5init used to.
+
+    python -m benchmarks.bench_h5init --tiles 10 100 1000
+
+"""
+import argparse
+import os
+import tempfile
+import time as timer
+
+import h5py
+
+from h5_writer import h5init, h5setup
+from benchmarks.common import geometry
+
+
+def run(tile_counts, frames, Y, X, channels):
+    wavelengths = ('405', '488', '561', '638')[0:channels]
+
+    for tiles in tile_counts:
+        camera, scan, experiment = geometry(nFrames=frames, Y=Y, X=X,
+                                            yTiles=tiles,
+                                            wavelengths=wavelengths)
+        setups = tiles*channels
+
+        with tempfile.TemporaryDirectory() as tmp:
+
+            dest = os.path.join(tmp, 'lazy.h5')
+            start = timer.time()
+            h5init(dest, camera, scan, experiment)
+            lazy = timer.time() - start
+
+            dest = os.path.join(tmp, 'eager.h5')
+            start = timer.time()
+            h5init(dest, camera, scan, experiment)
+            with h5py.File(dest, 'a') as f:
+                for idx in range(setups):
+                    h5setup(f, idx)
+            eager = timer.time() - start
+            size = os.path.getsize(dest)
+
+        print('%5d tiles  h5init %8.3f s   all setups %8.3f s  (%.1f MB)' %
+              (tiles, lazy, eager, size/1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tiles', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    parser.add_argument('--channels', type=int, default=2)
+    args = parser.parse_args()
+    run(args.tiles, args.frames, args.Y, args.X, args.channels)
@@ -0,0 +1,53 @@
+"""
+Benchmark the resolution pyramid: the skimage path used by h5write
+(three downscale_local_mean calls with astype after each level) against
+the streaming PyramidBuilder.
+
+    python -m benchmarks.bench_pyramid --blocks 4
+
+"""
+import argparse
+import time as timer
+
+import skimage.transform
+
+from pyramid import PyramidBuilder, to_output
+from benchmarks.common import synthetic_block, report
+
+
+def skimage_levels(img_3d):
+    levels = [img_3d.astype('int16')]
+    for z in range(1, 4):
+        img_3d = skimage.transform.downscale_local_mean(img_3d, (2, 2, 2)
+                                                        ).astype('uint16')
+        levels.append(img_3d.astype('int16'))
+    return levels
+
+
+def run(blocks, block_size, Y, X):
+    block = synthetic_block(block_size, Y, X)
+    mb = blocks*block.nbytes/1e6
+
+    start = timer.time()
+    for b in range(blocks):
+        skimage_levels(block)
+    report('skimage downscale_local_mean', timer.time() - start, mb, 'MB')
+
+    start = timer.time()
+    pyramid = PyramidBuilder(4)
+    for b in range(blocks):
+        for z, ind1, img_3d in pyramid.push(block):
+            to_output(img_3d)
+    for z, ind1, img_3d in pyramid.finish():
+        to_output(img_3d)
+    report('PyramidBuilder', timer.time() - start, mb, 'MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', type=int, default=4)
+    parser.add_argument('--block-size', type=int, default=512)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    args = parser.parse_args()
+    run(args.blocks, args.block_size, args.Y, args.X)
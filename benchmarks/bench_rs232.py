@@ -0,0 +1,68 @@
+"""
+Time spent in RS-232 round trips for the commands of one tile transition
+(hardware/simulated.py devices at their nominal latencies): the fixed
+100 ms sleep of commWithResp against reading until the device
+terminator.
+
+    python -m benchmarks.bench_rs232 --tiles 3
+
+"""
+import argparse
+import time as timer
+
+import hardware.ms2000 as ms2000
+import hardware.skyra as skyra
+import hardware.fw102c as fw102c
+from hardware.simulated import SimulatedASIStage, SimulatedSkyra, \
+    SimulatedFW102C
+
+
+def transition(xyzStage, skyraLaser, fWheel, tile):
+    """
+    The device commands scan3D issues between two tiles.
+    """
+    xyzStage.setVelocities({'X': 1.0, 'Y': 1.0, 'Z': 0.1})
+    xyzStage.goAbsoluteAxes({'X': -1.0, 'Y': 0.1*tile, 'Z': 0.1}, False)
+    xyzStage.waitUntilIdle()
+    xyzStage.setScanR(-1.0, 1.0)
+    xyzStage.setVelocities({'X': 0.1, 'Y': 0.1, 'Z': 0.1})
+    fWheel.setPosition(1 + tile % 2)
+    skyraLaser.setModulationHighCurrent(1, 1000.0)
+    skyraLaser.turnOn(1)
+    xyzStage.scan(False)
+    skyraLaser.turnOff(1)
+
+
+def run(tiles, terminators):
+    xyzStage = ms2000.MS2000(baudrate=9600, port=None,
+                             tty=SimulatedASIStage(baudrate=9600),
+                             terminator=terminators and '\r\n' or None)
+    skyraLaser = skyra.Skyra(baudrate=115200, port=None,
+                             tty=SimulatedSkyra(baudrate=115200),
+                             terminator=terminators and '\r\n' or None)
+    skyraLaser.setMaxCurrents({1: 2000.0})
+    fWheel = fw102c.FW102C(baudrate=115200, port=None,
+                           tty=SimulatedFW102C(baudrate=115200),
+                           terminator=terminators and '>' or None)
+
+    start = timer.perf_counter()
+    for tile in range(tiles):
+        transition(xyzStage, skyraLaser, fWheel, tile)
+    elapsed = timer.perf_counter() - start
+
+    print(('terminator' if terminators else 'fixed sleep') +
+          ': %.2f s per tile transition' % (elapsed/tiles))
+    for name, device in (('Stage', xyzStage),
+                         ('Laser', skyraLaser),
+                         ('Filter wheel', fWheel)):
+        device.printLatencyStats(name, details=True)
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tiles', type=int, default=3)
+    args = parser.parse_args()
+    legacy = run(args.tiles, False)
+    terminated = run(args.tiles, True)
+    print('%.1fx faster' % (legacy/terminated))
@@ -0,0 +1,167 @@
+"""
+End-to-end scan3D on simulated hardware (hardware/simulated.py): stage,
+laser, filter wheel, tunable lens, DAQ and camera, with the real frame
+loop, background writer and HDF5 / Zarr output. Settings come from
+static_params.json with the simulation section switched on.
+
+    python -m benchmarks.bench_scan3D --frames 1000 --yTiles 2
+    python -m benchmarks.bench_scan3D --fast --latency 0   # CI, no waiting
+
+--fast hands frames to the loop as fast as it takes them, so the frame
+rate printed is the throughput of the acquisition pipeline; without it
+frames arrive one expTime apart as on the instrument.
+
+--drop-rate makes the simulated cameras miss frames, to check the frame
+accounting (camera_loop.FrameStats) and the frameTimeout path:
+
+    python -m benchmarks.bench_scan3D --fast --drop-rate 0.001 --timestamp
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time as timer
+
+import lsmfx
+import telemetry
+
+
+def settings(tmp, frames, yTiles, zTiles, wavelengths, expTime, Y, X,
+             quantSigma, codec, backend, order='channel_innermost',
+             bidirectional=False, interleaved=False, cameras=1,
+             dtype='float64', frameTimeout=2.0, timestamp=False):
+    with open('static_params.json', 'r') as read_file:
+        static_params = json.load(read_file)
+
+    camera_dict = static_params['camera']
+    camera_dict['expTime'] = expTime
+    camera_dict['Y'] = Y
+    camera_dict['X'] = X
+    camera_dict['codec'] = codec
+    camera_dict['B3Denv'] = ''
+    camera_dict['quantSigma'] = {wave: quantSigma for wave in wavelengths}
+    camera_dict['number2'] = 1 if cameras > 1 else None
+    camera_dict['frameTimeout'] = frameTimeout
+    camera_dict['timestamp'] = 'binary' if timestamp else 'off'
+
+    experiment_dict = static_params['experiment']
+    experiment_dict['drive'] = tmp
+    experiment_dict['fname'] = 'bench_scan3D'
+    experiment_dict['backend'] = backend
+    experiment_dict['order'] = order
+    experiment_dict['bidirectional'] = bidirectional
+    experiment_dict['interleaved'] = interleaved
+    xLength = frames*experiment_dict['xWidth']/1000.0
+    experiment_dict['xMin'] = -xLength/2
+    experiment_dict['xMax'] = xLength/2
+    experiment_dict['yMin'] = 0.0
+    experiment_dict['yMax'] = yTiles*experiment_dict['yWidth']
+    experiment_dict['zMin'] = 0.1
+    experiment_dict['zMax'] = 0.1 + zTiles*experiment_dict['zWidth']
+    laser_dict = static_params['laser']
+    experiment_dict['wavelengths'] = {wave: laser_dict['min_currents'][wave]
+                                      for wave in wavelengths}
+    experiment_dict['attenuations'] = {wave: 1000 for wave in wavelengths}
+
+    daq_dict = static_params['daq']
+    daq_dict['dtype'] = dtype
+    for key, value in (('xmin', -5.15), ('xmax', 5.0), ('xpp', 1.2),
+                       ('ymin', -2.0), ('ymax', 2.4), ('ypp', 0.024),
+                       ('econst', 2.4)):
+        daq_dict[key] = {wave: value for wave in wavelengths}
+
+    # interleaved and dual camera channels go through a multiband filter
+    static_params['wheel']['names_to_channels']['multiband'] = 5
+
+    return static_params
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        static_params = settings(tmp, args.frames, args.yTiles, args.zTiles,
+                                 args.wavelengths, args.expTime, args.Y,
+                                 args.X, args.quantSigma, args.codec,
+                                 args.backend, args.order,
+                                 args.bidirectional, args.interleaved,
+                                 args.cameras, args.dtype,
+                                 args.frameTimeout, args.timestamp)
+        simulation = lsmfx.simulation({'enabled': True,
+                                       'realtime': not args.fast,
+                                       'latency': args.latency,
+                                       'drop_rate': args.drop_rate})
+        experiment = lsmfx.experiment(static_params['experiment'])
+        camera = lsmfx.camera(static_params['camera'])
+        session = lsmfx.scan(experiment, camera)
+
+        output = io.StringIO() if args.quiet else sys.stdout
+        start = timer.time()
+        with contextlib.redirect_stdout(output):
+            lsmfx.scan3D(experiment,
+                         camera,
+                         lsmfx.daq(static_params['daq']),
+                         lsmfx.laser(static_params['laser']),
+                         lsmfx.wheel(static_params['wheel']),
+                         lsmfx.etl(static_params['etl']),
+                         lsmfx.stage(static_params['stage']),
+                         {'option': 'no'},
+                         simulation)
+        elapsed = timer.time() - start
+
+        setups = session.yTiles*session.zTiles*session.nWavelengths
+        frames = len(session.order)*session.nCameras*session.framesPerTile
+        size = 0
+        for root, dirs, files in os.walk(experiment.path()):
+            if 'settings and code archive' in root:
+                continue
+            size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+
+        print('%d setups x %d frames of %d x %d: %.2f s, %.1f frames/s, '
+              '%.1f MB written' % (setups, session.nFrames, args.Y, args.X,
+                                   elapsed, frames/elapsed, size/1e6))
+        if args.telemetry:
+            telemetry.print_summary(telemetry.read_records(
+                experiment.path('telemetry.jsonl')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--yTiles', type=int, default=2)
+    parser.add_argument('--zTiles', type=int, default=1)
+    parser.add_argument('--wavelengths', nargs='+', default=['561'])
+    parser.add_argument('--expTime', type=float, default=10.0)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    parser.add_argument('--quantSigma', type=float, default=0.0)
+    parser.add_argument('--codec', default='b3d')
+    parser.add_argument('--backend', default='h5')
+    parser.add_argument('--order', default='channel_innermost',
+                        help='see acquisition_order.py')
+    parser.add_argument('--bidirectional', action='store_true',
+                        help='scan every other tile backwards in X')
+    parser.add_argument('--interleaved', action='store_true',
+                        help='all wavelengths in one pass per tile')
+    parser.add_argument('--cameras', type=int, default=1,
+                        help='2: dual camera acquisition')
+    parser.add_argument('--dtype', default='float64',
+                        help='DAQ write type, float64 or int16')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='fraction of frames the cameras drop')
+    parser.add_argument('--timestamp', action='store_true',
+                        help='image counter in the frames (binary timestamp)')
+    parser.add_argument('--frameTimeout', type=float, default=2.0,
+                        help='s without a frame before a tile is ended')
+    parser.add_argument('--fast', action='store_true',
+                        help='frames as fast as the loop takes them')
+    parser.add_argument('--latency', type=float, default=1.0,
+                        help='factor on simulated device latencies')
+    parser.add_argument('--quiet', action='store_true',
+                        help='hide the scan3D output')
+    parser.add_argument('--telemetry', action='store_true',
+                        help='summarize telemetry.jsonl (see telemetry.py)')
+    args = parser.parse_args()
+    run(args)
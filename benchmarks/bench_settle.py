@@ -0,0 +1,58 @@
+"""
+Waiting for stage moves to finish (hardware/simulated.py stage at its
+nominal latency): the busy '/' polling loop scan3D used against
+waitUntilIdle, for the moves of a tile transition.
+
+    python -m benchmarks.bench_settle --moves 10
+
+Reported: status polls sent, time from the real end of the move until
+the wait returned, and how long the port was held by the waiting.
+"""
+import argparse
+import time as timer
+
+import hardware.ms2000 as ms2000
+from hardware.simulated import SimulatedASIStage
+
+
+def busy_wait(xyzStage):
+    response = xyzStage.getMotorStatus()
+    while response[0] == 'B':
+        response = xyzStage.getMotorStatus()
+
+
+def run(moves, predicted):
+    port = SimulatedASIStage(baudrate=9600)
+    xyzStage = ms2000.MS2000(baudrate=9600, port=None, tty=port)
+    xyzStage.getPosition()
+    for ax in ('X', 'Y', 'Z'):
+        xyzStage.setVelocity(ax, 1.0)
+        xyzStage.setAcceleration(ax, 100)
+    xyzStage.resetLatencyStats()
+
+    late = 0.0
+    for n in range(moves):
+        xyzStage.goAbsolute('X', -1.0 - 0.2*(n % 2), False)
+        xyzStage.goAbsolute('Y', 0.1*n, False)
+        end = max(a['t1'] for a in port.axes.values())
+        if predicted:
+            xyzStage.waitUntilIdle()
+        else:
+            busy_wait(xyzStage)
+        late += timer.perf_counter() - end
+
+    stats = xyzStage.getLatencyStats()
+    polls, busy, worst = stats['/']
+    print('%-14s %6.1f polls/move, returned %5.1f ms after the stop, '
+          'port busy %6.1f ms/move' % ('waitUntilIdle' if predicted
+                                       else 'busy polling', polls/moves,
+                                       1000.0*late/moves,
+                                       1000.0*busy/moves))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--moves', type=int, default=10)
+    args = parser.parse_args()
+    run(args.moves, False)
+    run(args.moves, True)
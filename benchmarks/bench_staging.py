@@ -0,0 +1,92 @@
+"""
+Sustained frame rate of the scan3D frame loop with the HDF5 path
+(ring buffers + BackgroundWriter + H5Writer) against raw memmap staging,
+and the rate of the deferred conversion of the staged files.
+
+The loop copies the cropped region of a full sensor frame per frame, as
+scan3D does, without waiting for a camera, so the numbers are the rate
+each path can sustain.
+
+    python -m benchmarks.bench_staging --frames 4096 --tiles 2 --codec gzip
+
+"""
+import argparse
+import os
+import tempfile
+import time as timer
+
+from h5_writer import h5init, H5Writer
+from background_writer import BackgroundWriter
+from raw_staging import RawStaging, convert
+from benchmarks.common import geometry, synthetic_block, report
+
+
+def frame_loop(writer, ring_buffer, sensor, Y, X, nFrames, blockSize, idx):
+    counter = 0
+    previous = 0
+    for n in range(nFrames):
+        if counter == blockSize:
+            writer.submit(ring_buffer, counter, idx, previous, n)
+            ring_buffer = writer.get_buffer()
+            counter = 0
+            previous = n
+        ring_buffer[counter] = sensor[n % sensor.shape[0]][
+            2:Y + 2, 1024 - int(X/2):1024 - int(X/2) + X]
+        counter += 1
+    writer.submit(ring_buffer, counter, idx, previous, nFrames)
+    return ring_buffer
+
+
+def run(frames, tiles, Y, X, codec, workers):
+    camera, scan, experiment = geometry(nFrames=frames, Y=Y, X=X,
+                                        yTiles=tiles,
+                                        quantSigma=0.0 if codec == 'none'
+                                        else 1.0)
+    camera.codec = codec
+    sensor = synthetic_block(8, Y + 4, 2060)
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        dest = os.path.join(tmp, 'h5.h5')
+        h5init(dest, camera, scan, experiment)
+        start = timer.time()
+        writer = BackgroundWriter(H5Writer(dest, workers),
+                                  (scan.blockSize, Y, X))
+        ring_buffer = writer.get_buffer()
+        try:
+            for idx in range(tiles):
+                frame_loop(writer, ring_buffer, sensor, Y, X, frames,
+                           scan.blockSize, idx)
+                ring_buffer = writer.get_buffer()
+        finally:
+            writer.close()
+        report('HDF5 path', timer.time() - start, tiles*frames, 'frames')
+
+        staging = os.path.join(tmp, 'staging')
+        start = timer.time()
+        with RawStaging(staging, (frames, Y, X), scan.blockSize) as writer:
+            for idx in range(tiles):
+                ring_buffer = writer.start(idx)
+                frame_loop(writer, ring_buffer, sensor, Y, X, frames,
+                           scan.blockSize, idx)
+                writer.end()
+        report('raw staging', timer.time() - start, tiles*frames, 'frames')
+
+        dest = os.path.join(tmp, 'converted.h5')
+        h5init(dest, camera, scan, experiment)
+        start = timer.time()
+        convert(staging, dest, workers)
+        report('conversion', timer.time() - start, tiles*frames, 'frames')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=4096)
+    parser.add_argument('--tiles', type=int, default=2)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--X', type=int, default=2048)
+    parser.add_argument('--codec', default='gzip',
+                        help='none, gzip, zstd, blosc or b3d')
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args()
+    run(args.frames, args.tiles, args.Y, args.X, args.codec, args.workers)
@@ -0,0 +1,92 @@
+"""
+DAQ voltages of a scan: write_voltages for every tile against the
+WaveformCache (waveform_cache.py), with the simulated AO task of
+hardware/simulated.py. Settings as in bench_scan3D.
+
+    python -m benchmarks.bench_waveforms --tiles 20 --wavelengths 488 561
+
+The cached run still writes the voltages at every tile, since scan3D
+zeroes the AO task after each one.
+
+The AO task layout is compared too: all num_channels channels in
+float64 (--all-channels, the original task), the channels of
+names_to_channels in float64 (the default) and in int16 DAC codes
+(daq dtype 'int16'), with the buffer size and time of every write.
+"""
+import argparse
+import contextlib
+import io
+import time as timer
+
+import lsmfx
+from benchmarks.bench_scan3D import settings
+from hardware.simulated import SimulatedWaveformGenerator
+from waveform_cache import WaveformCache
+
+
+def objects(wavelengths, expTime, Y):
+    static_params = settings('', 1000, 1, 1, wavelengths, expTime, Y, 2048,
+                             0.0, 'b3d', 'h5')
+    return (lsmfx.daq(static_params['daq']),
+            lsmfx.laser(static_params['laser']),
+            lsmfx.camera(static_params['camera']),
+            lsmfx.experiment(static_params['experiment']))
+
+
+def run(tiles, wavelengths, expTime, Y, cached, all_channels=False,
+        dtype='float64'):
+    daq, laser, camera, experiment = objects(wavelengths, expTime, Y)
+    if all_channels:
+        daq.channels = list(range(daq.num_channels))
+    daq.dtype = dtype
+    session = type('session', (), {'nFrames': 1})
+    waveformGenerator = SimulatedWaveformGenerator(daq, camera, session)
+    waveforms = WaveformCache(prepare=waveformGenerator.prepare)
+
+    build = 0.0
+    start = timer.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tile in range(tiles):
+            ch = tile % len(wavelengths)
+            t0 = timer.perf_counter()
+            if cached:
+                key, voltages, rep_time = waveforms.get(
+                    lsmfx.write_voltages, daq, laser, camera, experiment,
+                    ch=ch)
+                build += timer.perf_counter() - t0
+                waveforms.write(waveformGenerator, key, voltages)
+                waveforms.write_zeros(waveformGenerator, daq)
+            else:
+                voltages, rep_time = lsmfx.write_voltages(
+                    daq, laser, camera, experiment, ch)
+                voltages = waveformGenerator.prepare(voltages)
+                build += timer.perf_counter() - t0
+                waveformGenerator.write(voltages)
+                waveformGenerator.write_zeros(daq=daq)
+    elapsed = timer.perf_counter() - start
+
+    print(('cached' if cached else 'rebuilt') +
+          ': %.3f ms per tile to get the voltages, %.2f ms per tile '
+          'in total' % (build/tiles*1000, elapsed/tiles*1000))
+    if cached:
+        waveforms.print_stats()
+    waveformGenerator.print_stats()
+    return build
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tiles', type=int, default=20)
+    parser.add_argument('--wavelengths', nargs='+', default=['488', '561'])
+    parser.add_argument('--expTime', type=float, default=10.0)
+    parser.add_argument('--Y', type=int, default=256)
+    parser.add_argument('--all-channels', action='store_true',
+                        help='AO task with all num_channels channels')
+    parser.add_argument('--dtype', default='float64',
+                        choices=('float64', 'int16'))
+    args = parser.parse_args()
+    rebuilt = run(args.tiles, args.wavelengths, args.expTime, args.Y, False,
+                  args.all_channels, args.dtype)
+    cached = run(args.tiles, args.wavelengths, args.expTime, args.Y, True,
+                 args.all_channels, args.dtype)
+    print('voltages %.1fx faster' % (rebuilt/cached))
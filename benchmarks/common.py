@@ -0,0 +1,61 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks are run from the repository root, e.g.
+
+    python -m benchmarks.bench_h5_writer
+
+and only use synthetic data, so they do not need any hardware.
+
+"""
+import types
+import numpy as np
+
+
+def geometry(nFrames=1024, Y=256, X=2048, yTiles=2, zTiles=1,
+             wavelengths=('488',), quantSigma=0.0):
+    """
+    Build minimal camera / scan / experiment stand-ins with the attributes
+    used by the writers (same names as lsmfx.camera, lsmfx.scan and
+    lsmfx.experiment).
+    """
+    camera = types.SimpleNamespace(
+        X=X, Y=Y, sampling=0.373, expTime=10.0, B3Denv='',
+        compressionMode=1, compressionWorkers=0, codec='b3d',
+        quantSigma={wave: quantSigma for wave in wavelengths})
+
+    experiment = types.SimpleNamespace(
+        wavelengths={wave: 0.0 for wave in wavelengths},
+        xWidth=0.373, yWidth=0.6893, zWidth=0.0563, theta=45.0)
+
+    scan = types.SimpleNamespace(
+        nFrames=nFrames, yTiles=yTiles, zTiles=zTiles,
+        nWavelengths=len(wavelengths))
+    scan.chunkSize1 = 256
+    if scan.chunkSize1 >= nFrames/8:
+        scan.chunkSize1 = np.floor(nFrames/8)
+    scan.chunkSize2 = 16
+    if scan.chunkSize2 >= Y/8:
+        scan.chunkSize2 = np.floor(Y/8)
+    scan.chunkSize3 = 256
+    if scan.chunkSize3 >= X/8:
+        scan.chunkSize3 = np.floor(X/8)
+    scan.blockSize = int(2*scan.chunkSize1)
+    scan.reversed = []
+
+    return camera, scan, experiment
+
+
+def synthetic_block(n, Y, X, seed=0):
+    """
+    Noisy uint16 frames with some structure, so compression has something
+    realistic to work on.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.linspace(100, 2000, X, dtype=np.float32)[np.newaxis, :]
+    block = rng.poisson(base, size=(n, Y, X))
+    return block.astype(np.uint16)
+
+
+def report(name, seconds, count, unit):
+    print('%-28s %8.3f s  %10.1f %s/s' % (name, seconds, count/seconds, unit))
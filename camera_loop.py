@@ -0,0 +1,224 @@
+#!/usr/bin/python
+
+"""
+Frame loop of scan3D
+
+acquire_tile copies the frames of one camera into the ring buffers of
+its writer while a tile is scanned, and hands full blocks to the writer.
+
+With two cameras behind a dichroic (dual camera acquisition) every
+camera records its own channel of the same stage pass. Each camera has
+its own writer queue and ring buffers and runs its own loop: camera 0 in
+the calling thread, the others on the threads of CameraLoops.
+
+Frames are counted rather than trusted: every frame is waited for with a
+timeout, and the image numbers of the camera show frames it dropped or
+delivered twice (FrameStats, stored with each setup in the output file).
+
+"""
+import concurrent.futures
+
+import numpy as np
+
+
+class FrameStats(object):
+    """
+    Frame accounting of one tile of one camera, or added up over a scan.
+
+    expected
+        frames the tile should have (scan.framesPerTile)
+
+    acquired
+        frames read from the camera and written
+
+    dropped
+        frames missing between two acquired frames, from the gaps in their
+        image numbers (see hardware/pco_camera.py)
+
+    duplicated
+        acquired frames whose image number did not increase
+
+    timeouts
+        tiles that ended because no frame came within the camera
+        frameTimeout; their last frames are missing
+    """
+
+    keys = ('expected', 'acquired', 'missing', 'dropped', 'duplicated',
+            'timeouts')
+
+    def __init__(self, expected=0):
+        self.expected = expected
+        self.acquired = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.timeouts = 0
+
+    @property
+    def missing(self):
+        return self.expected - self.acquired
+
+    def count(self, numbers):
+        """
+        Count the dropped and duplicated frames from the image numbers of
+        the acquired frames, in acquisition order.
+        """
+        steps = np.diff(np.asarray(numbers, dtype=np.int64))
+        self.dropped += int(np.sum(steps[steps > 1] - 1))
+        self.duplicated += int(np.count_nonzero(steps <= 0))
+
+    def add(self, other):
+        self.expected += other.expected
+        self.acquired += other.acquired
+        self.dropped += other.dropped
+        self.duplicated += other.duplicated
+        self.timeouts += other.timeouts
+
+    def attrs(self):
+        """
+        The counts as a dict, as stored with the setup in the output file.
+        """
+        return {key: int(getattr(self, key)) for key in self.keys}
+
+    def print_stats(self, name='Frames'):
+        print(name + ': ' + str(self.acquired) + '/' + str(self.expected) +
+              ' acquired, ' + str(self.missing) + ' missing, ' +
+              str(self.dropped) + ' dropped, ' + str(self.duplicated) +
+              ' duplicated, ' + str(self.timeouts) + ' timeouts')
+
+
+def acquire_tile(cam, writer, ring_buffer, session, setup, tile):
+    """
+    Acquire the frames of one tile and return the ring buffer to carry on
+    with at the next tile, and the FrameStats of the tile.
+
+    Every frame of the tile is waited for with the camera frameTimeout.
+    If one does not come the tile ends there: the frames acquired so far
+    are written (the last block is flushed even if it is not full) and
+    the rest of the setup stays empty. The FrameStats are stored with the
+    setup (writer.annotate).
+
+    Parameters
+    ----------
+
+    cam
+        hardware.pco_camera.PcoCamera, already started
+
+    writer
+        BackgroundWriter or RawStaging of this camera
+
+    ring_buffer
+        buffer of writer to fill first
+
+    session
+        lsmfx.scan, for framesPerTile and blockSize
+
+    setup
+        setup the frames are written to (tile + zTiles*yTiles*ch)
+    """
+    stats = FrameStats(session.framesPerTile)
+    numbers = np.zeros(session.framesPerTile, dtype=np.int64)
+
+    num_acquired = 0  # frames read so far
+    num_acquired_counter = 0  # frames in ring_buffer
+    num_acquired_previous = 0  # frame of ring_buffer[0]
+
+    while num_acquired < session.framesPerTile:
+
+        if not cam.wait_for_frame(num_acquired):
+            stats.timeouts += 1
+            print('Tile ' + str(tile) + ': no frame ' + str(num_acquired) +
+                  ' after ' + str(cam.timeout) + ' s, ' +
+                  str(session.framesPerTile - num_acquired) +
+                  ' frames missing')
+            break
+
+        # copy all frames that are ready straight into the ring buffer,
+        # up to the end of the block / tile
+        batch = cam.read_batch(num_acquired,
+                               ring_buffer[num_acquired_counter:
+                                           min(session.blockSize,
+                                               num_acquired_counter +
+                                               session.framesPerTile -
+                                               num_acquired)],
+                               numbers[num_acquired:])
+        num_acquired += batch
+        num_acquired_counter += batch
+
+        if num_acquired_counter == session.blockSize or \
+                num_acquired == session.framesPerTile:
+            print('Saving frames: ',
+                  str(num_acquired_previous),
+                  ' - ',
+                  str(num_acquired))
+            print('Tile: ' + str(tile))
+            writer.submit(ring_buffer, num_acquired_counter, setup,
+                          num_acquired_previous, num_acquired)
+            ring_buffer = writer.get_buffer()
+            num_acquired_counter = 0
+            num_acquired_previous = num_acquired
+
+    # last, partial block of a tile that timed out
+    if num_acquired_counter > 0:
+        print('Saving frames: ',
+              str(num_acquired_previous),
+              ' - ',
+              str(num_acquired))
+        writer.submit(ring_buffer, num_acquired_counter, setup,
+                      num_acquired_previous, num_acquired)
+        ring_buffer = writer.get_buffer()
+
+    stats.acquired = num_acquired
+    stats.count(numbers[:num_acquired])
+    writer.annotate(setup, stats.attrs())
+    if stats.missing or stats.dropped or stats.duplicated:
+        stats.print_stats('Tile ' + str(tile) + ' frames')
+
+    return ring_buffer, stats
+
+
+class CameraLoops(object):
+    """
+    Runs acquire_tile for several cameras at the same time.
+
+    Parameters
+    ----------
+
+    nCameras
+        number of cameras, all but the first get a thread
+    """
+
+    def __init__(self, nCameras):
+        self.nCameras = nCameras
+        self.pool = None
+        if nCameras > 1:
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=nCameras - 1, thread_name_prefix='Camera')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def run(self, cams, writers, ring_buffers, session, setups, tile):
+        """
+        Acquire one tile with every camera, camera i writing to setups[i].
+        Returns the ring buffers to carry on with and the FrameStats of
+        every camera. An error of any camera is raised once all of them
+        have stopped.
+        """
+        futures = [self.pool.submit(acquire_tile, cams[i], writers[i],
+                                    ring_buffers[i], session, setups[i], tile)
+                   for i in range(1, len(cams))]
+        try:
+            first = acquire_tile(cams[0], writers[0], ring_buffers[0],
+                                 session, setups[0], tile)
+        finally:
+            concurrent.futures.wait(futures)
+        results = [first] + [future.result() for future in futures]
+        return ([ring_buffer for ring_buffer, stats in results],
+                [stats for ring_buffer, stats in results])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+
+"""
+Chunk compression in a pool of worker processes
+
+With B3D (quantSigma != 0) all compression runs inside the HDF5 filter
+pipeline of the single writer call. In pool mode the writer instead cuts
+each level into whole HDF5 chunks (chunkSize1 x chunkSize2 x chunkSize3),
+compresses them in worker processes and stores the compressed bytes with
+write_direct_chunk, so compression scales across all cores.
+
+Codecs produce exactly the bytes the matching HDF5 filter would store, so
+the file reads back normally (B3D / Blosc / zstd need their HDF5 plugins
+installed on the reading side, as usual).
+
+"""
+import concurrent.futures
+import collections
+import os
+import zlib
+import numpy as np
+import h5py
+
+
+class Codec(object):
+    """
+    Interface for chunk codecs.
+
+    filter_id / filter_opts describe the HDF5 filter the dataset has to be
+    created with so readers can decode the chunks. encode takes one
+    C-contiguous chunk and returns the compressed bytes. Codecs are sent
+    to the worker processes, so they only hold plain attributes.
+    """
+
+    name = None
+    filter_id = None
+    filter_opts = ()
+
+    def dataset_kwargs(self):
+        """
+        Keyword arguments for require_dataset / create_dataset.
+        """
+        return {'compression': self.filter_id,
+                'compression_opts': self.filter_opts}
+
+    def encode(self, chunk):
+        raise NotImplementedError
+
+
+class GzipCodec(Codec):
+    """
+    HDF5 deflate filter (zlib). Always available, mainly for testing.
+    """
+
+    name = 'gzip'
+    filter_id = 'gzip'
+
+    def __init__(self, level=4):
+        self.level = level
+        self.filter_opts = level
+
+    def encode(self, chunk):
+        return zlib.compress(chunk.tobytes(), self.level)
+
+
+class ZstdCodec(Codec):
+    """
+    zstd filter (32015), needs the zstandard package to write and
+    hdf5plugin to read.
+    """
+
+    name = 'zstd'
+    filter_id = 32015
+
+    def __init__(self, level=3):
+        import zstandard  # noqa: F401, fail early if missing
+        self.level = level
+        self.filter_opts = (level,)
+
+    def dataset_kwargs(self):
+        kwargs = Codec.dataset_kwargs(self)
+        kwargs['allow_unknown_filter'] = True
+        return kwargs
+
+    def encode(self, chunk):
+        import zstandard
+        return zstandard.ZstdCompressor(level=self.level).compress(
+            chunk.tobytes())
+
+
+class BloscCodec(Codec):
+    """
+    Blosc filter (32001), needs the blosc package to write and hdf5plugin
+    to read.
+    """
+
+    name = 'blosc'
+    filter_id = 32001
+    compressors = {'blosclz': 0, 'lz4': 1, 'lz4hc': 2, 'zlib': 4, 'zstd': 5}
+
+    def __init__(self, cname='lz4', level=5, shuffle=1):
+        import blosc  # noqa: F401, fail early if missing
+        self.cname = cname
+        self.level = level
+        self.shuffle = shuffle
+        self.filter_opts = (0, 0, 0, 0, level, shuffle,
+                            self.compressors[cname])
+
+    def dataset_kwargs(self):
+        kwargs = Codec.dataset_kwargs(self)
+        kwargs['allow_unknown_filter'] = True
+        return kwargs
+
+    def encode(self, chunk):
+        import blosc
+        return blosc.compress(chunk.tobytes(), typesize=chunk.itemsize,
+                              clevel=self.level, shuffle=self.shuffle,
+                              cname=self.cname)
+
+
+class H5FilterCodec(Codec):
+    """
+    Runs any registered HDF5 filter on a chunk by writing it to an
+    in-memory HDF5 file and reading the stored chunk back, so filters
+    that only exist as HDF5 plugins (B3D) can be used in the pool.
+    """
+
+    name = 'hdf5'
+
+    def __init__(self, filter_id, filter_opts):
+        if not h5py.h5z.filter_avail(filter_id):
+            raise RuntimeError('HDF5 filter ' + str(filter_id) +
+                               ' is not available')
+        self.filter_id = filter_id
+        self.filter_opts = tuple(filter_opts)
+
+    def encode(self, chunk):
+        f = h5py.File('chunk', 'w', driver='core', backing_store=False)
+        try:
+            data = f.create_dataset('chunk', data=chunk, chunks=chunk.shape,
+                                    compression=self.filter_id,
+                                    compression_opts=self.filter_opts)
+            return data.id.read_direct_chunk((0,)*chunk.ndim)[1]
+        finally:
+            f.close()
+
+
+class B3DCodec(H5FilterCodec):
+    """
+    B3D (32016) with the options h5init has always used.
+    """
+
+    name = 'b3d'
+
+    def __init__(self, quantSigma, compressionMode):
+        self.filter_id = 32016
+        self.filter_opts = (round(quantSigma*1000),
+                            compressionMode,
+                            round(2.1845*1000),
+                            0,
+                            round(1.5*1000))
+
+    def encode(self, chunk):
+        if not h5py.h5z.filter_avail(self.filter_id):
+            raise RuntimeError('B3D filter (32016) is not available in ' +
+                               'this environment')
+        return H5FilterCodec.encode(self, chunk)
+
+
+def make_codec(camera, wave_str):
+    """
+    Codec for a channel, or None when it is stored uncompressed
+    (quantSigma == 0). camera.codec selects the codec, 'b3d' by default.
+    """
+    quantSigma = camera.quantSigma[wave_str]
+    if quantSigma == 0:
+        return None
+    codec = camera.codec
+    if codec == 'b3d':
+        return B3DCodec(quantSigma, camera.compressionMode)
+    elif codec == 'gzip':
+        return GzipCodec()
+    elif codec == 'zstd':
+        return ZstdCodec()
+    elif codec == 'blosc':
+        return BloscCodec()
+    else:
+        raise Exception('invalid codec: ' + str(codec))
+
+
+def codec_from_dataset(data):
+    """
+    Codec matching the filter pipeline of an existing dataset, or None if
+    the dataset is not compressed.
+    """
+    plist = data.id.get_create_plist()
+    for i in range(plist.get_nfilters()):
+        code, flags, values, name = plist.get_filter(i)
+        if code == h5py.h5z.FILTER_DEFLATE:
+            return GzipCodec(values[0])
+        elif code == 32015:
+            return ZstdCodec(values[0] if values else 3)
+        elif code == 32001:
+            cnames = {v: k for k, v in BloscCodec.compressors.items()}
+            return BloscCodec(cnames[values[6]], values[4], values[5])
+        else:
+            return H5FilterCodec(code, values)
+    return None
+
+
+def _encode(codec, chunk):
+    return codec.encode(chunk)
+
+
+class ChunkCompressor(object):
+    """
+    Compresses whole chunks in a process pool and stores them with
+    write_direct_chunk, in submission order.
+
+    Parameters
+    ----------
+
+    workers
+        number of worker processes (None = all cores)
+
+    max_pending
+        chunks in flight before submit waits for the oldest one, which
+        bounds memory
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        if workers is None:
+            workers = os.cpu_count()
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+        if max_pending is None:
+            max_pending = 4*workers
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        self.chunks_written = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def submit(self, data, codec, offset, chunk):
+        """
+        Compress chunk with codec and write it to dataset data at the
+        chunk-aligned offset.
+        """
+        future = self.pool.submit(_encode, codec, chunk)
+        self.pending.append((data, offset, future))
+        self.bytes_in += chunk.nbytes
+        while len(self.pending) > self.max_pending:
+            self._write_oldest()
+
+    def flush(self):
+        while self.pending:
+            self._write_oldest()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown()
+
+    def _write_oldest(self):
+        data, offset, future = self.pending.popleft()
+        compressed = future.result()
+        data.id.write_direct_chunk(offset, compressed)
+        self.chunks_written += 1
+        self.bytes_out += len(compressed)
+
+
+class RowStager(object):
+    """
+    Collects consecutive frames of one array until a full row of chunks
+    (row_frames frames) is available and hands it to flush_row. The last,
+    partial row is flushed by flush() with only the frames it holds.
+    """
+
+    def __init__(self, shape, row_frames, dtype):
+        self.row_frames = int(row_frames)
+        self.buffer = np.zeros((self.row_frames,) + tuple(shape[1:]),
+                               dtype=dtype)
+        self.row = None  # index of the chunk row held in buffer
+        self.filled = 0
+
+    def write(self, ind1, img_3d):
+        c1 = self.row_frames
+        pos = ind1
+        done = 0
+        while done < img_3d.shape[0]:
+            row = pos // c1
+            start = pos - row*c1
+            if row != self.row:
+                self.flush()
+                self.row = row
+                self.buffer[0:start] = 0
+            n = min(c1 - start, img_3d.shape[0] - done)
+            self.buffer[start:start + n] = img_3d[done:done + n]
+            self.filled = start + n
+            done += n
+            pos += n
+            if self.filled == c1:
+                self.flush()
+
+    def flush(self):
+        if self.row is not None and self.filled > 0:
+            self.flush_row(self.row*self.row_frames, self.filled)
+        self.row = None
+        self.filled = 0
+
+    def flush_row(self, start, filled):
+        """
+        Store buffer[0:filled] as frames start - start + filled.
+        """
+        raise NotImplementedError
+
+
+class ChunkStager(RowStager):
+    """
+    RowStager that cuts each row into whole HDF5 chunks for the
+    ChunkCompressor. The last, partial row is zero padded to whole chunks
+    (HDF5 stores edge chunks at full size).
+    """
+
+    def __init__(self, data, codec, compressor):
+        RowStager.__init__(self, data.shape, data.chunks[0], data.dtype)
+        self.data = data
+        self.codec = codec
+        self.compressor = compressor
+        self.chunks = data.chunks
+
+    def flush_row(self, start, filled):
+        c1, c2, c3 = self.chunks
+        self.buffer[filled:] = 0
+        Y, X = self.buffer.shape[1:]
+        for y in range(0, Y, c2):
+            for x in range(0, X, c3):
+                chunk = self.buffer[:, y:y + c2, x:x + c3]
+                if chunk.shape != (c1, c2, c3):
+                    padded = np.zeros((c1, c2, c3), dtype=chunk.dtype)
+                    padded[:, 0:chunk.shape[1], 0:chunk.shape[2]] = chunk
+                    chunk = padded
+                self.compressor.submit(self.data, self.codec, (start, y, x),
+                                       np.ascontiguousarray(chunk))
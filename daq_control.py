@@ -13,6 +13,7 @@ class Daq(object):
         self.daq = static_params['daq']
         self.names_to_channels = self.daq['names_to_channels']
         self.num_channels = self.daq['num_channels']
+        self.channels = sorted(set(self.names_to_channels.values())) # AO channels of the task
         self.ymax = ymax
         self.eoffset = eoffset
         self.rate = self.daq['rate']
@@ -26,7 +27,7 @@ class Daq(object):
         self.ao_task.stop() # uncomment while run
         self.voltages[4, :] = 5.0 # for test
         self.voltages[self.names_to_channels[wavelength], :] = 5.0 # uncomment while run
-        self.ao_task.write(self.voltages) # uncomment while run
+        self.ao_task.write(self.voltages[self.channels]) # uncomment while run
         self.ao_task.start() # uncomment while run
         print(str(wavelength) + ' galvo started!')
 
@@ -35,7 +36,7 @@ class Daq(object):
         self.ao_task.stop() # uncomment while run
         self.voltages[4, :] = 0.0 # for test
         self.voltages[self.names_to_channels[wavelength], :] = 0.0 # option1-close one # uncomment while run
-        self.ao_task.write(self.voltages) # option1-close one # uncomment while run
+        self.ao_task.write(self.voltages[self.channels]) # option1-close one # uncomment while run
 
         self.ao_task.start() # uncomment while run
         print(str(wavelength) + ' galvo stopped!')
@@ -43,7 +44,7 @@ class Daq(object):
 
     def update(self):
         self.ao_task.stop() # uncomment while run
-        self.ao_task.write(self.voltages) # uncomment while run
+        self.ao_task.write(self.voltages[self.channels]) # uncomment while run
         self.ao_task.start() # uncomment while run
         print('Galvo updated!')
 
@@ -51,7 +52,7 @@ class Daq(object):
     def stop_all(self):
         self.ao_task.stop() # uncomment while run
 
-        zero_voltage_array = numpy.zeros((self.daq['num_channels'], 2)) # option2-close all # uncomment while run
+        zero_voltage_array = numpy.zeros((len(self.channels), 2)) # option2-close all # uncomment while run
         self.ao_task.write(zero_voltage_array) # option2-close all # uncomment while run
 
         self.ao_task.start() # uncomment while run
@@ -113,38 +114,9 @@ class Daq(object):
 
     def create_ao_channels(self):
         # Create ao channels
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao0') # uncomment while run
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao1')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao2')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao3')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao4')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao5')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao6')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao7')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao8')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao9')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao10')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao11')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao12')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao13')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao14')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao15')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao16')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao17')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao18')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao19')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao20')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao21')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao22')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao23')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao24')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao25')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao26')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao27')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao28')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao29')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao30')
-        self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao31')
+        # only the channels in names_to_channels, in the order of self.channels
+        for channel in self.channels:
+            self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + self.daq['board'] + '/ao' + str(channel)) # uncomment while run
 
         self.ao_task.timing.cfg_samp_clk_timing(rate = self.rate, sample_mode = constants.AcquisitionType.CONTINUOUS, samps_per_chan= self.samples)
 
@@ -0,0 +1,358 @@
+#!/usr/bin/python
+
+"""
+BigDataViewer HDF5 writing for LSM scans
+
+h5init and h5write were moved here from lsmfx.py so that the file layout
+and the writers live together (and can be used without the hardware
+libraries that lsmfx imports). lsmfx re-exports h5init. scan3D writes
+with H5Writer; h5write, which reopens the file for every block, is kept
+as the baseline of benchmarks/bench_h5_writer.py.
+
+"""
+import numpy as np
+import os.path
+import json
+import h5py
+import skimage.transform
+from pyramid import PyramidBuilder, to_output
+from compression import make_codec, codec_from_dataset, ChunkCompressor, ChunkStager
+
+
+def b3d_env_error(camera, experiment):
+    """
+    Return why the current conda environment cannot write the B3D
+    compressed channels of experiment, or None if it can (or no channel
+    is compressed).
+    """
+    if camera.B3Denv == '':
+        return None
+    if all(camera.quantSigma[wave] == 0 for wave in experiment.wavelengths):
+        return None
+    env = os.environ.get('CONDA_DEFAULT_ENV')
+    if env == camera.B3Denv:
+        return None
+    return ('B3D is active but the current conda environment is: ' +
+            str(env) + ' (run \'conda activate ' + camera.B3Denv + '\')')
+
+
+def h5init(dest, camera, scan, experiment, prompt=True):
+    """
+    Create data.h5 and declare its layout.
+
+    Only /t00000 and the layout (a JSON string in the 'layout' attribute of
+    the file) are written here, so startup does not depend on the number
+    of tiles. The groups and datasets of a setup are created by h5setup
+    when that setup is first written, so the setups of an aborted scan
+    that were never reached are missing from the file.
+
+    A conda environment other than camera.B3Denv is a question if
+    prompt, and an error otherwise (unattended runs, run_queue.py).
+    """
+
+    error = b3d_env_error(camera, experiment)
+    if error is not None:
+        if not prompt:
+            raise Exception(error)
+        print('Warning: ' + error)
+        print('Press CTRL + C to exit and run \'conda' +
+              ' activate ' + camera.B3Denv + '\' before ' +
+              'running lsm-python-main.py')
+        input('Press Enter to override this warning' +
+              ' and continue anyways')
+
+    f = h5py.File(dest, 'a')
+
+    res_list = [1, 2, 4, 8]
+
+    channels = []
+
+    for ch in range(scan.nWavelengths):
+
+        if camera.quantSigma[list(experiment.wavelengths)[ch]] == 0:
+
+            channels.append({})
+
+        else:
+            # B3D (filter 32016) unless camera.codec selects
+            # one of the stand-in codecs
+            codec = make_codec(camera, list(experiment.wavelengths)[ch])
+            kwargs = codec.dataset_kwargs()
+            if isinstance(kwargs['compression_opts'], tuple):
+                kwargs['compression_opts'] = list(kwargs['compression_opts'])
+            channels.append(kwargs)
+
+    layout = {'res_list': res_list,
+              'shape': [int(scan.nFrames), int(camera.Y), int(camera.X)],
+              'chunks': [int(scan.chunkSize1),
+                         int(scan.chunkSize2),
+                         int(scan.chunkSize3)],
+              'zTiles': int(scan.zTiles),
+              'yTiles': int(scan.yTiles),
+              'channels': channels,
+              # setups scanned in the reverse X direction, their frames
+              # are stored in acquisition order (last X position first)
+              'reversed': [int(idx) for idx in scan.reversed]}
+
+    f.attrs['layout'] = json.dumps(layout)
+
+    tgroup = f.create_group('/t00000')
+
+    f.close()
+
+
+def h5layout(f):
+    """
+    Return the layout declared by h5init, or None for files written by
+    an h5init that created every dataset up front.
+    """
+    if 'layout' not in f.attrs:
+        return None
+    return json.loads(f.attrs['layout'])
+
+
+def h5setup(f, idx, layout=None):
+    """
+    Create the groups and datasets of setup idx in the open file f, if
+    they do not exist yet. idx = tile + zTiles*yTiles*ch, as in h5init.
+    """
+    if '/t00000/s' + str(idx).zfill(2) in f:
+        return
+
+    if layout is None:
+        layout = h5layout(f)
+    if layout is None:
+        raise Exception('setup ' + str(idx) + ' is not in ' + f.filename)
+
+    res_list = layout['res_list']
+    ch = idx // (layout['zTiles']*layout['yTiles'])
+    kwargs = dict(layout['channels'][ch])
+    if isinstance(kwargs.get('compression_opts'), list):
+        kwargs['compression_opts'] = tuple(kwargs['compression_opts'])
+
+    res_np = np.zeros((len(res_list), 3), dtype='float64')
+
+    res_np[:, 0] = res_list
+    res_np[:, 1] = res_list
+    res_np[:, 2] = res_list
+
+    subdiv_np = np.zeros((len(res_list), 3), dtype='uint32')
+
+    subdiv_np[:, 0] = layout['chunks'][0]
+    subdiv_np[:, 1] = layout['chunks'][1]
+    subdiv_np[:, 2] = layout['chunks'][2]
+
+    sgroup = f.require_group('/s' + str(idx).zfill(2))
+    # +1: frame 0 at the start of X, -1: frame 0 at the end of X
+    sgroup.attrs['scan_direction'] = \
+        -1 if idx in layout.get('reversed', []) else 1
+    resolutions = f.require_dataset('/s' + str(idx).zfill(2) + '/resolutions',
+                                    chunks=(res_np.shape),
+                                    dtype='float64',
+                                    shape=(res_np.shape),
+                                    data=res_np)
+
+    subdivisions = f.require_dataset('/s' + str(idx).zfill(2) + '/subdivisions',
+                                     chunks=(res_np.shape),
+                                     dtype='uint32',
+                                     shape=(subdiv_np.shape),
+                                     data=subdiv_np)
+
+    for z in range(len(res_list)-1, -1, -1):
+
+        res = res_list[z]
+
+        resgroup = f.create_group('/t00000/s' + str(idx).zfill(2) + '/' + str(z))
+
+        data = f.require_dataset('/t00000/s' + str(idx).zfill(2) + '/' + str(z) + '/cells',
+                                 chunks=tuple(layout['chunks']),
+                                 dtype='int16',
+                                 shape=np.ceil(np.divide(layout['shape'],
+                                                         res)),
+                                 **kwargs)
+
+
+def h5write(dest, img_3d, idx, ind1, ind2):
+
+    f = h5py.File(dest, 'a')
+
+    h5setup(f, idx)
+
+    res_list = [1, 2, 4, 8]
+
+    for z in range(len(res_list)):
+        res = res_list[z]
+        if res > 1:
+            img_3d = skimage.transform.downscale_local_mean(img_3d,
+                                                            (2, 2, 2)
+                                                            ).astype('uint16')
+
+        if ind1 == 0:
+            ind1_r = ind1
+        else:
+            ind1_r = np.ceil((ind1 + 1)/res - 1)
+
+        data = f['/t00000/s' + str(idx).zfill(2) + '/' + str(z) + '/cells']
+        data[int(ind1_r):int(ind1_r+img_3d.shape[0])] = img_3d.astype('int16')
+
+    f.close()
+
+
+class H5Writer(object):
+    """
+    Long-lived writer for data.h5.
+
+    h5write opens and closes the file for every block, which on a large
+    run means thousands of open/close cycles and metadata flushes. This
+    object opens the file once (after h5init has created it), caches the
+    /t00000/sNN/<level>/cells dataset handles and closes the file when
+    the scan ends or fails. Usable as a context manager.
+
+    The resolution levels are built with pyramid.PyramidBuilder instead of
+    repeated skimage downscaling, so they stay exact when a block is not a
+    multiple of 8 frames.
+
+    With compression_workers > 0, compressed datasets are written whole
+    chunk by whole chunk: the chunks are compressed in a pool of worker
+    processes (compression.ChunkCompressor) and stored with
+    write_direct_chunk instead of going through the HDF5 filter pipeline
+    in this thread.
+
+    Parameters
+    ----------
+
+    dest
+        path to data.h5, already initialized by h5init
+
+    compression_workers
+        number of compression processes, 0 to use the HDF5 filter pipeline
+    """
+
+    res_list = [1, 2, 4, 8]
+
+    def __init__(self, dest, compression_workers=0):
+        self.dest = dest
+        self.f = h5py.File(dest, 'a')
+        self.layout = h5layout(self.f)
+        self.datasets = {}
+        self.pyramids = {}
+        self.stagers = {}
+        self.compressor = None
+        if compression_workers:
+            self.compressor = ChunkCompressor(compression_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def setup(self, idx):
+        """
+        Create the datasets of setup idx (see h5setup). Done on demand
+        the first time a dataset of the setup is used.
+        """
+        h5setup(self.f, idx, self.layout)
+
+    def dataset(self, idx, z):
+        """
+        Return the (cached) cells dataset of setup idx at level z.
+        """
+        key = (idx, z)
+        if key not in self.datasets:
+            self.setup(idx)
+            self.datasets[key] = self.f['/t00000/s' + str(idx).zfill(2) +
+                                        '/' + str(z) + '/cells']
+        return self.datasets[key]
+
+    def write(self, img_3d, idx, ind1, ind2):
+        """
+        Write frames ind1 - ind2 of setup idx at all resolution levels.
+        Same arguments as h5write.
+
+        The lower levels come from a PyramidBuilder per setup, which
+        carries unpaired frames over to the next block, so blocks of a
+        setup must arrive in order. The carried frames are flushed when
+        the last frame of the setup is written (or on close).
+        """
+        pyramid = self.pyramids.get(idx)
+        if pyramid is None or pyramid.next[0] != ind1:
+            self.finish(idx)
+            pyramid = PyramidBuilder(len(self.res_list), start=ind1)
+            self.pyramids[idx] = pyramid
+
+        self._write_pieces(idx, pyramid.push(img_3d))
+
+        if ind2 >= self.dataset(idx, 0).shape[0]:
+            self.finish(idx)
+
+    def finish(self, idx):
+        """
+        Flush the frames carried by the pyramid of setup idx.
+        """
+        pyramid = self.pyramids.pop(idx, None)
+        if pyramid is not None:
+            self._write_pieces(idx, pyramid.finish())
+        for z in range(len(self.res_list)):
+            stager = self.stagers.get((idx, z))
+            if stager is not None:
+                stager.flush()
+
+    def stager(self, idx, z):
+        """
+        Return the ChunkStager of setup idx at level z, or None if the
+        dataset is written through the filter pipeline.
+        """
+        if self.compressor is None:
+            return None
+        key = (idx, z)
+        if key not in self.stagers:
+            data = self.dataset(idx, z)
+            codec = codec_from_dataset(data)
+            if codec is None:
+                self.stagers[key] = None
+            else:
+                self.stagers[key] = ChunkStager(data, codec, self.compressor)
+        return self.stagers[key]
+
+    def _write_pieces(self, idx, pieces):
+        for z, ind1_r, img_3d in pieces:
+            stager = self.stager(idx, z)
+            if stager is None:
+                data = self.dataset(idx, z)
+                data[ind1_r:ind1_r + img_3d.shape[0]] = to_output(img_3d)
+            else:
+                stager.write(ind1_r, to_output(img_3d))
+
+    def annotate(self, idx, attrs):
+        """
+        Store attrs (e.g. the frame accounting of camera_loop.FrameStats)
+        as frames_<name> attributes of group /sNN of setup idx.
+        """
+        self.setup(idx)
+        sgroup = self.f['/s' + str(idx).zfill(2)]
+        for name in attrs:
+            sgroup.attrs['frames_' + name] = attrs[name]
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        """
+        Close the file. Safe to call more than once.
+        """
+        if self.f is not None:
+            try:
+                for idx in set(self.pyramids) | set(i for i, z in self.stagers):
+                    self.finish(idx)
+                if self.compressor is not None:
+                    self.compressor.flush()
+            finally:
+                if self.compressor is not None:
+                    self.compressor.close()
+                    self.compressor = None
+                self.stagers = {}
+                self.pyramids = {}
+                self.datasets = {}
+                self.f.close()
+                self.f = None
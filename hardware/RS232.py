@@ -6,7 +6,9 @@ Adam Glaser 07/19
 
 """
 
+import re
 import serial
+import threading
 import time
 
 class RS232(object):
@@ -22,6 +24,9 @@ class RS232(object):
                  port = None,
                  timeout = 1.0e-3,
                  wait_time = 1.0e-2,
+                 tty = None,
+                 terminator = None,
+                 response_timeout = 1.0,
                  **kwds):
         """
         port - The port for RS-232 communication, e.g. "COM4".
@@ -30,11 +35,42 @@ class RS232(object):
         end_of_line - What character(s) are used to indicate the end of a line.
         wait_time - How long to wait between polling events before it is decided 
                     that there is no new data available on the port. 
+        tty - An already open serial.Serial like object to use instead of
+              opening port (e.g. a hardware.simulated device).
+        terminator - What character(s) end a response of the device. If set,
+                     responses are read until the terminator arrives instead
+                     of sleeping a fixed time after each command.
+        response_timeout - How long (in seconds) to wait for the terminator,
+                           the read timeout of the port if terminator is set.
         """
         super().__init__(**kwds)
         self.encoding = encoding
         self.end_of_line = end_of_line
         self.wait_time = wait_time
+        self.terminator = terminator
+        self.response_timeout = response_timeout
+        # per command latency statistics, see getLatencyStats
+        self.last_command = None
+        self.last_command_time = None
+        self.last_send_time = None
+        self.latency_stats = {}
+        self.timeouts = 0
+        self.discarded = 0  # commands sent with a stale response pending
+        # last acknowledged value of each setting, see cachedCommand
+        self.cache = {}
+        self.skipped = 0
+        self.skipped_total = 0
+        # one command / response exchange at a time per port
+        self.lock = threading.RLock()
+        # with a terminator, reads block until it arrives: set the port
+        # read timeout once here, changing it reconfigures the port
+        if terminator is not None:
+            timeout = response_timeout
+        if tty is not None:
+            self.tty = tty
+            if terminator is not None:
+                self.tty.timeout = timeout
+            return
         try:
             self.tty = serial.Serial(port, baudrate, timeout = timeout)
             self.tty.flush()
@@ -47,17 +83,140 @@ class RS232(object):
         """
         Send a command and wait (a little) for a response.
         """
-        self.sendCommand(command)
-        time.sleep(10 * self.wait_time)
-        response = ""
-        response_len = self.tty.inWaiting()
-        while response_len:
-            response += self.read(response_len)
-            time.sleep(self.wait_time)
+        with self.lock:
+            self.sendCommand(command)
+            if self.terminator is not None:
+                return self.readResponse()
+            time.sleep(10 * self.wait_time)
+            response = ""
             response_len = self.tty.inWaiting()
+            while response_len:
+                response += self.read(response_len)
+                time.sleep(self.wait_time)
+                response_len = self.tty.inWaiting()
+            self.recordLatency()
+            if len(response) > 0:
+                return response
+
+    def readResponse(self, terminator = None, timeout = None):
+        """
+        Read until terminator (default: the device terminator) arrives and
+        return the response, or whatever arrived (None if nothing) once
+        timeout seconds (default: response_timeout, the port read
+        timeout) have passed.
+        """
+        if terminator is None:
+            terminator = self.terminator
+        expected = terminator.encode(self.encoding)
+        if timeout is None or timeout == self.response_timeout:
+            response = self.tty.read_until(expected)
+        else:
+            # poll until the deadline rather than changing the port timeout
+            response = b""
+            deadline = time.perf_counter() + timeout
+            while not response.endswith(expected):
+                response_len = self.tty.inWaiting()
+                if response_len:
+                    response += self.tty.read(response_len)
+                elif time.perf_counter() < deadline:
+                    time.sleep(0.1 * self.wait_time)
+                else:
+                    break
+        response = response.decode(self.encoding)
+        if not response.endswith(terminator):
+            self.timeouts += 1
+            # the device may have missed any command, not just this one
+            self.invalidateCache()
+            print("RS232 timeout waiting for response to:", self.last_command)
+        self.recordLatency()
         if len(response) > 0:
             return response
 
+    def recordLatency(self):
+        """
+        Add the time since the last command was sent to the statistics of
+        that command (keyed by its first word, e.g. "M", "S", "pos").
+        """
+        if self.last_command_time is None:
+            return
+        latency = time.perf_counter() - self.last_command_time
+        key = re.split("[ =]", self.last_command.strip(), 1)[0]
+        count, total, worst = self.latency_stats.get(key, (0, 0.0, 0.0))
+        self.latency_stats[key] = (count + 1, total + latency,
+                                   max(worst, latency))
+        self.last_command_time = None
+
+    def getLatencyStats(self):
+        """
+        Return {command: (count, total seconds, max seconds)}.
+        """
+        return dict(self.latency_stats)
+
+    def resetLatencyStats(self):
+        self.latency_stats = {}
+        self.timeouts = 0
+        self.discarded = 0
+        self.skipped = 0
+
+    def printLatencyStats(self, name = None, details = False):
+        """
+        Print the number of commands and the time spent waiting for
+        responses (one line, or one line per command with details).
+        """
+        if name is None:
+            name = type(self).__name__
+        count = sum(c for c, t, m in self.latency_stats.values())
+        total = sum(t for c, t, m in self.latency_stats.values())
+        print(name + ": " + str(count) + " commands, " +
+              str(round(total, 3)) + " s waiting for responses" +
+              (", " + str(self.skipped) + " skipped (cached)" if self.skipped else "") +
+              (", " + str(self.timeouts) + " timeouts" if self.timeouts else "") +
+              (", " + str(self.discarded) + " stale responses discarded" if self.discarded else ""))
+        if details:
+            for key in sorted(self.latency_stats):
+                c, t, m = self.latency_stats[key]
+                print("    %-8s %5d x %7.1f ms (max %7.1f ms)" %
+                      (key, c, 1000.0 * t / c, 1000.0 * m))
+
+    def cachedCommand(self, key, value, command, wait = False):
+        """
+        Send command, which sets key to value, unless the device already
+        acknowledged that value. The value is remembered only if the
+        device answered (in time), so a failed command is sent again.
+        With wait, use sendCommand + waitResponse instead of commWithResp.
+        """
+        if key in self.cache and self.cache[key] == value:
+            self.skipped += 1
+            self.skipped_total += 1
+            return None
+        self.cache.pop(key, None)
+        timeouts = self.timeouts
+        if wait:
+            with self.lock:
+                self.sendCommand(command)
+                response = self.waitResponse()
+        else:
+            response = self.commWithResp(command)
+        if self.isAcknowledged(response) and self.timeouts == timeouts:
+            self.cache[key] = value
+        return response
+
+    def isAcknowledged(self, response):
+        """
+        True if response acknowledges a setting (any answer by default).
+        """
+        return bool(response)
+
+    def invalidateCache(self, key = None):
+        """
+        Forget the cached value of key (all settings if None), e.g. after
+        an error or a power cycle of the device.
+        """
+        if key is None:
+            self.cache = {}
+        else:
+            self.cache.pop(key, None)
+
     def getResponse(self):
         """
         Wait (a little) for a response.
@@ -80,8 +239,17 @@ class RS232(object):
         return response.decode(self.encoding).strip()
         
     def sendCommand(self, command):
-        self.tty.flush()
-        self.write(command + self.end_of_line)
+        with self.lock:
+            # a response that arrived after its timeout would otherwise
+            # be read as the response to this command
+            if self.tty.inWaiting():
+                self.tty.reset_input_buffer()
+                self.discarded += 1
+            self.tty.flush()
+            self.write(command + self.end_of_line)
+            self.last_command = command
+            self.last_command_time = time.perf_counter()
+            self.last_send_time = self.last_command_time
 
     def shutDown(self):
         """
@@ -94,9 +262,12 @@ class RS232(object):
         Waits much longer for a response. This is the method to use if
         you are sure that the hardware will respond eventually. If you
         don't set end_of_response then it will automatically be the
-        end_of_line character, and this will return once it finds the
-        first end_of_line character.
+        device terminator (or the end_of_line character if the device has
+        none), and this will return once it finds the first one.
         """
+        if self.terminator is not None:
+            return self.readResponse(end_of_response or None,
+                                     max_attempts * self.wait_time)
         if not end_of_response:
             end_of_response = str(self.end_of_line)
         attempts = 0
@@ -109,6 +280,7 @@ class RS232(object):
             time.sleep(self.wait_time)
             index = response.find(end_of_response)
             attempts += 1
+        self.recordLatency()
         return response
 
     def write(self, string):
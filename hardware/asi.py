@@ -0,0 +1,193 @@
+#!/usr/bin/python
+#
+## @file
+"""
+Motion bookkeeping shared by the ASI Tiger and MS2000 stage classes.
+
+The stage knows the velocities, accelerations and targets it has been
+sent, so it can predict when a move will end. waitUntilIdle sleeps
+until close to that time and only then polls the controller, instead
+of spinning on the serial line.
+
+"""
+import time
+import hardware.RS232 as RS232
+
+## ASIStage
+#
+# Base class of TIGER and MS2000.
+#
+class ASIStage(RS232.RS232):
+
+    # polling interval bounds (s) once the predicted end is near or passed
+    min_poll = 2.0e-3
+    max_poll = 50.0e-3
+
+    def __init__(self, **kwds):
+        self.axis_velocity = {}      # mm/s, as last set
+        self.axis_acceleration = {}  # ms, as last set
+        self.axis_target = {}        # mm, last commanded position
+        self.axis_idle_time = {}     # predicted perf_counter() time the move ends
+        self.scan_range = None       # (start, stop) in mm, from setScanR
+        self.last_settle_time = 0.0
+        self.settle_stats = [0, 0.0, 0]  # waits, seconds, polls
+        super().__init__(**kwds)
+
+    ## predictMove
+    #
+    # Note a move of axis to target (mm) and predict when it ends.
+    #
+    # @param axis - X, Y, or Z.
+    # @param target. New position in mm.
+    # @param start. Position the move starts from, None if it is the last
+    #        target.
+    #
+    def predictMove(self, axis, target, start=None):
+        # the move started when its command was sent
+        now = self.last_send_time or time.perf_counter()
+        if start is None:
+            start = self.axis_target.get(axis)
+        velocity = self.axis_velocity.get(axis)
+        self.axis_target[axis] = target
+        if start is None or not velocity:
+            # unknown, poll from now on
+            self.axis_idle_time[axis] = now
+            return
+        duration = abs(target - start)/velocity
+        if duration > 0:
+            duration += self.axis_acceleration.get(axis, 0.0)/1000.0
+        self.axis_idle_time[axis] = \
+            max(now, self.axis_idle_time.get(axis, now)) + duration
+
+    ## predictScan
+    #
+    # Note a scan of X over the range set with setScanR.
+    #
+    def predictScan(self):
+        if self.scan_range is None:
+            self.axis_idle_time['X'] = time.perf_counter()
+            return
+        start, stop = self.scan_range
+        self.predictMove('X', stop, start)
+
+    ## axisValues
+    #
+    # @param values. {axis: value}
+    # @return "X=.. Y=.." for one multi-axis command.
+    #
+    def axisValues(self, values):
+        return " ".join(ax + "=" + str(values[ax]) for ax in values)
+
+    ## cachedAxisCommand
+    #
+    # Send name with the values of the axes whose cached value differs,
+    # nothing if none does (see RS232.cachedCommand).
+    #
+    # @param name. Command, e.g. "S".
+    # @param values. {axis: value}
+    #
+    def cachedAxisCommand(self, name, values):
+        changed = {ax: values[ax] for ax in values
+                   if self.cache.get((name, ax), None) != values[ax]
+                   or (name, ax) not in self.cache}
+        if not changed:
+            self.skipped += 1
+            self.skipped_total += 1
+            return None
+        for ax in changed:
+            self.cache.pop((name, ax), None)
+        timeouts = self.timeouts
+        response = self.commWithResp(name + " " + self.axisValues(changed))
+        if self.isAcknowledged(response) and self.timeouts == timeouts:
+            for ax in changed:
+                self.cache[(name, ax)] = changed[ax]
+        return response
+
+    ## isAcknowledged
+    #
+    # The controller answers :A to a valid command, :N-.. to an error.
+    #
+    def isAcknowledged(self, response):
+        return response is not None and response.startswith(":A")
+
+    ## setBacklashes
+    #
+    # @param backlashes. {axis: 0 (off) or 1 (on)}, one command.
+    #
+    def setBacklashes(self, backlashes):
+        self.cachedAxisCommand("B", backlashes)
+
+    ## setAccelerations
+    #
+    # @param accels. {axis: time (ms) to reach velocity}, one command.
+    #
+    def setAccelerations(self, accels):
+        self.cachedAxisCommand("AC", accels)
+        self.axis_acceleration.update(accels)
+
+    ## setVelocities
+    #
+    # @param vels. {axis: maximum velocity (mm/s)}, one command.
+    #
+    def setVelocities(self, vels):
+        vels = {ax: round(vels[ax], 5) for ax in vels}
+        self.cachedAxisCommand("S", vels)
+        self.axis_velocity.update(vels)
+
+    ## waitUntilIdle
+    #
+    # Wait until the stage reports that no axis is moving.
+    #
+    # Sleeps through most of the predicted move time, then polls with an
+    # interval that halves towards the predicted end and doubles after
+    # it. The port is free between polls, so other threads can use it.
+    #
+    # @param axes. Axes whose moves are waited for (used for the
+    #        prediction, the controller reports all axes together).
+    # @param timeout. Seconds to wait past the predicted end before
+    #        giving up.
+    # @return seconds spent waiting.
+    #
+    def waitUntilIdle(self, axes=('X', 'Y', 'Z'), timeout=30.0):
+        start = time.perf_counter()
+        idle_time = max([self.axis_idle_time.get(ax, start) for ax in axes])
+        deadline = max(start, idle_time) + timeout
+        polls = 0
+        interval = self.min_poll
+        while True:
+            now = time.perf_counter()
+            remaining = idle_time - now
+            if remaining > self.min_poll:
+                # wake at the predicted end, or halfway for long moves
+                time.sleep(remaining if remaining < self.max_poll
+                           else remaining/2.0)
+                continue
+            response = self.getMotorStatus()
+            polls += 1
+            if response is not None and response.strip()[:1] == 'N':
+                break
+            if time.perf_counter() > deadline:
+                raise Exception('Stage still moving ' + str(timeout) +
+                                ' s after the predicted end of the move!')
+            time.sleep(interval)
+            interval = min(2*interval, self.max_poll)
+        self.last_settle_time = time.perf_counter() - start
+        self.settle_stats[0] += 1
+        self.settle_stats[1] += self.last_settle_time
+        self.settle_stats[2] += polls
+        # nothing is moving any more
+        for ax in self.axis_idle_time:
+            self.axis_idle_time[ax] = time.perf_counter()
+        return self.last_settle_time
+
+    def resetLatencyStats(self):
+        super().resetLatencyStats()
+        self.settle_stats = [0, 0.0, 0]
+
+    def printLatencyStats(self, name=None, details=False):
+        super().printLatencyStats(name, details)
+        waits, seconds, polls = self.settle_stats
+        if waits:
+            print("    waited " + str(round(seconds, 3)) + " s for " +
+                  str(waits) + " moves to settle (" + str(polls) +
+                  " status polls)")
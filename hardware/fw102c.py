@@ -12,6 +12,9 @@ class FW102C(RS232.RS232):
     Encapsulates communication with a Thorlabs filter wheel that is connected via RS-232.
     """
     def __init__(self, **kwds):
+        # responses end with the > prompt
+        kwds.setdefault('terminator', '>')
+
         try:
             # open port
             super().__init__(**kwds)
@@ -46,8 +49,7 @@ class FW102C(RS232.RS232):
         """
         Set the filter position.
         """
-        self.sendCommand("pos=" + str(position))
-        self.waitResponse()
+        self.cachedCommand("pos", position, "pos=" + str(position), wait=True)
 
     def setSensorMode(self, on):
         if on:
@@ -9,14 +9,14 @@ Adam Glaser 07/19
 
 """
 import sys 
-import hardware.RS232 as RS232
+import hardware.asi as asi
 import time
 
 ## MS2000
 #
 # Applied Scientific Instrumentation MS2000 RS232 interface class.
 #
-class MS2000(RS232.RS232):
+class MS2000(asi.ASIStage):
 
     ## __init__
     #
@@ -33,6 +33,9 @@ class MS2000(RS232.RS232):
         self.y = 0.0
         self.z = 0.0
 
+        # responses end with \r\n
+        kwds.setdefault('terminator', '\r\n')
+
         try:
             # open port
             super().__init__(**kwds)
@@ -68,10 +71,21 @@ class MS2000(RS232.RS232):
         p = pos * self.um_to_unit
         p = round(p)
         self.commWithResp("M " + axis + "=" + str(p))
+        self.predictMove(axis, p*self.unit_to_um)
+        if bwait == True:
+            self.waitUntilIdle((axis,))
+
+    ## goAbsoluteAxes
+    #
+    # @param positions. {axis: position}, moved with one command.
+    #
+    def goAbsoluteAxes(self, positions, bwait):
+        p = {ax: round(positions[ax] * self.um_to_unit) for ax in positions}
+        self.commWithResp("M " + self.axisValues(p))
+        for ax in p:
+            self.predictMove(ax, p[ax]*self.unit_to_um)
         if bwait == True:
-            response = self.getMotorStatus()
-            while response[0] == 'B':
-                response = self.getMotorStatus()
+            self.waitUntilIdle(tuple(p))
 
     ## goRelative
     #
@@ -82,10 +96,13 @@ class MS2000(RS232.RS232):
         p = pos * self.um_to_unit
         p = round(p)
         self.commWithResp("R " + axis + "=" + str(p))
+        target = self.axis_target.get(axis)
+        if target is None:
+            self.predictMove(axis, 0.0)
+        else:
+            self.predictMove(axis, target + p*self.unit_to_um)
         if bwait == True:
-            response = self.getMotorStatus()
-            while response[0] == 'B':
-                response = self.getMotorStatus()
+            self.waitUntilIdle((axis,))
 
     ## getPosition
     #
@@ -97,6 +114,7 @@ class MS2000(RS232.RS232):
             self.x = float(self.x)*self.unit_to_um # convert to mm
             self.y = float(self.y)*self.unit_to_um # convert to mm
             self.z = float(self.z)*self.unit_to_um # convert to mm
+            self.axis_target.update({'X': self.x, 'Y': self.y, 'Z': self.z})
         except:
             print("Stage Error")
             raise Exception('Stage Error - restart code')
@@ -107,7 +125,7 @@ class MS2000(RS232.RS232):
     # @param backlash. 0 (off) or 1 (on)
     #
     def setBacklash(self, axis, backlash):
-        self.commWithResp("B " + axis + "=" + str(backlash))
+        self.cachedAxisCommand("B", {axis: backlash})
 
     ## scan
     #
@@ -115,17 +133,16 @@ class MS2000(RS232.RS232):
     #
     def scan(self,bwait):
         self.commWithResp("SCAN")
+        self.predictScan()
         if bwait == True:
-            response = self.getMotorStatus()
-            while response[0] == 'B':
-                response = self.getMotorStatus()
+            self.waitUntilIdle(('X',))
 
     ## setScanF
     #
     # @param f. 0 - RASTER, 1 - SERPENTINE
     #
     def setScanF(self, x):
-        self.commWithResp("SCAN F=" + str(x))
+        self.cachedCommand("SCAN F", x, "SCAN F=" + str(x))
 
     ## setScanR
     #
@@ -136,7 +153,8 @@ class MS2000(RS232.RS232):
     def setScanR(self, x, y):
         x = round(x,3)
         y = round(y,3)
-        self.commWithResp("SCANR X=" + str(x) + " Y=" + str(y))
+        self.cachedCommand("SCANR", (x, y), "SCANR X=" + str(x) + " Y=" + str(y))
+        self.scan_range = (x, y)
 
     ## setScanV
     #
@@ -147,7 +165,7 @@ class MS2000(RS232.RS232):
     #
     def setScanV(self, x):
         x = round(x,3)
-        self.commWithResp("SCANV X=" + str(x) + "Y=" + str(x) + " Z=1 F=2")
+        self.cachedCommand("SCANV", x, "SCANV X=" + str(x) + "Y=" + str(x) + " Z=1 F=2")
 
     ## setTTL
     #
@@ -155,7 +173,7 @@ class MS2000(RS232.RS232):
     # @param TTL. 0 (on) or 1 (off)
     #
     def setTTL(self, axis, ttl):
-        self.commWithResp("TTL " + axis + "=" + str(ttl))
+        self.cachedCommand(("TTL", axis), ttl, "TTL " + axis + "=" + str(ttl))
 
     ## setAcceleration
     #
@@ -163,7 +181,8 @@ class MS2000(RS232.RS232):
     # @param accel time (ms) to reach velocity.
     #
     def setAcceleration(self, axis, accel):
-        self.commWithResp("AC " + axis + "=" + str(accel))
+        self.cachedAxisCommand("AC", {axis: accel})
+        self.axis_acceleration[axis] = accel
 
     ## setVelocity
     #
@@ -172,7 +191,8 @@ class MS2000(RS232.RS232):
     #
     def setVelocity(self, axis, vel):
         vel = round(vel,5)
-        self.commWithResp("S " + axis + "=" + str(vel))
+        self.cachedAxisCommand("S", {axis: vel})
+        self.axis_velocity[axis] = vel
 
     ## zero
     #
@@ -180,6 +200,7 @@ class MS2000(RS232.RS232):
     #
     def zero(self):
         self.commWithResp("Z")
+        self.axis_target = {'X': 0.0, 'Y': 0.0, 'Z': 0.0}
 
 #
 # The MIT License
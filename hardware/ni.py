@@ -15,69 +15,43 @@ import math
 import numpy
 import matplotlib.pyplot as plt
 from scipy import signal
+from interleave import pattern_samples
 
 class waveformGenerator(object):
 
 	def __init__(self, daq, camera, session, triggered = True):
 
-		self.samples = int(session.nFrames*daq.rate*camera.expTime/1000) #int(daq.rate*camera.expTime) # number of samples for DAQ
-
 		self.ao_task = nidaqmx.Task("ao0")
 
-		'''		
-		# new stuff
-		omit=[5,7]
-		all_chans = [i for i in range(32)]
-		use_chans = list(set(all_chans) - set(omit))
-		use_chans = [str(x) for x in use_chans]''
-
-		for j in use_chans:
-			self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao' + j)
+		# only the AO channels in daq.names_to_channels (daq.channels), in
+		# that order: the voltages of write_voltages are daq.num_channels
+		# rows, prepare() picks the rows of the task
+		self.channels = daq.channels
+		for c in self.channels:
+			self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao' + str(c))
 
-		'''
-		#OLD VERSION
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao0')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao1')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao2')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao3')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao4')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao5')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao6')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao7')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao8')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao9')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao10')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao11')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao12')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao13')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao14')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao15')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao16')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao17')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao18')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao19')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao20')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao21')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao22')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao23')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao24')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao25')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao26')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao27')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao28')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao29')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao30')
-		self.ao_task.ao_channels.add_ao_voltage_chan(physical_channel = '/' + daq.board + '/ao31')
+		self.set_samples(daq, camera, session)
 
-		## rate (float) – Specifies the sampling rate in samples per channel per second. If you use an external source for the Sample Clock, set this input to the maximum expected rate of that clock.
-		self.ao_task.timing.cfg_samp_clk_timing(rate = daq.rate, active_edge = nidaqmx.constants.Edge.RISING, sample_mode = nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan = self.samples)
-		
 		if triggered:
 			self.ao_task.triggers.start_trigger.retriggerable = True
 			self.ao_task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source = '/' + daq.board + '/PFI0', trigger_edge = nidaqmx.constants.Slope.RISING)
 		else:
 			self.ao_task.triggers.start_trigger.disable_start_trig()
 
+		# int16: raw DAC codes written with an unscaled writer, converted
+		# with the calibration polynomial of each channel
+		self.dtype = daq.dtype
+		if self.dtype == 'int16':
+			self.writer = stream_writers.AnalogUnscaledWriter(self.ao_task.out_stream, auto_start = False)
+			self.coeffs = [chan.ao_dev_scaling_coeff for chan in self.ao_task.ao_channels]
+		elif self.dtype != 'float64':
+			raise Exception('invalid daq dtype!')
+
+		# counters
+		self.writes = 0
+		self.bytes_written = 0
+		self.write_time = 0.0
+
 		'''
 		self.counter_task = nidaqmx.Task("counter0")
 		self.counter_loop = self.counter_task.ci_channels.add_ci_count_edges_chan('/' + daq.board + '/ctr0', edge = nidaqmx.constants.Edge.RISING)
@@ -90,6 +64,50 @@ class waveformGenerator(object):
 		# plt.show()
 
 
+	# Function sets the number of samples of the task for the scan length
+	# of session, e.g. for the next well (the task stays open).
+	# Interleaved: one pattern of nChannels frames per trigger, the next
+	# trigger restarts it at channel 0 (see interleave.py).
+
+	def set_samples(self, daq, camera, session):
+		if session.interleaved:
+			self.samples = pattern_samples(daq, camera, session.nChannels)
+		else:
+			self.samples = int(session.nFrames*daq.rate*camera.expTime/1000) #int(daq.rate*camera.expTime) # number of samples for DAQ
+
+		## rate (float) – Specifies the sampling rate in samples per channel per second. If you use an external source for the Sample Clock, set this input to the maximum expected rate of that clock.
+		self.ao_task.timing.cfg_samp_clk_timing(rate = daq.rate, active_edge = nidaqmx.constants.Edge.RISING, sample_mode = nidaqmx.constants.AcquisitionType.FINITE, samps_per_chan = self.samples)
+
+	# Function returns the data for write() from voltages, a
+	# (daq.num_channels, samples) array in volts: the rows of the task
+	# channels, converted to raw DAC codes if daq.dtype is int16.
+	# It is computed once per waveform (see waveform_cache.py).
+
+	def prepare(self, voltages):
+		voltages = voltages[self.channels]
+		if self.dtype == 'int16':
+			codes = numpy.empty(voltages.shape, dtype = numpy.int16)
+			for i in range(len(self.channels)):
+				codes[i] = numpy.clip(numpy.rint(numpy.polynomial.polynomial.polyval(voltages[i], self.coeffs[i])), -32768, 32767)
+			return codes
+		return numpy.ascontiguousarray(voltages, dtype = numpy.float64)
+
+	# Function writes data from prepare() to the task
+
+	def write(self, data):
+		start = time.perf_counter()
+		if data.dtype == numpy.int16:
+			self.writer.write_int16(data)
+		else:
+			self.ao_task.write(data)
+		self.write_time += time.perf_counter() - start
+		self.writes += 1
+		self.bytes_written += data.nbytes
+
+	def print_stats(self):
+		if self.writes:
+			print('DAQ: ' + str(len(self.channels)) + ' AO channels, ' + self.dtype + ', ' + str(round(self.bytes_written/self.writes/1e3, 1)) + ' kB and ' + str(round(self.write_time/self.writes*1e3, 2)) + ' ms per write (' + str(self.writes) + ' writes)')
+
 	# Function writes zeros to all active channels of the NIDAQ
 	# It disables triggering functions above, writes zeros, then renables them
 	# This causes the code to crash if used at the start of the imaging loop (maybe it must be used after a normal write?)
@@ -100,7 +118,7 @@ class waveformGenerator(object):
   	# 	error_buffer.value.decode("utf-8"), error_code))
 
 	def write_zeros(self, daq):
-		zero_voltage_array = numpy.zeros((daq.num_channels, 2)) # create zero voltages array
+		zero_voltage_array = numpy.zeros((len(self.channels), 2)) # create zero voltages array
 		self.ao_task.triggers.start_trigger.retriggerable = False
 		self.ao_task.triggers.start_trigger.disable_start_trig()
 		self.ao_task.write(zero_voltage_array)
@@ -13,6 +13,9 @@ class Opto(object):
         self.ser = None
         self._current = None
         self._current_max = 292.84
+        # last value written with mode() / current(), see invalidate_cache
+        self._cache = {}
+        self.skipped = 0
 
     def __enter__(self):
         self.connect()
@@ -25,6 +28,7 @@ class Opto(object):
         """
         Open the serial port and connect
         """
+        self.invalidate_cache()
         self.ser = serial.Serial()
         self.ser.baudrate = 115200
         self.ser.port = self.port
@@ -37,6 +41,13 @@ class Opto(object):
             self.ser.close()
             raise
 
+    def invalidate_cache(self):
+        """
+        Forget the cached mode and current, e.g. after an error, so the
+        next mode() / current() call is sent to the lens again.
+        """
+        self._cache = {}
+
     def close(self, soft_close=None):
         """
         Close the serial port
@@ -269,11 +280,14 @@ class Opto(object):
             r = self._send_cmd(b'Ar\x00\x00')
             self._current = (int.from_bytes(r[1:], byteorder='big',
                              signed=True) * self._current_max/4095)
+        elif self._cache.get('current') == value:
+            self.skipped += 1
         else:
             data = int(value*4095/self._current_max)
             data = data.to_bytes(2, byteorder='big', signed=True)
             r = self._send_cmd(b'Aw'+data, wait_for_resp=False)
             self._current = value
+            self._cache['current'] = value
         return self._current
 
     def siggen_upper(self, value=None):
@@ -512,7 +526,10 @@ class Opto(object):
                      7: 'position'}
             r = self._send_cmd(b'MMA')
             self._mode = modes[r[3]]
+        elif self._cache.get('mode') == mode_str:
+            self.skipped += 1
         else:
+            self._cache.pop('mode', None)
             if mode_str == 'sinusoidal':        # ID #0301
                 self._send_cmd(b'MwSA')
             elif mode_str == 'rectangular':     # ID #0302
@@ -528,4 +545,5 @@ class Opto(object):
             else:
                 raise(ValueError('{}'.format(mode_str)))
             self._mode = mode_str
+            self._cache['mode'] = mode_str
         return self._mode
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+pco.edge camera adapter for the scan3D frame loop.
+
+scan3D used to read out (1, 1023-Y/2, 2060, 1026+Y/2) and crop every
+frame to [2:Y+2, 1024-X/2:1024-X/2+X] before copying it into the ring
+buffer. The adapter sets the ROI to exactly that region, so the camera
+delivers Y x X frames, and can fetch all frames that are ready in one
+call. If the camera rejects the exact ROI the old readout + crop is used.
+
+With the pco package, frames are copied by PCO_RecorderCopyImage straight
+into the caller's ring buffer row (cropped by the recorder in the legacy
+case): pco.Camera.image / images() allocate a new array per frame, and
+the recorder has no call that copies several frames at once, so a batch
+is one recorder copy per frame. The simulated camera (and a pco package
+without the recorder library handle) goes through image() and a copy.
+
+Every frame read returns its image number, so the frame loop can tell
+dropped and duplicated frames apart (camera_loop.FrameStats): the image
+counter of the camera timestamp if the timestamp is on (camera
+'timestamp' setting, 'binary' or 'binary & ascii'; it replaces the
+first pixels of row 0), otherwise the recorder image number.
+wait_for_frame polls the recorder with a timeout instead of the
+blocking wait_for_next_image, which hangs if a frame never arrives.
+
+"""
+import ctypes
+import time
+
+import numpy as np
+
+
+def exact_roi(Y, X):
+    """
+    pco ROI (x0, y0, x1, y1), 1-based and inclusive, of the Y x X region
+    scan3D crops out of legacy_roi. It is vertically symmetric about the
+    sensor center like legacy_roi.
+    """
+    x0 = 1024 - int(X/2) + 1
+    y0 = 1023 - round(Y/2) + 2
+    return (x0, y0, x0 + X - 1, y0 + Y - 1)
+
+
+def image_number(meta, index):
+    """
+    Image number of frame index from the metadata of pco.Camera.image:
+    the timestamp image counter, else the recorder image number, else
+    index + 1.
+    """
+    stamp = meta.get('timestamp')
+    if isinstance(stamp, dict) and 'image counter' in stamp:
+        return int(stamp['image counter'])
+    if 'recorder image number' in meta:
+        return int(meta['recorder image number'])
+    return index + 1
+
+
+def legacy_roi(Y):
+    """
+    ROI scan3D has always read out (full width, Y + 4 rows).
+    """
+    return (1, 1023 - round(Y/2), 2060, 1026 + round(Y/2))
+
+
+class PcoCamera(object):
+    """
+    Wraps pco.Camera (or hardware.simulated.SimulatedCamera) for scan3D.
+
+    Parameters
+    ----------
+
+    camera
+        lsmfx.camera settings (number, X, Y, expTime, triggerMode,
+        acquireMode, timestamp, frameTimeout)
+
+    cam
+        an already opened camera object; a pco.Camera is opened if None
+
+    number
+        pco camera number to open, camera.number if None
+    """
+
+    def __init__(self, camera, cam=None, number=None):
+        if number is None:
+            number = camera.number
+        self.number = number
+        if cam is None:
+            import pco
+            cam = pco.Camera(camera_number=number)
+        self.cam = cam
+        self.X = camera.X
+        self.Y = camera.Y
+        self.crop = None
+        self.timeout = camera.frameTimeout
+
+        configuration = {'exposure time': camera.expTime*1.0e-3,
+                         'roi': exact_roi(camera.Y, camera.X),
+                         'trigger': camera.triggerMode,
+                         'acquire': camera.acquireMode,
+                         'pixel rate': 272250000}
+        if camera.timestamp != 'off':
+            configuration['timestamp'] = camera.timestamp
+        try:
+            self.cam.configuration = configuration
+        except Exception as e:
+            print('Camera rejected the exact ROI (' + str(e) +
+                  '), cropping the full width readout instead')
+            configuration['roi'] = legacy_roi(camera.Y)
+            self.cam.configuration = configuration
+            x0 = 1024 - int(camera.X / 2)
+            self.crop = (slice(2, camera.Y + 2), slice(x0, x0 + camera.X))
+
+        # PCO_RecorderCopyImage of the pco recorder, see read_into
+        self.copy_image = None
+        self.timestamp = camera.timestamp != 'off'
+        rec = getattr(self.cam, 'rec', None)
+        if hasattr(rec, 'PCO_Recorder') and \
+                getattr(self.cam, '_raw_format_mode', 'Word') == 'Word':
+            from pco.recorder import PCO_METADATA_STRUCT, PCO_TIMESTAMP_STRUCT
+            self.rec = rec
+            self.copy_image = rec.PCO_Recorder.PCO_RecorderCopyImage
+            # reused by every copy
+            self.image_number = ctypes.c_uint32()
+            self.metadata = PCO_METADATA_STRUCT()
+            self.metadata.wSize = ctypes.sizeof(PCO_METADATA_STRUCT)
+            self.stamp = PCO_TIMESTAMP_STRUCT()
+            self.stamp.wSize = ctypes.sizeof(PCO_TIMESTAMP_STRUCT)
+            if self.crop is None:
+                self.copy_roi = (1, 1, self.X, self.Y)
+            else:
+                rows, cols = self.crop
+                self.copy_roi = (cols.start + 1, rows.start + 1,
+                                 cols.stop, rows.stop)
+
+    def record(self, nFrames):
+        self.cam.record(number_of_images=nFrames, mode='sequence non blocking')
+
+    def start(self):
+        self.cam.start()
+
+    def stop(self):
+        self.cam.stop()
+
+    def close(self):
+        self.cam.close()
+
+    def wait_for_next_image(self, index):
+        self.cam.wait_for_next_image(index)
+
+    def wait_for_frame(self, index, timeout=None):
+        """
+        Wait until frame index is recorded. Returns False if it is not
+        within timeout s (self.timeout if None).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start = time.perf_counter()
+        while self.ready() <= index:
+            if time.perf_counter() - start > timeout:
+                return False
+            time.sleep(0.5e-3)
+        return True
+
+    def image(self, index):
+        """
+        Frame index as a new Y x X array.
+        """
+        out = np.empty((self.Y, self.X), dtype=np.uint16)
+        self.read_into(index, out)
+        return out
+
+    def ready(self):
+        """
+        Number of frames recorded so far.
+        """
+        return self.cam.rec.get_status()['dwProcImgCount']
+
+    def read_into(self, index, out):
+        """
+        Copy frame index into out, a Y x X view (e.g. a ring buffer row),
+        and return its image number. A contiguous uint16 out is filled by
+        the recorder directly, without an intermediate frame.
+        """
+        if self.copy_image is not None and out.dtype == np.uint16 and \
+                out.flags['C_CONTIGUOUS']:
+            return self.copy_into(index, out)
+        frame, meta = self.cam.image(index)
+        if self.crop is None:
+            np.copyto(out, frame, casting='unsafe')
+        else:
+            np.copyto(out, frame[self.crop], casting='unsafe')
+        return image_number(meta, index)
+
+    def copy_into(self, index, out):
+        """
+        PCO_RecorderCopyImage of frame index into out, returns its image
+        number (see image_number).
+        """
+        x0, y0, x1, y1 = self.copy_roi
+        error = self.copy_image(self.rec.recorder_handle,
+                                self.rec.camera_handle, index,
+                                x0, y0, x1, y1, out.ctypes.data,
+                                ctypes.byref(self.image_number),
+                                ctypes.byref(self.metadata),
+                                ctypes.byref(self.stamp))
+        if (error & 0x80000000) and not (error & 0x40000000):
+            raise Exception('camera ' + str(self.number) + ': copying ' +
+                            'frame ' + str(index) + ' failed (' +
+                            hex(error) + ')')
+        if self.timestamp and self.stamp.dwImgCounter:
+            return int(self.stamp.dwImgCounter)
+        if self.image_number.value:
+            return int(self.image_number.value)
+        return index + 1
+
+    def read_batch(self, first, out, numbers=None):
+        """
+        Copy the frames from first on that are ready (at least frame first,
+        which must be ready) into out[0], out[1], ..., up to len(out), and
+        their image numbers into numbers[0], numbers[1], ... if given.
+        Returns the number of frames copied, one recorder copy each.
+        """
+        n = min(len(out), max(self.ready() - first, 1))
+        for i in range(n):
+            number = self.read_into(first + i, out[i])
+            if numbers is not None:
+                numbers[i] = number
+        return n
@@ -0,0 +1,553 @@
+#!/usr/bin/env python
+"""
+Simulated hardware for running and benchmarking scan3D without the
+instrument.
+
+The serial devices (ASI stage, Skyra, FW102C) are simulated at the port
+level: the real drivers in this package talk to a SimulatedPort, which
+answers each command after a device latency and delivers the answer at
+the baud rate, so driver overheads (polling, sleeps) show up as they
+would on the instrument. The camera, DAQ and tunable lens are simulated
+at the driver level.
+
+All latencies are multiplied by the latency factor of the simulation
+(0 = instant, for CI).
+
+"""
+import re
+import time
+import types
+import numpy as np
+
+from interleave import frame_period, pattern_samples
+
+
+class SimulatedCamera(object):
+    """
+    Stands in for pco.Camera: same configuration / record / start / stop /
+    wait_for_next_image / image / close calls. Like pco.Camera, image()
+    returns a newly allocated frame of the configured ROI size, with the
+    recorder image number (and the timestamp image counter if the
+    'timestamp' configuration is not 'off') in its metadata.
+
+    Parameters
+    ----------
+
+    realtime
+        if True frames become ready one exposure time apart after start();
+        if False every recorded frame is ready immediately (for measuring
+        the CPU cost of the frame loop)
+
+    pool
+        number of distinct synthetic frames cycled through
+
+    drop_rate
+        fraction of the triggers the camera misses: their image counter
+        is skipped and the recording ends that many frames short
+    """
+
+    def __init__(self, camera_number=0, realtime=True, pool=8, seed=0,
+                 drop_rate=0.0):
+        self.camera_number = camera_number
+        self.realtime = realtime
+        self.pool_size = pool
+        self.drop_rate = drop_rate
+        self.rng = np.random.default_rng(seed)
+        self._configuration = {'exposure time': 10.0e-3,
+                               'roi': (1, 1, 2060, 2048),
+                               'timestamp': 'off'}
+        self.frames = None
+        self.number_of_images = 0
+        self.counters = np.zeros(0, dtype=np.int64)
+        self.start_time = None
+        self.rec = types.SimpleNamespace(get_status=self._get_status)
+
+    @property
+    def configuration(self):
+        return dict(self._configuration)
+
+    @configuration.setter
+    def configuration(self, value):
+        x0, y0, x1, y1 = value['roi']
+        if not (1 <= x0 <= x1 <= 2060 and 1 <= y0 <= y1 <= 2048):
+            raise ValueError('invalid roi ' + str(value['roi']))
+        self._configuration.update(value)
+        shape = (y1 - y0 + 1, x1 - x0 + 1)
+        # signal varies across the full sensor width, so the ROI matters
+        base = np.linspace(100, 2000, 2060, dtype=np.float32)[x0 - 1:x1]
+        self.frames = self.rng.poisson(
+            base, size=(self.pool_size,) + shape).astype(np.uint16)
+
+    def record(self, number_of_images=1, mode='sequence'):
+        self.number_of_images = number_of_images
+        # image counter of every frame that is recorded
+        kept = self.rng.random(number_of_images) >= self.drop_rate
+        self.counters = np.flatnonzero(kept) + 1
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        self.start_time = None
+
+    def close(self):
+        self.frames = None
+
+    def _ready(self):
+        if self.start_time is None:
+            return 0
+        if not self.realtime:
+            return len(self.counters)
+        elapsed = time.perf_counter() - self.start_time
+        triggers = int(elapsed/self._configuration['exposure time'])
+        return int(np.searchsorted(self.counters, triggers, side='right'))
+
+    def _get_status(self):
+        return {'dwProcImgCount': self._ready()}
+
+    def wait_for_next_image(self, index, timeout=None):
+        start = time.perf_counter()
+        while self._ready() <= index:
+            if timeout is not None and time.perf_counter() - start > timeout:
+                raise TimeoutError('frame ' + str(index) + ' not received')
+            time.sleep(0.0005)
+
+    def image(self, image_index=0):
+        if image_index >= self._ready():
+            raise ValueError('frame ' + str(image_index) + ' not recorded yet')
+        frame = np.array(self.frames[image_index % self.pool_size])
+        meta = {'recorder image number': image_index + 1}
+        if self._configuration['timestamp'] != 'off':
+            meta['timestamp'] = {
+                'image counter': int(self.counters[image_index])}
+        return frame, meta
+
+
+class SimulatedPort(object):
+    """
+    Stands in for serial.Serial. Every command written (terminated by
+    end_of_line) is passed to respond(); the answer becomes readable
+    latency seconds after the command has been sent and then arrives at
+    the baud rate, like on a real RS-232 line.
+    """
+
+    # device processing time in seconds, before the answer starts
+    latency = 5.0e-3
+
+    def __init__(self, baudrate=9600, end_of_line='\r', timeout=1.0e-3,
+                 latency_factor=1.0):
+        self.baudrate = baudrate
+        self.end_of_line = end_of_line
+        self.timeout = timeout
+        self.latency_factor = latency_factor
+        self.is_open = True
+        self.pending = ''
+        self.answers = []  # [text, first byte time, bytes already read]
+        self.commands = 0
+
+    def _char_time(self):
+        return 10.0/self.baudrate*self.latency_factor
+
+    def write(self, data):
+        now = time.perf_counter()
+        self.pending += data.decode('utf-8')
+        while self.end_of_line in self.pending:
+            command, self.pending = self.pending.split(self.end_of_line, 1)
+            self.commands += 1
+            sent = now + len(command)*self._char_time()
+            answer, delay = self.respond(command.strip())
+            if answer:
+                start = sent + (self.latency + delay)*self.latency_factor
+                if self.answers:
+                    last = self.answers[-1]
+                    start = max(start, last[1] + len(last[0])*self._char_time())
+                self.answers.append([answer, start, 0])
+        return len(data)
+
+    def respond(self, command):
+        """
+        Answer to command and extra delay in seconds (e.g. a move that has
+        to finish before the device answers).
+        """
+        raise NotImplementedError
+
+    def _arrived(self, answer, now):
+        text, start, done = answer
+        if now < start:
+            return 0
+        if self._char_time() == 0:
+            return len(text)
+        return min(len(text), int((now - start)/self._char_time()))
+
+    def inWaiting(self):
+        now = time.perf_counter()
+        return sum(self._arrived(a, now) - a[2] for a in self.answers)
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+    def _take(self, size):
+        now = time.perf_counter()
+        out = ''
+        while self.answers and len(out) < size:
+            answer = self.answers[0]
+            n = min(self._arrived(answer, now) - answer[2], size - len(out))
+            out += answer[0][answer[2]:answer[2] + n]
+            answer[2] += n
+            if answer[2] == len(answer[0]):
+                self.answers.pop(0)
+            else:
+                break
+        return out
+
+    def read(self, size=1):
+        deadline = time.perf_counter() + (self.timeout or 0)
+        out = self._take(size)
+        while len(out) < size and time.perf_counter() < deadline:
+            time.sleep(min(self._char_time(), 1.0e-3) or 1.0e-4)
+            out += self._take(size - len(out))
+        return out.encode('utf-8')
+
+    def read_until(self, expected=b'\n', size=None):
+        expected = expected.decode('utf-8')
+        deadline = time.perf_counter() + (self.timeout or 0)
+        out = ''
+        while not out.endswith(expected):
+            if size is not None and len(out) >= size:
+                break
+            c = self._take(1)
+            if c:
+                out += c
+            elif time.perf_counter() >= deadline:
+                break
+            else:
+                time.sleep(1.0e-4)
+        return out.encode('utf-8')
+
+    def readline(self):
+        return self.read_until(b'\n')
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.answers = []
+
+    def close(self):
+        self.is_open = False
+
+
+class SimulatedASIStage(SimulatedPort):
+    """
+    ASI MS2000 / Tiger controller with X, Y and Z axes. Positions are in
+    controller units (10000 per mm), velocities in mm/s. A move or a scan
+    takes distance / velocity plus the acceleration time; '/' answers B
+    while any axis is moving.
+    """
+
+    latency = 3.0e-3
+    units_per_mm = 10000.0
+
+    def __init__(self, **kwds):
+        SimulatedPort.__init__(self, **kwds)
+        self.axes = {ax: {'start': 0.0, 'target': 0.0, 't0': 0.0, 't1': 0.0}
+                     for ax in 'XYZ'}
+        self.velocity = {ax: 1.0 for ax in 'XYZ'}
+        self.acceleration = {ax: 100.0 for ax in 'XYZ'}  # ms
+        self.scanr = (0.0, 0.0)
+
+    def position(self, ax, now=None):
+        if now is None:
+            now = time.perf_counter()
+        a = self.axes[ax]
+        if now >= a['t1']:
+            return a['target']
+        f = (now - a['t0'])/(a['t1'] - a['t0'])
+        return a['start'] + f*(a['target'] - a['start'])
+
+    def moving(self, now=None):
+        if now is None:
+            now = time.perf_counter()
+        return any(now < a['t1'] for a in self.axes.values())
+
+    def move(self, ax, target, velocity=None):
+        now = time.perf_counter()
+        start = self.position(ax, now)
+        if velocity is None:
+            velocity = self.velocity[ax]
+        duration = abs(target - start)/self.units_per_mm/max(velocity, 1.0e-6)
+        if duration > 0:
+            duration += self.acceleration[ax]/1000.0
+        self.axes[ax] = {'start': start, 'target': target, 't0': now,
+                         't1': now + duration*self.latency_factor}
+
+    def respond(self, command):
+        fields = command.split()
+        if not fields:
+            return ':A\r\n', 0
+        head = fields[0].upper()
+        args = dict(re.findall(r'([XYZF])=([-0-9.]+)', command.upper()))
+
+        if head == '/':
+            return ('B' if self.moving() else 'N') + '\r\n', 0
+        elif head == 'W':
+            return ':A ' + ' '.join(str(round(self.position(ax)))
+                                    for ax in fields[1:]) + ' \r\n', 0
+        elif head in ('M', 'R'):
+            for ax, value in args.items():
+                if ax in self.axes:
+                    target = float(value)
+                    if head == 'R':
+                        target += self.position(ax)
+                    self.move(ax, target)
+        elif head == 'S':
+            for ax, value in args.items():
+                self.velocity[ax] = float(value)
+        elif head == 'AC':
+            for ax, value in args.items():
+                self.acceleration[ax] = float(value)
+        elif head == 'SCANR':
+            self.scanr = (float(args['X']), float(args['Y']))
+        elif head == 'SCAN' and len(fields) == 1:
+            start, stop = self.scanr
+            self.axes['X']['target'] = start*self.units_per_mm
+            self.axes['X']['t1'] = 0.0
+            self.move('X', stop*self.units_per_mm)
+        elif head == 'Z':
+            for ax in self.axes:
+                self.axes[ax] = {'start': 0.0, 'target': 0.0,
+                                 't0': 0.0, 't1': 0.0}
+        return ':A\r\n', 0
+
+
+class SimulatedSkyra(SimulatedPort):
+    """
+    Cobolt Skyra: acknowledges set commands with OK, answers queries
+    (ending in ?) with the stored value.
+    """
+
+    latency = 10.0e-3
+
+    def __init__(self, **kwds):
+        SimulatedPort.__init__(self, **kwds)
+        self.state = {}
+
+    def respond(self, command):
+        if command.endswith('?'):
+            return str(self.state.get(command[:-1], 0.0)) + '\r\n', 0
+        fields = command.split(' ', 1)
+        self.state[fields[0]] = fields[1] if len(fields) > 1 else 1
+        return 'OK\r\n', 0
+
+
+class SimulatedFW102C(SimulatedPort):
+    """
+    Thorlabs FW102C: echoes the command followed by the > prompt, after
+    the wheel has turned for pos= commands.
+    """
+
+    latency = 2.0e-3
+    slot_time = 0.25  # s per filter slot
+    positions = 6
+
+    def __init__(self, **kwds):
+        SimulatedPort.__init__(self, **kwds)
+        self.pos = 1
+
+    def respond(self, command):
+        delay = 0
+        if command.startswith('pos='):
+            target = int(command[4:])
+            steps = abs(target - self.pos)
+            steps = min(steps, self.positions - steps)
+            delay = steps*self.slot_time
+            self.pos = target
+        elif command == '*idn?':
+            return command + '\rTHORLABS FW102C/FW212C Filter Wheel ' + \
+                'version 1.07 (simulated)\r>', 0
+        elif command == 'pos?':
+            return command + '\r' + str(self.pos) + '\r>', 0
+        return command + '\r>', delay
+
+
+class SimulatedOpto(object):
+    """
+    Stands in for hardware.opto.Opto (the calls scan3D makes).
+    """
+
+    latency = 2.0e-3
+
+    def __init__(self, port=None, latency_factor=1.0):
+        self.port = port
+        self.latency_factor = latency_factor
+        self._current = None
+        self._mode = None
+
+    def _wait(self):
+        time.sleep(self.latency*self.latency_factor)
+
+    def connect(self):
+        self._wait()
+
+    def handshake(self):
+        self._wait()
+        return b'Ready\r\n'
+
+    def mode(self, mode_str=None):
+        self._wait()
+        if mode_str is not None:
+            self._mode = mode_str
+        return self._mode
+
+    def current(self, value=None):
+        self._wait()
+        if value is not None:
+            self._current = value
+        return self._current
+
+    def invalidate_cache(self):
+        pass
+
+    def close(self, soft_close=None):
+        self._current = 0
+
+
+class SimulatedTask(object):
+    """
+    Stands in for the nidaqmx analog output task of waveformGenerator.
+    write() takes as long as moving the samples to the board would.
+
+    Like the FINITE, retriggerable task, every camera trigger that does
+    not arrive during a generation starts samps_per_chan samples of the
+    buffer, from its start. start() checks that a waveform of several
+    frames (interleave.py) plays the frame of the pattern each camera
+    frame of the tile expects.
+    """
+
+    bytes_per_second = 200.0e6
+
+    def __init__(self, num_channels, latency_factor=1.0):
+        self.num_channels = num_channels
+        self.latency_factor = latency_factor
+        self.running = False
+        self.writes = 0
+        self.samples_written = 0
+        # set by SimulatedWaveformGenerator.set_samples
+        self.samps_per_chan = None
+        self.period = None  # samples between camera triggers
+        self.frames = 0  # camera triggers per tile
+        self.triggers = types.SimpleNamespace(
+            start_trigger=types.SimpleNamespace(
+                retriggerable=True,
+                disable_start_trig=lambda: None,
+                cfg_dig_edge_start_trig=lambda **kwds: None))
+
+    def write(self, data, auto_start=False):
+        data = np.asarray(data)
+        if data.ndim != 2 or data.shape[0] != self.num_channels:
+            raise ValueError('expected (' + str(self.num_channels) +
+                             ', samples) voltages, got ' + str(data.shape))
+        if self.running:
+            raise RuntimeError('task is running')
+        time.sleep(data.nbytes/self.bytes_per_second*self.latency_factor)
+        self.writes += 1
+        self.samples_written = data.shape[1]
+        return data.shape[1]
+
+    def start(self):
+        self.running = True
+        self.check_retriggering()
+
+    def playback(self, triggers):
+        """
+        Position in the buffer played at each of triggers camera frames,
+        one period apart.
+        """
+        positions = []
+        start = end = 0  # current generation
+        for k in range(triggers):
+            t = k*self.period
+            if t >= end:
+                start, end = t, t + self.samps_per_chan
+            positions.append((t - start) % self.samples_written)
+        return positions
+
+    def check_retriggering(self):
+        if self.period is None or self.samples_written <= self.period:
+            return
+        frames = -(-self.samples_written // self.period)  # per pattern
+        for k, position in enumerate(self.playback(self.frames)):
+            if position // self.period != k % frames:
+                raise RuntimeError('camera frame ' + str(k) + ' plays ' +
+                                   'frame ' + str(position // self.period) +
+                                   ' of the DAQ pattern, not ' +
+                                   str(k % frames) + ' (' +
+                                   str(self.samps_per_chan) +
+                                   ' samples per trigger)')
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.running = False
+
+
+class SimulatedWaveformGenerator(object):
+    """
+    Stands in for hardware.ni.waveformGenerator. The int16 DAC codes use
+    the nominal +-10 V, 16 bit scaling instead of a calibration.
+    """
+
+    # volts -> DAC codes polynomial of every channel
+    scaling_coeff = [0.0, 32768/10.0]
+
+    def __init__(self, daq, camera, session, triggered=True,
+                 latency_factor=1.0):
+        self.channels = daq.channels
+        self.ao_task = SimulatedTask(len(self.channels), latency_factor)
+        self.set_samples(daq, camera, session)
+        self.dtype = daq.dtype
+        if self.dtype not in ('float64', 'int16'):
+            raise Exception('invalid daq dtype!')
+        self.writes = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+
+    def set_samples(self, daq, camera, session):
+        if session.interleaved:
+            self.samples = pattern_samples(daq, camera, session.nChannels)
+        else:
+            self.samples = int(session.nFrames*daq.rate*camera.expTime/1000)
+        self.ao_task.samps_per_chan = self.samples
+        self.ao_task.period = frame_period(daq, camera)
+        self.ao_task.frames = int(session.framesPerTile)
+
+    def prepare(self, voltages):
+        voltages = voltages[self.channels]
+        if self.dtype == 'int16':
+            codes = np.polynomial.polynomial.polyval(voltages,
+                                                     self.scaling_coeff)
+            return np.clip(np.rint(codes), -32768, 32767).astype(np.int16)
+        return np.ascontiguousarray(voltages, dtype=np.float64)
+
+    def write(self, data):
+        start = time.perf_counter()
+        self.ao_task.write(data)
+        self.write_time += time.perf_counter() - start
+        self.writes += 1
+        self.bytes_written += data.nbytes
+
+    def print_stats(self):
+        if self.writes:
+            print('DAQ: ' + str(len(self.channels)) + ' AO channels, ' +
+                  self.dtype + ', ' +
+                  str(round(self.bytes_written/self.writes/1e3, 1)) +
+                  ' kB and ' +
+                  str(round(self.write_time/self.writes*1e3, 2)) +
+                  ' ms per write (' + str(self.writes) + ' writes)')
+
+    def write_zeros(self, daq):
+        self.ao_task.write(np.zeros((len(self.channels), 2)))
+        self.ao_task.start()
+        self.ao_task.stop()
@@ -43,6 +43,9 @@ class Skyra(RS232.RS232):
         #                     3: 1.0,
         #                     4: 1.0}
 
+        # responses end with \r\n
+        kwds.setdefault('terminator', '\r\n')
+
         try:
             # open port
             super().__init__(**kwds)
@@ -90,19 +93,25 @@ class Skyra(RS232.RS232):
             with open('skyra_LUT.json', 'r') as read_file:
                 self.LUT = json.load(read_file)
 
+    def isAcknowledged(self, response):
+        """
+        Set commands are answered with OK.
+        """
+        return response is not None and "OK" in response
+
     def turnOn(self, wavelength):
         """
         Turn laser ON.
         """
-        self.sendCommand(str(wavelength) + "l1")
-        self.waitResponse()
+        self.cachedCommand((wavelength, "l"), 1,
+                           str(wavelength) + "l1", wait=True)
 
     def turnOff(self, wavelength):
         """
         Turn laser OFF.
         """
-        self.sendCommand(str(wavelength) + "l0")
-        self.waitResponse()
+        self.cachedCommand((wavelength, "l"), 0,
+                           str(wavelength) + "l0", wait=True)
 
     def setPower(self, wavelength, power):
         """
@@ -112,29 +121,29 @@ class Skyra(RS232.RS232):
         power: power in mW
         """
         power = power/1000  # convert to W
-        self.sendCommand(str(wavelength) + "p " + str(power))
-        self.waitResponse()
+        self.cachedCommand((wavelength, "p"), power,
+                           str(wavelength) + "p " + str(power), wait=True)
 
     def setModulationOn(self, wavelength):
         """
         Set the modulation mode ON.
         """
-        self.sendCommand(str(wavelength) + "em")
-        self.waitResponse()
+        self.cachedCommand((wavelength, "em"), 1,
+                           str(wavelength) + "em", wait=True)
 
     def setDigitalModulation(self, wavelength, mode):
         """
         Set digital modulation mode.
         """
-        self.sendCommand(str(wavelength) + "sdmes " + str(mode))
-        self.waitResponse()
+        self.cachedCommand((wavelength, "sdmes"), mode,
+                           str(wavelength) + "sdmes " + str(mode), wait=True)
 
     def setAnalogModulation(self, wavelength, mode):
         """
         Set analog modulation mode.
         """
-        self.sendCommand(str(wavelength) + "sames " + str(mode))
-        self.waitResponse()
+        self.cachedCommand((wavelength, "sames"), mode,
+                           str(wavelength) + "sames " + str(mode), wait=True)
 
     def getModulationHighCurrent(self, wavelength):
         """
@@ -142,7 +151,6 @@ class Skyra(RS232.RS232):
         """
 
         response = self.commWithResp(str(wavelength) + "gmc?")
-        self.waitResponse()
         response = float(response[0:len(response)-5])
         # print(response)
         return response
@@ -154,7 +162,6 @@ class Skyra(RS232.RS232):
 
         response = self.commWithResp(str(wavelength) + "glth?")
         print(response)
-        self.waitResponse()
         response = float(response[0:len(response)-5])
         # print(response)
         return response
@@ -176,8 +183,8 @@ class Skyra(RS232.RS232):
 
         print('Setting high current for wavelength ' + str(wavelength) +
               ' to ' + str(current) + ' mA')
-        self.sendCommand(str(wavelength) + "smc " + str(current))
-        self.waitResponse()
+        self.cachedCommand((wavelength, "smc"), current,
+                           str(wavelength) + "smc " + str(current), wait=True)
 
     def setModulationLowCurrent(self, wavelength, current):
         """
@@ -193,8 +200,8 @@ class Skyra(RS232.RS232):
         print('Setting low current for wavelength ' + str(wavelength) +
               ' to ' + str(current) + ' mA')
 
-        self.sendCommand(str(wavelength) + "slth " + str(current))
-        self.waitResponse()
+        self.cachedCommand((wavelength, "slth"), current,
+                           str(wavelength) + "slth " + str(current), wait=True)
 
     def power2current(self, wavelength, power):
         """
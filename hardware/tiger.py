@@ -13,14 +13,14 @@ Renamed variables to refer to mm and not um (code is correct,
 
 """
 import sys 
-import hardware.RS232 as RS232
+import hardware.asi as asi
 import time
 
 ## TIGER
 #
 # Applied Scientific Instrumentation tiger RS232 interface class.
 #
-class TIGER(RS232.RS232):
+class TIGER(asi.ASIStage):
 
     ## __init__
     #
@@ -37,6 +37,9 @@ class TIGER(RS232.RS232):
         self.y = 0.0
         self.z = 0.0
 
+        # responses end with \r\n
+        kwds.setdefault('terminator', '\r\n')
+
         try:
             # open port
             super().__init__(**kwds)
@@ -68,10 +71,21 @@ class TIGER(RS232.RS232):
         p = pos * self.mm_to_unit
         p = round(p)
         self.commWithResp("M " + axis + "=" + str(p))
+        self.predictMove(axis, p*self.unit_to_mm)
+        if bwait == True:
+            self.waitUntilIdle((axis,))
+
+    ## goAbsoluteAxes
+    #
+    # @param positions. {axis: position in mm}, moved with one command.
+    #
+    def goAbsoluteAxes(self, positions, bwait):
+        p = {ax: round(positions[ax] * self.mm_to_unit) for ax in positions}
+        self.commWithResp("M " + self.axisValues(p))
+        for ax in p:
+            self.predictMove(ax, p[ax]*self.unit_to_mm)
         if bwait == True:
-            response = self.getMotorStatus()
-            while response[0] == 'B':
-                response = self.getMotorStatus()
+            self.waitUntilIdle(tuple(p))
 
     ## goRelative
     #
@@ -82,10 +96,13 @@ class TIGER(RS232.RS232):
         p = pos * self.mm_to_unit
         p = round(p)
         self.commWithResp("R " + axis + "=" + str(p))
+        target = self.axis_target.get(axis)
+        if target is None:
+            self.predictMove(axis, 0.0)
+        else:
+            self.predictMove(axis, target + p*self.unit_to_mm)
         if bwait == True:
-            response = self.getMotorStatus()
-            while response[0] == 'B':
-                response = self.getMotorStatus()
+            self.waitUntilIdle((axis,))
 
     ## getPosition
     #
@@ -97,6 +114,7 @@ class TIGER(RS232.RS232):
             self.x = float(self.x)*self.unit_to_mm # convert to mm
             self.y = float(self.y)*self.unit_to_mm # convert to mm
             self.z = float(self.z)*self.unit_to_mm # convert to mm
+            self.axis_target.update({'X': self.x, 'Y': self.y, 'Z': self.z})
         except:
             print("Stage Error")
         return [self.x, self.y, self.z]
@@ -106,7 +124,7 @@ class TIGER(RS232.RS232):
     # @param backlash. 0 (off) or 1 (on)
     #
     def setBacklash(self, axis, backlash):
-        self.commWithResp("B " + axis + "=" + str(backlash))
+        self.cachedAxisCommand("B", {axis: backlash})
 
     ## scan
     #
@@ -114,17 +132,16 @@ class TIGER(RS232.RS232):
     #
     def scan(self,bwait):
         self.commWithResp("SCAN")
+        self.predictScan()
         if bwait == True:
-            response = self.getMotorStatus()
-            while response[0] == 'B':
-                response = self.getMotorStatus()
+            self.waitUntilIdle(('X',))
 
     ## setScanF
     #
     # @param f. 0 - RASTER, 1 - SERPENTINE
     #
     def setScanF(self, x):
-        self.commWithResp("SCAN F=" + str(x))
+        self.cachedCommand("SCAN F", x, "SCAN F=" + str(x))
 
     ## setScanR
     #
@@ -135,7 +152,8 @@ class TIGER(RS232.RS232):
     def setScanR(self, x, y):
         x = round(x,3)
         y = round(y,3)
-        self.commWithResp("SCANR X=" + str(x) + " Y=" + str(y))
+        self.cachedCommand("SCANR", (x, y), "SCANR X=" + str(x) + " Y=" + str(y))
+        self.scan_range = (x, y)
 
     ### ****May need to be updated for F param: http://asiimaging.com/docs/products/tiger#commandscanv_nv****
     ## setScanV
@@ -147,7 +165,7 @@ class TIGER(RS232.RS232):
     #
     def setScanV(self, x):
         x = round(x,3)
-        self.commWithResp("SCANV X=" + str(x) + "Y=" + str(x) + " Z=1 F=10")
+        self.cachedCommand("SCANV", x, "SCANV X=" + str(x) + "Y=" + str(x) + " Z=1 F=10")
         #may need to adjust F number, it is the extra settling time in ms
 
     ## setTTL
@@ -157,7 +175,8 @@ class TIGER(RS232.RS232):
     # @param TTL. 0 (on) or 1 (off)
     #
     def setTTL(self, card, axis, ttl):
-        self.commWithResp(str(card) + "TTL " + axis + "=" + str(ttl))
+        self.cachedCommand((card, "TTL", axis), ttl,
+                           str(card) + "TTL " + axis + "=" + str(ttl))
 
     ## setPLCPreset
     #
@@ -165,7 +184,8 @@ class TIGER(RS232.RS232):
     # @param preset. preset PLC code - use 52 for stage SYNC access on BNC 3
     #
     def setPLCPreset(self, card, preset):
-        self.commWithResp(str(card) + "CCA X=" + str(preset))
+        self.cachedCommand((card, "CCA"), preset,
+                           str(card) + "CCA X=" + str(preset))
 
     ## setAcceleration
     #
@@ -173,7 +193,8 @@ class TIGER(RS232.RS232):
     # @param accel time (ms) to reach velocity.
     #
     def setAcceleration(self, axis, accel):
-        self.commWithResp("AC " + axis + "=" + str(accel))
+        self.cachedAxisCommand("AC", {axis: accel})
+        self.axis_acceleration[axis] = accel
         
     ## setVelocity
     #
@@ -182,7 +203,8 @@ class TIGER(RS232.RS232):
     #
     def setVelocity(self, axis, vel):
         vel = round(vel,5)
-        self.commWithResp("S " + axis + "=" + str(vel))
+        self.cachedAxisCommand("S", {axis: vel})
+        self.axis_velocity[axis] = vel
 
     ## zero
     #
@@ -190,6 +212,7 @@ class TIGER(RS232.RS232):
     #
     def zero(self):
         self.commWithResp("Z")
+        self.axis_target = {'X': 0.0, 'Y': 0.0, 'Z': 0.0}
 
 #
 # The MIT License
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+
+"""
+Hardware connected once per run of scan3D
+
+scan3D_image_wells used to connect the stage, DAQ, laser (with its
+confirmation prompt), filter wheel, tunable lens and cameras again for
+every well, without closing the previous connections. HardwareSession
+connects every device the first time open() is called and keeps it for
+the following wells. Only what depends on the region of a well is set
+again:
+
+    laser     the current at the last z tile is checked against the
+              maximum (laser.check_currents), and the currents are set
+              again if the wavelengths change (laser.configure)
+    DAQ       number of samples of the AO task (waveformGenerator.set_samples)
+    cameras   number of frames recorded per tile (cam.record)
+
+close() turns the lasers off and tears everything down once, at the end
+of the run, also when a scan failed.
+
+Everything else is fixed while the devices are connected: scans sharing
+a HardwareSession (the wells of a puck, the items of run_queue.py) must
+have the same connection_settings.
+
+"""
+
+
+def connection_settings(camera, daq, laser, wheel, etl, stage):
+    """
+    Settings a HardwareSession keeps from its first scan, as a dict of
+    {section: {name: value}} that can be compared between scans.
+    """
+    return {'camera': {name: getattr(camera, name)
+                       for name in ('number', 'number2', 'X', 'Y', 'expTime',
+                                    'triggerMode', 'acquireMode', 'timestamp',
+                                    'frameTimeout')},
+            'daq': {'board': daq.board, 'rate': daq.rate,
+                    'channels': daq.channels, 'dtype': daq.dtype},
+            'laser': {name: getattr(laser, name)
+                      for name in ('port', 'rate', 'skyra_system_name',
+                                   'names_to_channels', 'min_currents',
+                                   'max_currents', 'max_powers')},
+            'wheel': {'port': wheel.port, 'rate': wheel.rate},
+            'etl': {'port': etl.port},
+            'stage': {'model': stage.model, 'port': stage.port,
+                      'rate': stage.rate}}
+
+
+class HardwareSession(object):
+    """
+    Devices of a scan, reused across wells and queued scans.
+
+    Parameters
+    ----------
+
+    camera, daq, laser, wheel, etl, stage
+        lsmfx settings objects, whose initialize() connects the device
+
+    simulation
+        lsmfx.simulation, or None for the instrument
+
+    confirm
+        ask before connecting the laser (laser.initialize), False for
+        unattended runs
+
+    Usage::
+
+        hardware = HardwareSession(camera, daq, laser, wheel, etl, stage)
+        try:
+            for well in wells:
+                session = scan(experiment, camera)
+                hardware.open(experiment, session)
+                ... hardware.xyzStage, hardware.cams, ...
+        finally:
+            hardware.close()
+    """
+
+    def __init__(self, camera, daq, laser, wheel, etl, stage,
+                 simulation=None, confirm=True):
+        self.camera = camera
+        self.daq = daq
+        self.laser = laser
+        self.wheel = wheel
+        self.etl = etl
+        self.stage = stage
+        self.simulation = simulation
+        self.confirm = confirm
+
+        self.xyzStage = None
+        self.initialPos = None
+        self.waveformGenerator = None
+        self.skyraLaser = None
+        self.fWheel = None
+        self.etlLens = None
+        self.cams = []
+        self.wavelengths = None  # the laser is configured for
+
+        # counters
+        self.opened = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def connected(self):
+        return self.xyzStage is not None
+
+    def open(self, experiment, session):
+        """
+        Connect the devices (first call only) and configure them for the
+        region of session (lsmfx.scan). Returns self.
+        """
+        if not self.connected:
+            self.connect(experiment, session)
+        else:
+            print('reusing the connected hardware')
+            self.invalidate_caches()
+            self.configure(experiment, session)
+        self.opened += 1
+        return self
+
+    def connect(self, experiment, session):
+
+        #  CONNECT XYZ STAGE
+        self.xyzStage, self.initialPos = self.stage.initialize(
+            self.simulation)
+        print(self.xyzStage)
+
+        # CONNECT NIDAQ
+        self.waveformGenerator = self.daq.initialize(self.camera, session,
+                                                     self.simulation)
+
+        # CONNECT LASER
+
+        # according to the manual, you should wait for 2min after setting
+        # laser 1 (561) to mod mode for power to stabalize. Consider adding this in
+        # TODO: disentangle laser and experiment attributes
+        self.skyraLaser = self.laser.initialize(experiment, session,
+                                                self.simulation, self.confirm)
+        self.wavelengths = dict(experiment.wavelengths)
+        print(self.skyraLaser)
+
+        # CONNECT FILTER WHEEL
+        self.fWheel = self.wheel.initialize(self.simulation)
+        print(self.fWheel)
+
+        # CONNECT TUNBALE LENS
+        self.etlLens = self.etl.initialize(self.simulation)
+        print(self.etlLens)
+
+        # CONNECT CAMERA
+        # (dual camera acquisition: one per channel of a pass)
+        self.cams = [self.camera.initialize(self.simulation)]
+        self.record(session)
+
+    def configure(self, experiment, session):
+        """
+        Set the ROI-dependent parameters of the connected devices.
+        """
+        if dict(experiment.wavelengths) != self.wavelengths:
+            self.laser.configure(self.skyraLaser, experiment, session)
+            self.wavelengths = dict(experiment.wavelengths)
+        else:
+            self.laser.check_currents(experiment, session)
+        self.waveformGenerator.set_samples(self.daq, self.camera, session)
+        self.record(session)
+
+    def invalidate_caches(self):
+        """
+        Forget the settings the stage, laser, filter wheel and tunable
+        lens drivers skip as already set (after a failed scan, and before
+        every scan on the connected devices), so they are sent again.
+        """
+        if not self.connected:
+            return
+        for device in (self.xyzStage, self.skyraLaser, self.fWheel):
+            device.invalidateCache()
+        self.etlLens.invalidate_cache()
+
+    def record(self, session):
+        # second camera only once a scan needs it, kept (unused) for
+        # single camera scans after it: use cams[:session.nCameras]
+        if session.nCameras > 1 and len(self.cams) < 2:
+            self.cams.append(self.camera.initialize(self.simulation,
+                                                    self.camera.number2))
+        for cam in self.cams[:session.nCameras]:
+            cam.record(session.framesPerTile)
+        # possibly change mode to ring buffer??
+
+    def close(self):
+        """
+        Disconnect every device, once. A device that fails to shut down
+        does not keep the others connected: the first error is raised
+        after all of them have been released.
+        """
+        if not self.connected:
+            return
+        steps = []
+        # a failed scan may have left a laser on
+        for wave in self.wavelengths or {}:
+            steps.append((self.skyraLaser.turnOff,
+                          self.laser.names_to_channels[wave]))
+        steps.append((self.xyzStage.waitUntilIdle,))
+        for cam in self.cams:
+            steps.append((cam.close,))
+        steps += [(self.etlLens.close, True),
+                  # waveformGenerator.counter_task.close()
+                  (self.waveformGenerator.ao_task.close,),
+                  (self.skyraLaser.shutDown,),
+                  (self.fWheel.shutDown,),
+                  (self.xyzStage.shutDown,)]
+        error = None
+        for step in steps:
+            try:
+                step[0](*step[1:])
+            except Exception as e:
+                print('Hardware: error closing: ' + repr(e))
+                if error is None:
+                    error = e
+
+        self.xyzStage = None
+        self.cams = []
+        self.wavelengths = None
+        if self.opened > 1:
+            print('Hardware: connected once for ' + str(self.opened) +
+                  ' scans')
+        self.opened = 0
+        if error is not None:
+            raise error
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+"""
+Frame-interleaved multi-wavelength acquisition
+
+Instead of one X pass of the stage per wavelength, every channel is
+acquired in the same pass: the DAQ waveform spans nWavelengths camera
+frames and turns on a different laser in each of them, and the stage
+moves nWavelengths times slower so each channel still gets one frame
+every xWidth. Frame n of a tile then belongs to channel n % nWavelengths.
+
+The emission filter has to pass every wavelength, so the filter wheel
+sits at its 'multiband' position for the whole scan.
+
+Frames are stored per channel as usual (setup tile + zTiles*yTiles*ch),
+the Deinterleaver splits the blocks of the frame loop before they reach
+the file writer.
+
+"""
+import numpy as np
+
+
+def frame_period(daq, camera):
+    """
+    Number of DAQ samples between two camera frames: expTime plus the
+    10 us readout gap assumed by scan.setScanSpeed.
+    """
+    return int(daq.rate*(camera.expTime + 10.0e-3)/1e3)
+
+
+def pattern_samples(daq, camera, nChannels):
+    """
+    Length of the interleave_voltages waveform of nChannels channels:
+    nChannels - 1 frame periods and one frame (write_voltages). The AO
+    task plays exactly this many samples per trigger, so each pattern
+    starts on the frame that triggers it, a multiple of nChannels.
+    """
+    return ((nChannels - 1)*frame_period(daq, camera) +
+            int(daq.rate*camera.expTime/1e3))
+
+
+def interleave_voltages(frames, period):
+    """
+    Join the single-frame waveforms of the channels into one waveform of
+    len(frames) frames.
+
+    The DAQ is retriggered by the camera, and triggers that arrive while
+    the waveform plays are ignored, so the waveform restarts every
+    len(frames) frames, as long as the task plays it once per trigger
+    (pattern_samples). Every frame but the last is held at its final
+    value up to period samples so the frames stay in step with the camera.
+
+    Parameters
+    ----------
+
+    frames
+        list of (num_channels, samples) voltages, one per channel in
+        acquisition order (see write_voltages)
+
+    period
+        samples between two camera frames (frame_period)
+    """
+    pieces = []
+    for n, voltages in enumerate(frames):
+        pieces.append(voltages)
+        gap = period - voltages.shape[1]
+        if n < len(frames) - 1 and gap > 0:
+            pieces.append(np.repeat(voltages[:, -1:], gap, axis=1))
+    return np.concatenate(pieces, axis=1)
+
+
+class Deinterleaver(object):
+    """
+    File writer that splits interleaved blocks into their channels.
+
+    write(img_3d, idx, ind1, ind2) takes frames ind1 - ind2 of a tile in
+    acquisition order, idx being the setup of the tile in channel 0, and
+    writes every nChannels-th frame to the setup of each channel. Blocks
+    must start on a multiple of nChannels (scan.blockSize is one).
+
+    Parameters
+    ----------
+
+    writer
+        H5Writer or ZarrWriter
+
+    nChannels
+        channels acquired in each pass
+
+    stride
+        setups per channel, zTiles*yTiles
+    """
+
+    def __init__(self, writer, nChannels, stride):
+        self.writer = writer
+        self.nChannels = nChannels
+        self.stride = stride
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, img_3d, idx, ind1, ind2):
+        if ind1 % self.nChannels != 0:
+            raise Exception('interleaved block does not start on channel 0!')
+        for ch in range(self.nChannels):
+            frames = np.ascontiguousarray(img_3d[ch::self.nChannels])
+            if frames.shape[0] == 0:
+                continue
+            start = ind1 // self.nChannels
+            self.writer.write(frames, idx + self.stride*ch,
+                              start, start + frames.shape[0])
+
+    def annotate(self, idx, attrs):
+        """
+        The attributes of a tile apply to all of its channels.
+        """
+        for ch in range(self.nChannels):
+            self.writer.annotate(idx + self.stride*ch, attrs)
+
+    def close(self):
+        self.writer.close()
@@ -13,12 +13,16 @@ wheel_dict = static_params['wheel']
 etl_dict = static_params['etl']
 stage_dict = static_params['stage']
 image_wells = static_params['image_wells'] ## Default option for this is "no"
+simulation_dict = static_params.get('simulation', {})  # simulated hardware, off by default
 
 
 # ------ Set user-defined paramters ------ #
 
 # CAMERA PARAMETERS
 camera_dict['expTime'] = 10.0  # ms 
+# camera_dict['number2'] = 2  # second pco camera behind the dichroic: two wavelengths per stage pass, see camera_loop.py
+# camera_dict['frameTimeout'] = 2.0  # s without a frame before a tile is ended, see camera_loop.py
+# camera_dict['timestamp'] = 'binary'  # pco image counter in row 0 of every frame, to count dropped frames
 
 # B3D compression. 0.0 = off, 1.0 = standard compression
 camera_dict['quantSigma'] = {'405': 1.0,
@@ -29,6 +33,10 @@ camera_dict['quantSigma'] = {'405': 1.0,
 # FILE PARAMETERS
 experiment_dict['drive'] = 'A'
 experiment_dict['fname'] = 'LB_OTLS4_eosin_sample_2-6-23'  # file name
+experiment_dict['backend'] = 'h5'  # 'h5' (data.h5 + data.xml), 'zarr' (data.ome.zarr) or 'raw' (staged, see raw_staging.py)
+experiment_dict['order'] = 'channel_innermost'  # 'channel_innermost', 'channel_outermost' or 'serpentine', see acquisition_order.py
+experiment_dict['bidirectional'] = False  # True: every other tile is scanned backwards in X, no X return moves
+experiment_dict['interleaved'] = False  # True: all wavelengths in one X pass, lasers alternate frame by frame (needs the multiband filter below), see interleave.py
 
 # ## If imaging on hivex puck with pre-defined well positions, indicate which wells to image below.
 ## If not, just comment out the two lines below
@@ -49,6 +57,9 @@ experiment_dict['zMax'] = 0.28  # mm
 # wheel_dict['names_to_channels']['638'] = 6
 # wheel_dict['names_to_channels']['488'] = 6
 
+# Filter wheel position of the multiband emission filter, needed for interleaved acquisition
+# wheel_dict['names_to_channels']['multiband'] = 5
+
 ################## IMPORTANT!!##################
 # set experiment wavelenths here, current in mA
 ################################################
@@ -116,6 +127,13 @@ laserObj = lsmfx.laser(laser_dict)
 wheelObj = lsmfx.wheel(wheel_dict)
 etlObj = lsmfx.etl(etl_dict)
 stageObj = lsmfx.stage(stage_dict)
+simulationObj = lsmfx.simulation(simulation_dict)
 
 # Begin scanning
-lsmfx.scan3D(experimentObj, cameraObj, daqObj, laserObj, wheelObj, etlObj, stageObj, image_wells)
\ No newline at end of file
+# (python planner.py predicts the scan time, data volume and disk space
+# of these settings without touching the hardware)
+# (python run_queue.py runs several samples from JSON files unattended)
+# (guarded so compression worker processes can import this file)
+if __name__ == '__main__':
+    lsmfx.scan3D(experimentObj, cameraObj, daqObj, laserObj, wheelObj, etlObj, stageObj, image_wells,
+                 simulationObj)
\ No newline at end of file
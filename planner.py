@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+"""
+Dry run of a scan: predicted duration, data volume and disk space
+
+plan() builds the scan geometry (lsmfx.scan) from the settings of
+lsm-python-main.py without touching any hardware, and predicts
+
+    time    tiles x xLength / scanSpeed, plus the tile transitions of the
+            acquisition order (stage moves, filter changes, laser current
+            changes, see acquisition_order.predict) and the serial
+            commands the scan waits for at every tile
+    bytes   per resolution level, uncompressed and compressed with the
+            codec of each channel (assumed ratios, see ratios)
+    space   free space on the drive of experiment.path()
+
+    python planner.py                      # settings of lsm-python-main.py
+    python planner.py my-main.py --order serpentine
+
+scan3D calls check_disk_space before it creates anything on the drive.
+
+"""
+import argparse
+import os
+import runpy
+import shutil
+
+import numpy as np
+
+from acquisition_order import costs, predict, print_predictions
+
+# serial commands, s and characters (see hardware/RS232.py)
+serial_costs = {'latency': 5.0e-3,    # device processing time per command
+                'chars': 30,          # command + answer characters
+                'stage_commands': 7,  # stage_to_tile and scan, per tile
+                'laser_commands': 2}  # turnOn and turnOff, per wavelength
+
+# assumed compression ratios (uncompressed / stored), by codec
+ratios = {'none': 1.0,
+          'b3d': 10.0,   # quantSigma 1, within the photon noise
+          'gzip': 2.0,
+          'zstd': 2.5,   # also the zarr default
+          'blosc': 2.0}
+
+# required space is the predicted volume times this
+margin = 1.1
+
+res_list = [1, 2, 4, 8]
+
+
+def command_time(baudrate, serial_costs=serial_costs):
+    """
+    Time of one serial command and its answer, in s.
+    """
+    return serial_costs['latency'] + serial_costs['chars']*10.0/baudrate
+
+
+def serial_time(session, laser, stage, serial_costs=serial_costs):
+    """
+    Serial command time per tile the scan waits for: the stage commands
+    of the transition and scan start, and turning the lasers of a pass
+    on and off.
+    """
+    return serial_costs['stage_commands']*command_time(stage.rate,
+                                                       serial_costs) + \
+        serial_costs['laser_commands']*session.nChannels * \
+        command_time(laser.rate, serial_costs)
+
+
+def tile_costs(session, laser, stage, costs=costs,
+               serial_costs=serial_costs):
+    """
+    costs of acquisition_order.predict with the serial command time of
+    a tile added to its overhead.
+    """
+    costs = dict(costs)
+    costs['overhead'] += serial_time(session, laser, stage, serial_costs)
+    return costs
+
+
+def predict_time(session, experiment, laser, stage, costs=costs,
+                 serial_costs=serial_costs):
+    """
+    Predicted duration of the scan, as a dict of s (acquisition,
+    transitions, serial, total) and the number of filter changes.
+    """
+    serial = serial_time(session, laser, stage, serial_costs)
+    total, transitions, wheel_changes = predict(
+        session.order, session, experiment,
+        tile_costs(session, laser, stage, costs, serial_costs),
+        experiment.bidirectional)
+    return {'tiles': len(session.order),
+            'acquisition': len(session.order)*session.xLength /
+            session.scanSpeed,
+            'transitions': transitions - serial*len(session.order),
+            'serial': serial*len(session.order),
+            'total': total,
+            'wheel_changes': wheel_changes}
+
+
+def channel_codec(camera, experiment, wave_str):
+    """
+    Codec name the frames of wave_str are stored with.
+    """
+    if experiment.backend == 'zarr':
+        return 'zstd'
+    if camera.quantSigma[wave_str] == 0:
+        return 'none'
+    return camera.codec
+
+
+def predict_bytes(session, camera, experiment, ratios=ratios):
+    """
+    Predicted data volume, as a list of (level, uncompressed bytes,
+    compressed bytes) over all setups, and the bytes of the raw staging
+    files (backend 'raw', 0 otherwise).
+    """
+    tiles = session.zTiles*session.yTiles
+    shape = (session.nFrames, camera.Y, camera.X)
+    levels = []
+    for z, res in enumerate(res_list):
+        voxels = int(np.prod([np.ceil(n/res) for n in shape]))
+        raw = 0
+        compressed = 0.0
+        for wave_str in experiment.wavelengths:
+            codec = channel_codec(camera, experiment, wave_str)
+            raw += tiles*voxels*2
+            compressed += tiles*voxels*2/ratios[codec]
+        levels.append((z, raw, int(compressed)))
+    staging = 0
+    if experiment.backend == 'raw':
+        staging = tiles*session.nWavelengths*int(np.prod(shape))*2
+    return levels, staging
+
+
+def required_bytes(session, camera, experiment, ratios=ratios):
+    """
+    Space the scan needs on the drive, with the margin.
+    """
+    levels, staging = predict_bytes(session, camera, experiment, ratios)
+    return int(margin*(sum(compressed for z, raw, compressed in levels) +
+                       staging))
+
+
+def free_bytes(path):
+    """
+    Free space on the drive of path, which need not exist yet.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def check_disk_space(session, camera, experiment, ratios=ratios):
+    """
+    Raise if the predicted volume of the scan does not fit on the drive.
+    """
+    needed = required_bytes(session, camera, experiment, ratios)
+    free = free_bytes(experiment.path())
+    if needed > free:
+        raise Exception('not enough free space for ' + experiment.path() +
+                        ': ' + str(round(needed/1e9, 1)) + ' GB needed, ' +
+                        str(round(free/1e9, 1)) + ' GB free!')
+    print('Disk space: ' + str(round(needed/1e9, 1)) + ' GB needed, ' +
+          str(round(free/1e9, 1)) + ' GB free')
+
+
+def plan(experiment, camera, laser, stage, costs=costs,
+         serial_costs=serial_costs, ratios=ratios):
+    """
+    Predictions for a scan with the lsmfx settings objects of
+    lsm-python-main.py, as a dict (session, costs, time, levels,
+    staging, required, free).
+    """
+    import lsmfx
+    session = lsmfx.scan(experiment, camera)
+    levels, staging = predict_bytes(session, camera, experiment, ratios)
+    return {'session': session,
+            'costs': tile_costs(session, laser, stage, costs, serial_costs),
+            'time': predict_time(session, experiment, laser, stage, costs,
+                                 serial_costs),
+            'levels': levels,
+            'staging': staging,
+            'required': required_bytes(session, camera, experiment, ratios),
+            'free': free_bytes(experiment.path())}
+
+
+def print_plan(predictions, experiment, camera):
+    session = predictions['session']
+    time = predictions['time']
+    print('Scan: ' + str(session.zTiles) + ' z x ' + str(session.yTiles) +
+          ' y tiles, ' + str(session.nWavelengths) + ' wavelengths (' +
+          str(time['tiles']) + ' passes of ' + str(session.nChannels) +
+          '), ' + str(session.framesPerTile) + ' frames of ' +
+          str(camera.Y) + ' x ' + str(camera.X) + ' per pass, ' +
+          str(round(session.scanSpeed, 4)) + ' mm/s')
+    print('Time: %.3f h (acquisition %.3f h, transitions %.3f h, serial '
+          'commands %.3f h), %d filter changes' %
+          (time['total']/3600, time['acquisition']/3600,
+           time['transitions']/3600, time['serial']/3600,
+           time['wheel_changes']))
+    print('%-6s %14s %14s' % ('level', 'raw GB', 'stored GB'))
+    for z, raw, compressed in predictions['levels']:
+        print('%-6d %14.2f %14.2f' % (z, raw/1e9, compressed/1e9))
+    if predictions['staging']:
+        print('raw staging files: %.2f GB' % (predictions['staging']/1e9))
+    fits = predictions['required'] <= predictions['free']
+    print('Disk: %.1f GB needed, %.1f GB free on %s%s' %
+          (predictions['required']/1e9, predictions['free']/1e9,
+           experiment.path(), '' if fits else '  NOT ENOUGH SPACE'))
+    print_predictions(session, experiment, experiment.order,
+                      costs=predictions['costs'],
+                      bidirectional=experiment.bidirectional,
+                      channels=session.nChannels)
+    return fits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Predict the duration, data volume and disk space of '
+                    'a scan without touching the hardware')
+    parser.add_argument('settings', nargs='?', default='lsm-python-main.py',
+                        help='script that builds the settings objects')
+    parser.add_argument('--order', default=None,
+                        help='acquisition order, see acquisition_order.py')
+    args = parser.parse_args()
+    # runs the settings part only, scan3D is behind __main__
+    settings = runpy.run_path(args.settings)
+    experiment = settings['experimentObj']
+    camera = settings['cameraObj']
+    if args.order is not None:
+        experiment.order = args.order
+    print_plan(plan(experiment, camera, settings['laserObj'],
+                    settings['stageObj']), experiment, camera)
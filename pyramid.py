@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+"""
+Incremental resolution pyramid for the BigDataViewer levels
+
+Each level is computed from the one above it with a 2x2x2 mean. Frames
+that cannot be paired at the end of a block are carried over to the next
+block, so every level is exact regardless of the block size, and only the
+final (odd) frame of a level is averaged on its own when the tile ends.
+Memory stays bounded to one block per level plus one carried frame.
+
+"""
+import numpy as np
+
+
+def downsample(img_3d):
+    """
+    2x2x2 mean of an (n, Y, X) array with an even number of frames.
+
+    The pairs along each axis are taken from a reshaped view of the input
+    and summed in float32, so the input is never copied or padded (unless
+    Y or X is odd, in which case the last row / column is repeated, i.e.
+    the edge is averaged over the pixels that exist).
+    """
+    n, Y, X = img_3d.shape
+    assert n % 2 == 0
+    if Y % 2 or X % 2:
+        img_3d = np.pad(img_3d, ((0, 0), (0, Y % 2), (0, X % 2)), mode='edge')
+        n, Y, X = img_3d.shape
+
+    v = img_3d.reshape(n//2, 2, Y//2, 2, X//2, 2)
+    out = np.add(v[:, 0], v[:, 1], dtype=np.float32)  # (n/2, Y/2, 2, X/2, 2)
+    out = np.add(out[:, :, 0], out[:, :, 1])  # (n/2, Y/2, X/2, 2)
+    out = np.add(out[..., 0], out[..., 1])  # (n/2, Y/2, X/2)
+    out *= 0.125
+    return out
+
+
+def downsample_single(frame):
+    """
+    2x2 mean of a single (1, Y, X) frame, used for the last unpaired frame
+    of a level when the tile ends.
+    """
+    return downsample(np.concatenate((frame, frame)))
+
+
+class PyramidBuilder(object):
+    """
+    Streaming pyramid for one setup (tile / channel).
+
+    push() takes consecutive blocks of full resolution frames and returns
+    the pieces to write as (level, first frame, frames) tuples. Level 0 is
+    passed through untouched, lower levels are float32 until to_output.
+    finish() flushes the carried frames once the tile is complete.
+
+    Parameters
+    ----------
+
+    n_levels
+        number of levels (4 for res_list [1, 2, 4, 8])
+
+    start
+        index of the first full resolution frame that will be pushed
+    """
+
+    def __init__(self, n_levels=4, start=0):
+        self.n_levels = n_levels
+        self.next = [int(start // 2**z) for z in range(n_levels)]
+        self.carry = [None]*n_levels  # unpaired input frame per level
+
+    def push(self, img_3d):
+        pieces = [(0, self.next[0], img_3d)]
+        self.next[0] += img_3d.shape[0]
+        self._feed(1, img_3d, pieces)
+        return pieces
+
+    def finish(self):
+        """
+        Average the remaining unpaired frames on their own, matching the
+        ceil(nFrames/res) size of the lower levels.
+        """
+        pieces = []
+        for z in range(1, self.n_levels):
+            if self.carry[z] is not None:
+                frame = downsample_single(self.carry[z])
+                self.carry[z] = None
+                pieces.append((z, self.next[z], frame))
+                self.next[z] += 1
+                self._feed(z + 1, frame, pieces)
+        return pieces
+
+    def _feed(self, z, frames, pieces):
+        if z >= self.n_levels or frames.shape[0] == 0:
+            return
+
+        out = []
+        if self.carry[z] is not None:
+            out.append(downsample(np.concatenate((self.carry[z], frames[0:1]))))
+            frames = frames[1:]
+            self.carry[z] = None
+
+        even = frames.shape[0] - frames.shape[0] % 2
+        if even:
+            out.append(downsample(frames[0:even]))
+        if even < frames.shape[0]:
+            self.carry[z] = np.array(frames[even:])
+
+        if not out:
+            return
+        level = out[0] if len(out) == 1 else np.concatenate(out)
+        pieces.append((z, self.next[z], level))
+        self.next[z] += level.shape[0]
+        self._feed(z + 1, level, pieces)
+
+
+def to_output(img_3d, dtype='int16'):
+    """
+    Round the float levels to uint16 and reinterpret as dtype without
+    another copy. data.h5 stores int16 (the same bits h5write stores with
+    astype('int16')).
+    """
+    if img_3d.dtype.kind == 'f':
+        img_3d = np.rint(img_3d).astype('uint16')
+    return img_3d.view(dtype)
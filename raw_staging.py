@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+"""
+Raw memory-mapped staging of a scan, with deferred HDF5 conversion
+
+For the fastest scans the frame loop writes the cropped frames straight
+into one preallocated np.memmap file per setup (sNN.raw, nFrames x Y x X
+uint16), so acquisition only costs a memory copy per frame. Pyramid and
+compression are done afterwards, or alongside the run, by the converter:
+
+    python raw_staging.py A:\\sample\\staging A:\\sample\\data.h5 --workers 8
+    python raw_staging.py A:\\sample\\staging A:\\sample\\data.h5 --watch
+
+data.h5 / data.xml are initialized as usual (h5init, write_xml) when the
+scan starts. manifest.json in the staging directory records which setups
+are complete, so the converter can follow a running scan (--watch).
+
+The converter handles the setups one after another: data.h5 has a single
+writer, so only the chunk compression (--workers) runs in parallel. A
+conversion without compression (quantSigma 0, or --workers 0) is bound by
+one core building the pyramid and by the disk.
+
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import threading
+import time as timer
+import numpy as np
+
+from h5_writer import H5Writer
+
+
+class RawStaging(object):
+    """
+    Staging files of one scan. Replaces the BackgroundWriter in the frame
+    loop: the buffers handed out by start / get_buffer are views of the
+    memmap of the current setup, so the loop fills the file directly.
+    The memmap of a finished setup is flushed (and marked complete in the
+    manifest) on a background thread, not between tiles.
+
+    Parameters
+    ----------
+
+    directory
+        staging directory, created if needed
+
+    shape
+        (nFrames, Y, X) of one setup
+
+    blockSize
+        frames per buffer handed to the frame loop
+    """
+
+    def __init__(self, directory, shape, blockSize):
+        self.directory = directory
+        self.shape = tuple(int(n) for n in shape)
+        self.blockSize = int(blockSize)
+        os.makedirs(directory, exist_ok=True)
+        # the manifest is also saved by the flushing thread
+        self.lock = threading.Lock()
+        self.flusher = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='RawStaging')
+        self.flushes = []
+        self.manifest = {'shape': list(self.shape),
+                         'dtype': 'uint16',
+                         'setups': {}}
+        self.save_manifest()
+
+        self.idx = None
+        self.data = None
+        self.pos = 0
+
+        # counters
+        self.frames_written = 0
+        self.flush_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def save_manifest(self):
+        with self.lock:
+            tmp = os.path.join(self.directory, 'manifest.json.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.manifest, f, indent=1)
+            os.replace(tmp, os.path.join(self.directory, 'manifest.json'))
+
+    def start(self, idx):
+        """
+        Open (create) the staging file of setup idx and return the buffer
+        for its first block.
+        """
+        self.end()
+        name = 's' + str(idx).zfill(2) + '.raw'
+        self.data = np.memmap(os.path.join(self.directory, name),
+                              dtype='uint16', mode='w+', shape=self.shape)
+        self.idx = idx
+        self.pos = 0
+        with self.lock:
+            self.manifest['setups'][str(idx)] = {'file': name,
+                                                 'frames': 0,
+                                                 'complete': False}
+        self.save_manifest()
+        return self.get_buffer()
+
+    def get_buffer(self):
+        """
+        View of the next blockSize frames of the current setup. The view is
+        shorter at the end of the file.
+        """
+        return self.data[self.pos:self.pos + self.blockSize]
+
+    def submit(self, buffer, n, idx, ind1, ind2):
+        """
+        Record that frames ind1 - ind1 + n of setup idx were filled, same
+        arguments as BackgroundWriter.submit.
+        """
+        if idx != self.idx:
+            raise Exception('setup ' + str(idx) + ' is not being staged')
+        self.pos = ind1 + n
+        self.frames_written += n
+        with self.lock:
+            self.manifest['setups'][str(idx)]['frames'] = self.pos
+
+    def annotate(self, idx, attrs):
+        """
+        Record attrs (camera_loop.FrameStats) with setup idx in the
+        manifest, the converter stores them in data.h5.
+        """
+        with self.lock:
+            self.manifest['setups'][str(idx)]['frame_stats'] = dict(attrs)
+
+    def end(self):
+        """
+        Hand the current setup to the flushing thread, which writes it to
+        disk and marks it complete. Re-raises an error of an earlier flush.
+        """
+        self._check()
+        if self.data is None:
+            return
+        self.flushes.append(self.flusher.submit(self._flush, self.data,
+                                                self.idx))
+        self.data = None
+        self.idx = None
+
+    def _flush(self, data, idx):
+        start = timer.perf_counter()
+        data.flush()
+        self.flush_time += timer.perf_counter() - start
+        with self.lock:
+            self.manifest['setups'][str(idx)]['complete'] = True
+        self.save_manifest()
+
+    def _check(self):
+        done = [future for future in self.flushes if future.done()]
+        self.flushes = [future for future in self.flushes
+                        if not future.done()]
+        for future in done:
+            future.result()
+
+    def stats(self):
+        """
+        Counters as in BackgroundWriter.stats, the frame loop never waits
+        for a memmap view.
+        """
+        return {'frames_written': self.frames_written,
+                'write_time': self.flush_time,
+                'producer_wait': 0.0}
+
+    def print_stats(self):
+        print('Staged frames: ' + str(self.frames_written) +
+              ', flush time: ' + str(round(self.flush_time, 3)) + ' s')
+
+    def close(self):
+        """
+        Flush the last setup and wait for the flushing thread.
+        """
+        try:
+            self.end()
+        finally:
+            self.flusher.shutdown(wait=True)
+        self._check()
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def convert_setup(directory, manifest, idx, writer, blockSize):
+    """
+    Write one staged setup to data.h5 through writer (an H5Writer).
+    """
+    entry = manifest['setups'][str(idx)]
+    data = np.memmap(os.path.join(directory, entry['file']),
+                     dtype=manifest['dtype'], mode='r',
+                     shape=tuple(manifest['shape']))
+    nFrames = data.shape[0]
+    for ind1 in range(0, nFrames, blockSize):
+        ind2 = min(ind1 + blockSize, nFrames)
+        writer.write(np.asarray(data[ind1:ind2]), idx, ind1, ind2)
+    writer.finish(idx)
+    if 'frame_stats' in entry:
+        writer.annotate(idx, entry['frame_stats'])
+    del data
+
+
+def convert(directory, dest, workers=0, watch=False, poll=5.0, delete=False):
+    """
+    Convert all complete setups in the staging directory into dest
+    (a data.h5 initialized by h5init), one setup after the other. Chunks
+    are compressed in a pool of workers processes (see H5Writer). With watch, keep polling the
+    manifest until every setup of a running scan has been converted.
+
+    Returns the number of frames converted.
+    """
+    done = set()
+    frames = 0
+    start = timer.time()
+
+    with H5Writer(dest, workers) as writer:
+        blockSize = 2*writer.layout['chunks'][0] if writer.layout else 512
+        total = None
+        if writer.layout:
+            total = writer.layout['zTiles']*writer.layout['yTiles'] * \
+                len(writer.layout['channels'])
+
+        while True:
+            manifest = read_manifest(directory)
+            pending = [int(idx) for idx, entry in manifest['setups'].items()
+                       if entry['complete'] and int(idx) not in done]
+            for idx in sorted(pending):
+                print('Converting setup ' + str(idx))
+                convert_setup(directory, manifest, idx, writer, blockSize)
+                writer.flush()
+                done.add(idx)
+                frames += manifest['shape'][0]
+                if delete:
+                    os.remove(os.path.join(directory,
+                                           manifest['setups'][str(idx)]['file']))
+
+            if not watch or (total is not None and len(done) >= total):
+                break
+            if not pending:
+                timer.sleep(poll)
+
+    elapsed = timer.time() - start
+    print('Converted ' + str(len(done)) + ' setups, ' + str(frames) +
+          ' frames in ' + str(round(elapsed, 1)) + ' s')
+    return frames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert raw staging files into a BigDataViewer data.h5')
+    parser.add_argument('staging', help='staging directory')
+    parser.add_argument('dest', help='data.h5 created by the scan')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='compression processes (0 = HDF5 filter pipeline)')
+    parser.add_argument('--watch', action='store_true',
+                        help='follow a running scan until all setups are done')
+    parser.add_argument('--delete', action='store_true',
+                        help='delete each staging file once converted')
+    args = parser.parse_args()
+    convert(args.staging, args.dest, args.workers, args.watch,
+            delete=args.delete)
@@ -0,0 +1,353 @@
+#!/usr/bin/python
+
+"""
+Unattended queue of scans
+
+Runs several experiments back to back on one HardwareSession, without
+the prompts of lsm-python-main.py (laser system name, data directory
+deletion), e.g. overnight:
+
+    python run_queue.py sample1.json sample2.json sample3.json
+
+Each queue item is a JSON file with the sections of static_params.json
+it changes, as lsm-python-main.py would set them, e.g.
+
+    {"experiment": {"fname": "sample1", "drive": "A",
+                    "xMin": -5.07, "xMax": -3.07, "yMin": 5.4,
+                    "yMax": 10.3, "zMin": 0.19, "zMax": 0.28,
+                    "wavelengths": {"561": 1550},
+                    "attenuations": {"561": 15}},
+     "camera": {"quantSigma": {"561": 1.0}},
+     "daq": {"ymax": {"561": 2.445}},
+     "image_wells": {"option": "yes", "well_numbers": [1, 2, 3]}}
+
+Every section replaces the keys it names, the others come from
+static_params.json.
+
+All items are validated before the first one starts (scan geometry,
+wavelengths known to the laser, filter wheel and DAQ, laser currents,
+the conda environment B3D compression needs (camera B3Denv), data
+directories that do not exist yet, the same connection_settings
+for all items, see hardware_session.py, and the disk space of the whole
+queue, see planner.py); any error stops the queue before the hardware
+is touched.
+
+The progress is kept in a state file (queue_state.json), rewritten after
+every status change:
+
+    pending       not started
+    running       started, not finished
+    done          finished
+    failed        raised an error (the queue stops, unless --keep-going)
+    interrupted   was running when the queue crashed
+
+Running the same command again (or python run_queue.py with the state
+file alone) resumes at the next pending item. Interrupted and failed
+items are not retried: their data directory already exists, and is left
+for the user to inspect. --retry sets them back to pending, once their
+directory has been removed or renamed.
+
+"""
+import argparse
+import copy
+import json
+import os
+import time as timer
+import traceback
+
+import hivex_puck as puck
+import lsmfx
+from h5_writer import b3d_env_error
+from hardware_session import HardwareSession, connection_settings
+from planner import plan
+
+sections = ('camera', 'experiment', 'daq', 'laser', 'wheel', 'etl', 'stage',
+            'image_wells', 'simulation')
+
+# keyed by wavelength, every wavelength of an experiment needs an entry
+per_wavelength = (('experiment', 'attenuations'), ('camera', 'quantSigma'),
+                  ('laser', 'names_to_channels'),
+                  ('daq', 'xmin'), ('daq', 'xmax'), ('daq', 'xpp'),
+                  ('daq', 'ymin'), ('daq', 'ymax'), ('daq', 'ypp'),
+                  ('daq', 'econst'))
+
+
+def load_settings(path, static_params):
+    """
+    static_params with the sections of the queue item at path.
+    """
+    with open(path, 'r') as read_file:
+        item = json.load(read_file)
+    unknown = [name for name in item if name not in sections]
+    if unknown:
+        raise Exception(path + ': unknown sections ' + ', '.join(unknown))
+    settings = copy.deepcopy(static_params)
+    for name in item:
+        settings.setdefault(name, {}).update(item[name])
+    return settings
+
+
+def settings_objects(settings):
+    """
+    lsmfx settings objects of settings, as a dict by section.
+    """
+    return {'experiment': lsmfx.experiment(settings['experiment']),
+            'camera': lsmfx.camera(settings['camera']),
+            'daq': lsmfx.daq(settings['daq']),
+            'laser': lsmfx.laser(settings['laser']),
+            'wheel': lsmfx.wheel(settings['wheel']),
+            'etl': lsmfx.etl(settings['etl']),
+            'stage': lsmfx.stage(settings['stage']),
+            'image_wells': settings.get('image_wells', {'option': 'no'}),
+            'simulation': lsmfx.simulation(settings.get('simulation', {}))}
+
+
+def experiments(objects):
+    """
+    Experiment of every scan of a queue item: one, or one per well as
+    scan3D_image_wells sets them.
+    """
+    experiment = objects['experiment']
+    image_wells = objects['image_wells']
+    if image_wells.get('option') != 'yes':
+        return [experiment]
+    wells = []
+    for well_number in image_wells['well_numbers']:
+        well = puck.well(well_number, copy.copy(experiment))
+        well.fname = experiment.fname + '_well_' + str(well_number)
+        wells.append(well)
+    return wells
+
+
+def validate(settings, objects):
+    """
+    Check a queue item without touching the hardware. Returns a list of
+    errors and the plan (planner.plan) of each of its scans.
+    """
+    errors = []
+    plans = []
+    for experiment in experiments(objects):
+        scan_errors = []
+        for section, name in per_wavelength:
+            missing = [wave for wave in experiment.wavelengths
+                       if wave not in settings[section][name]]
+            if missing:
+                scan_errors.append(section + ' ' + name + ' has no ' +
+                                   ', '.join(missing))
+        if os.path.exists(experiment.path()):
+            scan_errors.append(experiment.path() + ' already exists')
+        if scan_errors:
+            errors += scan_errors
+            continue
+        try:
+            predictions = plan(experiment, objects['camera'],
+                               objects['laser'], objects['stage'])
+            session = predictions['session']
+            if session.nChannels > 1:
+                positions = ['multiband']
+            else:
+                positions = list(experiment.wavelengths)
+            missing = [name for name in positions
+                       if name not in objects['wheel'].names_to_channels]
+            if missing:
+                errors.append('wheel names_to_channels has no ' +
+                              ', '.join(missing))
+            objects['laser'].check_currents(experiment, session)
+            if experiment.backend in ('h5', 'raw'):
+                error = b3d_env_error(objects['camera'], experiment)
+                if error is not None:
+                    errors.append(error)
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        plans.append((experiment, predictions))
+    return errors, plans
+
+
+def validate_queue(items, static_params):
+    """
+    Validate the pending items of the queue, print what they will
+    acquire and raise if any of them cannot run.
+    """
+    errors = []
+    first = None
+    paths = set()
+    needed = {}  # bytes per drive
+    free = {}
+    total_time = 0.0
+    for item in items:
+        if item['status'] != 'pending':
+            continue
+        name = os.path.basename(item['file'])
+        try:
+            settings = load_settings(item['file'], static_params)
+            objects = settings_objects(settings)
+        except Exception as e:
+            errors.append(name + ': ' + repr(e))
+            continue
+
+        # one hardware session for the whole queue
+        connection = connection_settings(objects['camera'], objects['daq'],
+                                         objects['laser'], objects['wheel'],
+                                         objects['etl'], objects['stage'])
+        connection['simulation'] = settings.get('simulation', {})
+        if first is None:
+            first = (name, connection)
+        else:
+            for section in connection:
+                for key in connection[section]:
+                    if connection[section][key] != first[1][section].get(key):
+                        errors.append(name + ': ' + section + ' ' + key +
+                                      ' differs from ' + first[0] +
+                                      ' (queue it separately)')
+
+        item_errors, plans = validate(settings, objects)
+        errors += [name + ': ' + error for error in item_errors]
+        for experiment, predictions in plans:
+            if experiment.path() in paths:
+                errors.append(name + ': ' + experiment.path() +
+                              ' is used by an earlier item')
+            paths.add(experiment.path())
+            needed[experiment.drive] = needed.get(experiment.drive, 0) + \
+                predictions['required']
+            free.setdefault(experiment.drive, predictions['free'])
+            total_time += predictions['time']['total']
+            print('%-24s %-40s %8.2f h %10.1f GB' %
+                  (name, experiment.fname,
+                   predictions['time']['total']/3600,
+                   predictions['required']/1e9))
+
+    for drive in needed:
+        print('Drive ' + drive + ': ' + str(round(needed[drive]/1e9, 1)) +
+              ' GB needed, ' + str(round(free[drive]/1e9, 1)) + ' GB free')
+        if needed[drive] > free[drive]:
+            errors.append('not enough free space on ' + drive + ' for the '
+                          'queue')
+    if first is not None:
+        print('Laser system: ' + first[1]['laser']['skyra_system_name'])
+    print('Predicted queue time: ' + str(round(total_time/3600, 2)) + ' h')
+
+    if errors:
+        raise Exception('invalid queue:\n  ' + '\n  '.join(errors))
+
+
+def load_state(path, files):
+    """
+    Queue items of the state file at path, with the files not in it
+    appended as pending. Items left running by a crash are interrupted.
+    """
+    items = []
+    if os.path.exists(path):
+        with open(path, 'r') as read_file:
+            items = json.load(read_file)['items']
+    known = set(item['file'] for item in items)
+    for f in files:
+        f = os.path.abspath(f)
+        if f not in known:
+            items.append({'file': f, 'status': 'pending'})
+            known.add(f)
+    for item in items:
+        if item['status'] == 'running':
+            item['status'] = 'interrupted'
+    return items
+
+
+def save_state(path, items):
+    # written to a temporary file first, a crash never leaves half a file
+    with open(path + '.tmp', 'w') as write_file:
+        json.dump({'items': items}, write_file, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def print_state(items):
+    for item in items:
+        print('%-12s %s' % (item['status'], item['file']) +
+              (' (' + item['error'] + ')' if 'error' in item else ''))
+
+
+def run_queue(items, state_path, static_params, keep_going=False):
+    """
+    Run the pending items one after the other on one HardwareSession,
+    saving the state after every status change.
+    """
+    hardware = None
+    try:
+        for item in items:
+            if item['status'] != 'pending':
+                continue
+            objects = settings_objects(load_settings(item['file'],
+                                                     static_params))
+            if hardware is None:
+                hardware = HardwareSession(objects['camera'], objects['daq'],
+                                           objects['laser'], objects['wheel'],
+                                           objects['etl'], objects['stage'],
+                                           objects['simulation'],
+                                           confirm=False)
+
+            print('Queue: starting ' + item['file'])
+            item['status'] = 'running'
+            item['started'] = timer.time()
+            save_state(state_path, items)
+            try:
+                lsmfx.scan3D(objects['experiment'], objects['camera'],
+                             objects['daq'], objects['laser'],
+                             objects['wheel'], objects['etl'],
+                             objects['stage'], objects['image_wells'],
+                             objects['simulation'], hardware=hardware,
+                             prompt=False)
+            except Exception as e:
+                item['status'] = 'failed'
+                item['error'] = repr(e)
+                item['finished'] = timer.time()
+                save_state(state_path, items)
+                if not keep_going:
+                    raise
+                traceback.print_exc()
+                # connect again for the next item
+                hardware.close()
+                hardware = None
+                continue
+            item['status'] = 'done'
+            item['finished'] = timer.time()
+            save_state(state_path, items)
+            print('Queue: finished ' + item['file'] + ' in ' +
+                  str(round((item['finished'] - item['started'])/3600, 3)) +
+                  ' hrs')
+    finally:
+        if hardware is not None:
+            hardware.close()
+        print_state(items)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run a queue of experiments without prompts')
+    parser.add_argument('files', nargs='*',
+                        help='queue item JSON files, in order (appended to '
+                             'the queue of the state file)')
+    parser.add_argument('--state', default='queue_state.json',
+                        help='progress of the queue, resumed from if it '
+                             'exists')
+    parser.add_argument('--static', default='static_params.json',
+                        help='settings the items change')
+    parser.add_argument('--keep-going', action='store_true',
+                        help='go on with the next item after an error')
+    parser.add_argument('--retry', action='store_true',
+                        help='run interrupted and failed items again')
+    parser.add_argument('--check', action='store_true',
+                        help='only validate the queue')
+    args = parser.parse_args()
+
+    with open(args.static, 'r') as read_file:
+        static_params = json.load(read_file)
+    items = load_state(args.state, args.files)
+    if args.retry:
+        for item in items:
+            if item['status'] in ('interrupted', 'failed'):
+                item['status'] = 'pending'
+                item.pop('error', None)
+
+    validate_queue(items, static_params)
+    if not args.check:
+        save_state(args.state, items)
+        run_queue(items, args.state, static_params, args.keep_going)
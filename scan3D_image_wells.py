@@ -10,19 +10,26 @@ LSM scanning code
 """
 import numpy as np
 import math
-import h5py
 import os.path
+import sys
 import shutil
-import skimage.transform
-import pco
 # Tiger or MS2000 are imported below based on stage model param
-import hardware.ni as ni
-import hardware.fw102c as fw102c
-import hardware.skyra as skyra
-from hardware.opto import Opto
 import time as timer
 import shutil
 import hivex_puck as puck
+from h5_writer import h5init, H5Writer
+from background_writer import BackgroundWriter, SharedWriter, close_writers
+from camera_loop import CameraLoops, FrameStats
+from telemetry import Telemetry
+from waveform_cache import WaveformCache
+from zarr_writer import zarrinit, ZarrWriter
+from raw_staging import RawStaging
+from planner import check_disk_space
+from hardware_session import HardwareSession
+from tile_transition import TileTransition, stage_to_tile, laser_currents
+from acquisition_order import acquisition_order, reversed_setups, print_predictions
+from interleave import Deinterleaver, frame_period, interleave_voltages
+import hardware.simulated as simulated
 
 
 class experiment(object):
@@ -57,6 +64,14 @@ class experiment(object):
     theta
 
     overlap
+
+    backend
+        'h5' (data.h5 + data.xml, default), 'zarr' (data.ome.zarr) or
+        'raw' (memmap staging files, converted to data.h5 afterwards)
+
+    interleaved
+        acquire all wavelengths in one stage pass per tile, alternating
+        the lasers frame by frame (see interleave.py)
     """
 
     def __init__(self, experiment_dict):
@@ -72,6 +87,10 @@ class experiment(object):
         self.theta = experiment_dict['theta']
         self.overlapY = experiment_dict['overlapY']
         self.overlapZ = experiment_dict['overlapZ']
+        self.backend = experiment_dict.get('backend', 'h5')
+        self.order = experiment_dict.get('order', 'channel_innermost')
+        self.bidirectional = experiment_dict.get('bidirectional', False)
+        self.interleaved = experiment_dict.get('interleaved', False)
 
         ## If imaging pre-defined coordinates for hivex well, these keys will not be defined until lsmfx is opened 
         check_for_keys = 'xMin', 'xMax', 'yMin', 'yMax', 'zMin', 'zMax'
@@ -86,6 +105,17 @@ class experiment(object):
         else:
             print('not all keys are defined yet')
 
+    def path(self, *names):
+        """
+        Path in the data directory of the experiment. drive is a Windows
+        drive letter (e.g. 'A' -> A:\\fname) or any directory.
+        """
+        if len(self.drive) == 1 and self.drive.isalpha():
+            root = self.drive + ':\\'
+        else:
+            root = self.drive
+        return os.path.join(root, self.fname, *names)
+
 class scan(object):
     def __init__(self, experiment, camera):
 
@@ -102,8 +132,30 @@ class scan(object):
         self.yTiles = int(round(self.yLength/experiment.yWidth))
         self.zTiles = int(round(self.zLength/experiment.zWidth))
 
+        # channels acquired in one pass of the stage: all of them with
+        # interleaved acquisition (nWavelengths frames per xWidth, one per
+        # channel), one per camera with dual camera acquisition
+        self.interleaved = experiment.interleaved and self.nWavelengths > 1
+        if camera.number2 is not None and self.nWavelengths > 1:
+            self.nCameras = 2
+        else:
+            self.nCameras = 1
+        if self.interleaved and self.nCameras > 1:
+            raise Exception('interleaved acquisition uses one camera!')
+        if self.nWavelengths % self.nCameras != 0:
+            raise Exception('dual camera acquisition needs an even ' +
+                            'number of wavelengths!')
+        if (self.interleaved or self.nCameras > 1) and \
+                experiment.backend == 'raw':
+            raise Exception('interleaved and dual camera acquisition ' +
+                            'need the h5 or zarr backend!')
+        self.nChannels = self.nWavelengths if self.interleaved else self.nCameras
+        self.framesPerWidth = self.nWavelengths if self.interleaved else 1
+        self.framesPerTile = self.nFrames*self.framesPerWidth
+
         # setup scan speed and chunk sizes
-        self.scanSpeed = self.setScanSpeed(experiment.xWidth, camera.expTime)
+        self.scanSpeed = self.setScanSpeed(experiment.xWidth, camera.expTime) / \
+            self.framesPerWidth
         self.chunkSize1 = 256
         if self.chunkSize1 >= self.nFrames/8:
             self.chunkSize1 = np.floor(self.nFrames/8)
@@ -117,7 +169,21 @@ class scan(object):
         if self.chunkSize3 >= camera.X/8:
             self.chunkSize3 = np.floor(camera.X/8)
 
-        self.blockSize = int(2*self.chunkSize1)
+        # interleaved blocks hold 2*chunkSize1 frames of each channel
+        self.blockSize = int(2*self.chunkSize1*self.framesPerWidth)
+
+        # number of ring buffers shared with the background writer
+        self.nBuffers = 2
+
+        # order of tiles and channels, and the setups scanned backwards
+        # in X (see acquisition_order.py)
+        # (ch counts passes of nChannels channels)
+        self.order = acquisition_order(experiment.order, self.zTiles,
+                                       self.yTiles,
+                                       self.nWavelengths // self.nChannels)
+        self.reversed = reversed_setups(self.order, self.zTiles,
+                                        self.yTiles, experiment.bidirectional,
+                                        self.nChannels)
 
     def setScanSpeed(self, xWidth, expTime):
 
@@ -130,6 +196,9 @@ class camera(object):
     def __init__(self,
                  camera_dict):
         self.number = camera_dict['number']
+        # pco camera number of the second camera for dual camera
+        # acquisition (see camera_loop.py), None with one camera
+        self.number2 = camera_dict.get('number2', None)
         self.X = camera_dict['X']
         self.Y = camera_dict['Y']
         self.sampling = camera_dict['sampling']
@@ -140,6 +209,15 @@ class camera(object):
         self.compressionMode = camera_dict['compressionMode']
         self.B3Denv = camera_dict['B3Denv']
         self.quantSigma = camera_dict['quantSigma']
+        # B3D compression in worker processes (0 = in the HDF5 filter
+        # pipeline) and the codec used when quantSigma != 0
+        self.compressionWorkers = camera_dict.get('compressionWorkers', 0)
+        self.codec = camera_dict.get('codec', 'b3d')
+        # longest wait for a frame before a tile is ended (s), and the
+        # pco timestamp mode ('off', 'binary', 'binary & ascii'), whose
+        # image counter shows dropped frames (see camera_loop.py)
+        self.frameTimeout = camera_dict.get('frameTimeout', 2.0)
+        self.timestamp = camera_dict.get('timestamp', 'off')
 
 
 class daq(object):
@@ -151,6 +229,12 @@ class daq(object):
         # self.name = daq_dict['name']
         self.num_channels = daq_dict['num_channels']
         self.names_to_channels = daq_dict['names_to_channels']
+        # AO channels of the task: only those in names_to_channels, the
+        # others are never driven
+        self.channels = sorted(set(self.names_to_channels.values()))
+        # 'float64' (volts) or 'int16' (raw DAC codes, a quarter of the
+        # data per write)
+        self.dtype = daq_dict.get('dtype', 'float64')
 
         self.xmin = daq_dict['xmin']
         self.xmax = daq_dict['xmax']
@@ -174,12 +258,20 @@ class laser(object):
         self.max_currents = laser_dict['max_currents']
         self.strobing = laser_dict['strobing']
 
-    def initialize(self, experiment, scan):
+    def initialize(self, experiment, scan, simulation=None):
+
+        import hardware.skyra as skyra
 
         print('initializing laser')
         print('System_name=' + self.skyra_system_name)
-        input('If this is NOT correct, press CTRL+C to exit and avoid damage' +
-              ' to the laser. If this correct, press Enter to continue.')
+        if simulation is not None and simulation.enabled:
+            print('(simulated laser)')
+            tty = simulated.SimulatedSkyra(baudrate=self.rate,
+                                           latency_factor=simulation.latency)
+        else:
+            input('If this is NOT correct, press CTRL+C to exit and avoid damage' +
+                  ' to the laser. If this correct, press Enter to continue.')
+            tty = None
 
         min_currents_sk_num = {}
         max_currents_sk_num = {}
@@ -194,7 +286,8 @@ class laser(object):
                 self.max_powers[ch]
 
         skyraLaser = skyra.Skyra(baudrate=self.rate,
-                                 port=self.port)
+                                 port=self.port,
+                                 tty=tty)
         skyraLaser.setMinCurrents(min_currents_sk_num)
         skyraLaser.setMaxCurrents(max_currents_sk_num)
 
@@ -261,18 +354,23 @@ class stage(object):
                          }
         self.axes = ('X', 'Y', 'Z')
 
-    def initialize(self):
+    def initialize(self, simulation=None):
+
+        tty = None
+        if simulation is not None and simulation.enabled:
+            tty = simulated.SimulatedASIStage(baudrate=self.rate,
+                                              latency_factor=simulation.latency)
 
         if self.model == 'tiger':
             print('initializing stage: Tiger')
             import hardware.tiger as tiger
-            xyzStage = tiger.TIGER(baudrate=self.rate, port=self.port)
+            xyzStage = tiger.TIGER(baudrate=self.rate, port=self.port, tty=tty)
             xyzStage.setPLCPreset(6, 52)
 
         elif self.model == 'ms2000':
             print('initializing stage: MS2000')
             import hardware.ms2000 as ms2000
-            xyzStage = ms2000.MS2000(baudrate=self.rate, port=self.port)
+            xyzStage = ms2000.MS2000(baudrate=self.rate, port=self.port, tty=tty)
             xyzStage.setTTL('Y', 3)
 
         else:
@@ -280,10 +378,9 @@ class stage(object):
 
         initialPos = xyzStage.getPosition()
         xyzStage.setScanF(1)
-        for ax in self.axes:
-            xyzStage.setBacklash(ax, self.settings['backlash'])
-            xyzStage.setVelocity(ax, self.settings['velocity'])
-            xyzStage.setAcceleration(ax, self.settings['acceleration'])
+        xyzStage.setBacklashes({ax: self.settings['backlash'] for ax in self.axes})
+        xyzStage.setVelocities({ax: self.settings['velocity'] for ax in self.axes})
+        xyzStage.setAccelerations({ax: self.settings['acceleration'] for ax in self.axes})
         print('stage initialized', initialPos)
         return xyzStage, initialPos
 
@@ -292,10 +389,12 @@ class stage(object):
 # initialize hardware
 # scan tiles
 
-def scan3D_image_wells(experiment, camera, daq, laser, wheel, etl, stage, image_wells):
+def scan3D_image_wells(experiment, camera, daq, laser, wheel, etl, stage, image_wells,
+                       simulation=None, hardware=None, prompt=True):
+    # hardware, prompt: see lsmfx.scan3D
 
     if image_wells['option'] == 'yes':
-        experiment.fname += '_well_N' ## re-format file name for well-based imaging
+        fname = experiment.fname ## file name of each well: fname_well_<number>
 
         ## Check to make sure that well numbers were defined by the user
         try:
@@ -303,262 +402,306 @@ def scan3D_image_wells(experiment, camera, daq, laser, wheel, etl, stage, image_
         except NameError:
             print('Well numbers are not defined')
 
-        for well_number in image_wells['well_numbers']:
-            experiment = puck.well(well_number, experiment) ## Define imaging coordinates for this well
-            fname_end = str(experiment.fname).split('_')[-1]
-            experiment.fname = experiment.fname.replace(fname_end, str(well_number)) ## adjust fname
-            
-            # ROUND SCAN DIMENSIONS & SETUP IMAGING SESSION
-            session = scan(experiment, camera)
-
-            # SETUP DATA DIRECTORY
-            ## Check if drive already exists. If so, provide option to delete
-            if os.path.exists(experiment.drive + ':\\' + experiment.fname):
-                userinput = input('this file directory already exists! permanently delete? [y/n]')
-                if userinput == 'y':
-                    shutil.rmtree(experiment.drive + ':\\' + experiment.fname, ignore_errors=True)
-                if userinput== 'n':
-                    sys.exit('--Terminating-- re-name write directory and try again')
-
-            os.makedirs(experiment.drive + ':\\' + experiment.fname)
-            dest = experiment.drive + ':\\' + experiment.fname + '\\data.h5'
-
-            # # Save a copy of all files in the current directory, i.e. so user can refer to experiment settings and could reproduce experiment entirely
-            # src = os.getcwd()
-            # settings_rxiv = experiment.drive + ':\\' + experiment.fname + '\\settings and code archive\\'
-            # shutil.copytree(src,dst=settings_rxiv)
-
-            #  CONNECT XYZ STAGE
-            xyzStage, initialPos = stage.initialize()
-            print(xyzStage)
-
-            #  INITIALIZE H5 FILE
-            h5init(dest, camera, session, experiment)
-            write_xml(experiment=experiment, camera=camera, scan=session)
-
-            # CONNECT NIDAQ
-            waveformGenerator = ni.waveformGenerator(daq=daq,
-                                                     camera=camera,
-                                                     session=session,
-                                                     triggered=True)
-
-            # CONNECT LASER
-
-            # according to the manual, you should wait for 2min after setting
-            # laser 1 (561) to mod mode for power to stabalize. Consider adding this in
-            # TODO: disentangle laser and experiment attributes
-            skyraLaser = laser.initialize(experiment, session)
-            print(skyraLaser)
-
-            # CONNECT FILTER WHEEL
-
-            fWheel = fw102c.FW102C(baudrate=wheel.rate, port=wheel.port)
-            print(fWheel)
-
-            # CONNECT TUNBALE LENS
-
-            etl = Opto(port=etl.port)
-            etl.connect()
-            etl.mode('analog')
-            print(etl)
+        # devices are connected at the first well and kept for the others
+        # (see hardware_session.py)
+        owner = hardware is None
+        if owner:
+            hardware = HardwareSession(camera, daq, laser, wheel, etl, stage,
+                                       simulation, confirm=prompt)
 
-            # CONNECT CAMERA
-            # TODO: setup separate hardware initialization method within camera
-
-            cam = pco.Camera(camera_number=camera.number)
-
-            cam.configuration = {'exposure time': camera.expTime*1.0e-3,
-                                 'roi': (1,
-                                         1023-round(camera.Y/2),
-                                         2060,
-                                         1026+round(camera.Y/2)),
-                                 'trigger': camera.triggerMode,
-                                 'acquire': camera.acquireMode,
-                                 'pixel rate': 272250000}
-
-            cam.record(number_of_images=session.nFrames, mode='sequence non blocking')
-            # possibly change mode to ring buffer??
-
-            # IMAGING LOOP
-
-            ring_buffer = np.zeros((session.blockSize,
-                                   camera.Y,
-                                   camera.X),
-                                   dtype=np.uint16)
-
-            # print('made ring buffer')
-            tile = 0
-            previous_tile_time = 0
-            previous_ram = 0
-
-            start_time = timer.time()
-
-            xPos = session.xLength/2.0 - session.xOff
-
-            for j in range(session.zTiles):
-
-                zPos = j*experiment.zWidth + session.zOff
-                xyzStage.setVelocity('Z', 0.1)
-                xyzStage.goAbsolute('Z', zPos, False)
-
-                for k in range(session.yTiles):
-
-                    yPos = session.yOff - session.yLength / 2.0 + \
-                        k*experiment.yWidth + experiment.yWidth / 2.0
-
-                    xyzStage.setVelocity('Y', 1.0)
-                    xyzStage.goAbsolute('Y', yPos, False)
-
-                    for ch in range(session.nWavelengths):
-
-                        wave_str = list(experiment.wavelengths)[ch]
-                        # wave_str is wavelength in nm as a string, e.g. '488'
+        try:
+            for well_number in image_wells['well_numbers']:
+                experiment = puck.well(well_number, experiment) ## Define imaging coordinates for this well
+                experiment.fname = fname + '_well_' + str(well_number) ## adjust fname
+            
+                # ROUND SCAN DIMENSIONS & SETUP IMAGING SESSION
+                session = scan(experiment, camera)
+                if session.nChannels > 1 and 'multiband' not in wheel.names_to_channels:
+                    raise Exception('interleaved and dual camera acquisition need a ' +
+                                    '\'multiband\' filter wheel position!')
+
+                # SETUP DATA DIRECTORY
+                ## Check if drive already exists. If so, provide option to delete
+                if os.path.exists(experiment.path()):
+                    if not prompt:
+                        raise Exception(experiment.path() + ' already exists!')
+                    userinput = input('this file directory already exists! permanently delete? [y/n]')
+                    if userinput == 'y':
+                        shutil.rmtree(experiment.path(), ignore_errors=True)
+                    if userinput== 'n':
+                        sys.exit('--Terminating-- re-name write directory and try again')
+
+                check_disk_space(session, camera, experiment)
+                os.makedirs(experiment.path())
+                if experiment.backend in ('h5', 'raw'):
+                    dest = experiment.path('data.h5')
+                elif experiment.backend == 'zarr':
+                    dest = experiment.path('data.ome.zarr')
+                else:
+                    raise Exception('invalid backend!')
+
+                # # Save a copy of all files in the current directory, i.e. so user can refer to experiment settings and could reproduce experiment entirely
+                # src = os.getcwd()
+                # settings_rxiv = experiment.path('settings and code archive')
+                # shutil.copytree(src,dst=settings_rxiv)
+
+                #  INITIALIZE H5 FILE
+                if experiment.backend in ('h5', 'raw'):
+                    h5init(dest, camera, session, experiment, prompt)
+                    write_xml(experiment=experiment, camera=camera, scan=session)
+                else:
+                    zarrinit(dest, camera, session, experiment)
+
+                # CONNECT HARDWARE (first well), SET THE SCAN LENGTH OF THIS WELL
+                hardware.open(experiment, session)
+                xyzStage = hardware.xyzStage
+                waveformGenerator = hardware.waveformGenerator
+                skyraLaser = hardware.skyraLaser
+                fWheel = hardware.fWheel
+                # a session may have kept a second camera from an earlier scan
+                cams = hardware.cams[:session.nCameras]
+
+                # IMAGING LOOP
+
+                # print('made ring buffer')
+                # ORDER OF TILES AND CHANNELS (see acquisition_order.py)
+                order = session.order
+                print_predictions(session, experiment, experiment.order,
+                                  bidirectional=experiment.bidirectional,
+                                  channels=session.nChannels)
+                previous_tile_time = 0
+                previous_ram = 0
+
+                start_time = timer.time()
+
+                xPos = session.xLength/2.0 - session.xOff
+
+                # OPEN data.h5 ONCE FOR THE WHOLE WELL
+                # frames are written from a background thread while the camera loop
+                # fills the next ring buffer
+                # (raw: the frames go straight into one memmap per setup,
+                # converted to data.h5 later with raw_staging.py)
+                staging = experiment.path('staging')
+                # (dual camera: every camera has its own writer queue and ring
+                # buffers, writing to the same file)
+                if experiment.backend == 'raw':
+                    writers = [RawStaging(staging,
+                                          (session.nFrames, camera.Y, camera.X),
+                                          session.blockSize)]
+                    ring_buffers = [None]
+                else:
+                    if experiment.backend == 'h5':
+                        output = H5Writer(dest, camera.compressionWorkers)
+                    else:
+                        output = ZarrWriter(dest)
+                    if session.interleaved:
+                        # frames alternate between the channels, split them per setup
+                        output = Deinterleaver(output, session.nChannels,
+                                               session.zTiles*session.yTiles)
+                    if session.nCameras > 1:
+                        output = SharedWriter(output, session.nCameras)
+                    writers = [BackgroundWriter(output,
+                                                (session.blockSize, camera.Y, camera.X),
+                                                n_buffers=session.nBuffers)
+                               for cam in cams]
+                    ring_buffers = [writer.get_buffer() for writer in writers]
+
+                # stage, filter wheel and laser moves between tiles run on a thread
+                # pool (one per device)
+                transition = TileTransition(max_workers=3)
+                # frame loops of the cameras (see camera_loop.py)
+                loops = CameraLoops(session.nCameras)
+                # frames acquired / dropped over the scan
+                frames = FrameStats()
+                # timed spans of every tile in telemetry.jsonl next to data.h5
+                # (summary: python telemetry.py <path>)
+                telemetry = Telemetry(experiment.path('telemetry.jsonl'))
+                telemetry.event('scan_start', tiles=len(order),
+                                framesPerTile=int(session.framesPerTile),
+                                backend=experiment.backend,
+                                cameras=session.nCameras,
+                                interleaved=session.interleaved)
+                # voltages are built once per channel and only written when they change
+                waveforms = WaveformCache(prepare=waveformGenerator.prepare)
+
+                failed = False
+                try:
+                    for n, (j, k, ch) in enumerate(order):
+
+                        # setup of this tile, independent of the order, for every
+                        # camera (interleaved: of channel 0, the writer splits the
+                        # channels)
+                        tile = j*session.yTiles + k
+                        setups = [tile + session.zTiles*session.yTiles*(ch*session.nChannels + c)
+                                  for c in range(session.nCameras)]
+                        reverse = setups[0] in session.reversed
+                        zPos = j*experiment.zWidth + session.zOff
+                        yPos = session.yOff - session.yLength / 2.0 + \
+                            k*experiment.yWidth + experiment.yWidth / 2.0
+
+                        # wavelengths acquired in this pass, in nm as strings, e.g. '488'
+                        waves = list(experiment.wavelengths)[ch*session.nChannels:
+                                                             (ch + 1)*session.nChannels]
+                        telemetry.set_tags(tile=n, j=j, k=k, ch=ch, waves=waves)
 
                         # ch is order of wavelenghts in main (an integer 0 -> X)
                         #   (NOT necessarily Skyra channel number)
 
-                        xyzStage.setVelocity('X', 1.0)
+                        # PREPARE THE TILE
+                        # stage, filter wheel and laser are on separate ports and are
+                        # prepared concurrently while the voltages are written
+                        transition.start()
                         xPos = session.xLength/2.0 - session.xOff
-                        xyzStage.goAbsolute('X', -xPos, False)
+                        transition.submit('stage', stage_to_tile, xyzStage,
+                                          xPos, yPos, zPos, session.xLength,
+                                          session.scanSpeed, reverse)
 
                         # CHANGE FILTER
-                        fWheel.setPosition(wheel.names_to_channels[wave_str])
+                        if session.nChannels > 1:
+                            position = wheel.names_to_channels['multiband']
+                        else:
+                            position = wheel.names_to_channels[waves[0]]
+                        transition.submit('wheel', fWheel.setPosition, position)
 
                         # START SCAN
 
-                        skyraLaser.setModulationHighCurrent(
-                            laser.names_to_channels[wave_str],
-                            experiment.wavelengths[wave_str] /
-                            np.exp(-j*experiment.zWidth /
-                                   experiment.attenuations[wave_str])
-                            )
-
-                        voltages, rep_time = write_voltages(daq=daq,
-                                                            laser=laser,
-                                                            camera=camera,
-                                                            experiment=experiment,
-                                                            ch=ch)
-
-                        waveformGenerator.ao_task.write(voltages)
-
-                        print('Starting tile ' + str((tile)*session.nWavelengths+ch+1),
+                        transition.submit('laser', laser_currents, skyraLaser,
+                                          {laser.names_to_channels[wave_str]:
+                                           experiment.wavelengths[wave_str] /
+                                           np.exp(-j*experiment.zWidth /
+                                                  experiment.attenuations[wave_str])
+                                           for wave_str in waves})
+
+                        if session.interleaved:
+                            key, voltages, rep_time = transition.run(
+                                'voltages', waveforms.get, write_interleaved_voltages,
+                                daq=daq, laser=laser, camera=camera, experiment=experiment)
+                        elif session.nCameras > 1:
+                            key, voltages, rep_time = transition.run(
+                                'voltages', waveforms.get, write_simultaneous_voltages,
+                                daq=daq, laser=laser, camera=camera, experiment=experiment,
+                                chs=range(ch*session.nChannels, (ch + 1)*session.nChannels))
+                        else:
+                            key, voltages, rep_time = transition.run(
+                                'voltages', waveforms.get, write_voltages,
+                                daq=daq, laser=laser, camera=camera, experiment=experiment,
+                                ch=ch)
+
+                        transition.run('daq', waveforms.write, waveformGenerator, key, voltages)
+
+                        print('Starting tile ' + str(n + 1),
                               '/',
-                              str(session.nWavelengths*session.zTiles*session.yTiles))
+                              str(len(order)))
                         print('y position: ' + str(yPos) + ' mm')
                         print('z position: ' + str(zPos) + ' mm')
+                        if reverse:
+                            print('scanning X in reverse')
                         tile_start_time = timer.time()
 
-                        xyzStage.setScanR(-xPos, -xPos + session.xLength)
-                        xyzStage.setScanV(yPos)
-
-                        response = xyzStage.getMotorStatus()
-                        while response[0] == 'B':
-                            response = xyzStage.getMotorStatus()
-
-                        xyzStage.setVelocity('X', session.scanSpeed)
-                        xyzStage.setVelocity('Y', session.scanSpeed)
-                        xyzStage.setVelocity('Z', session.scanSpeed)
+                        # wait for the stage to settle and the filter and laser current
+                        settle_time = transition.wait('stage')[0]
+                        transition.wait()
+                        print('Stage settled in ' + str(round(settle_time, 3)) + ' s')
+                        transition.print_stats()
+                        telemetry.transition(transition, settle_time)
+                        acquire_start = timer.perf_counter()
+                        writer_stats = [writer.stats() for writer in writers]
 
                         waveformGenerator.ao_task.start()
-                        cam.start()
+                        for cam in cams:
+                            cam.start()
                         xyzStage.scan(False)
-                        skyraLaser.turnOn(laser.names_to_channels[
-                            list(experiment.wavelengths)[ch]])
+                        for wave_str in waves:
+                            skyraLaser.turnOn(laser.names_to_channels[wave_str])
 
                         # START IMAGING LOOP
 
-                        num_acquired = 0
-                        num_acquired_counter = 0
-                        num_acquired_previous = 0
-
-                        # while num_acquired < scan.nFrames: #original version.
-                        # for some reason code frequently (but not always)
-                        # gets stuck on cam.wait_for_next_image(num_acquired),
-                        # like cam is a frame or two ahead of code
-                        while num_acquired < session.nFrames - 100:
-
-                            # print('you\'ve got an image!', num_acquired, 'of',
-                            #       session.nFrames, 'total')
-                            cam.wait_for_next_image(num_acquired)
-
-                            if num_acquired_counter == int(session.blockSize):
-                                print('Saving frames: ',
-                                      str(num_acquired_previous),
-                                      ' - ',
-                                      str(num_acquired))
-                                print('Tile: ' + str(tile))
-                                h5write(dest,
-                                        ring_buffer,
-                                        tile + session.zTiles*session.yTiles*ch,
-                                        num_acquired_previous, num_acquired)
-                                num_acquired_counter = 0
-                                num_acquired_previous = num_acquired
-                                temp = cam.image(num_acquired)[0]
-
-                                ring_buffer[num_acquired_counter] = \
-                                    temp[2:camera.Y + 2, 1024 - int(camera.X / 2):1024
-                                         - int(camera.X / 2) + camera.X]
-
-                            else:
-
-                                temp = cam.image(num_acquired)[0]
-
-                                ring_buffer[num_acquired_counter] = \
-                                    temp[2:camera.Y + 2, 1024 - int(camera.X / 2):1024
-                                         - int(camera.X / 2) + camera.X]
-
-                            if num_acquired == session.nFrames-1:
-                                print('Saving frames: ',
-                                      str(num_acquired_previous),
-                                      ' - ',
-                                      str(session.nFrames))
-
-                                h5write(dest,
-                                        ring_buffer[0:num_acquired_counter+1],
-                                        tile + session.zTiles*session.yTiles*ch,
-                                        num_acquired_previous,
-                                        session.nFrames)
-
-                            num_acquired += 1
-                            num_acquired_counter += 1
+                        if experiment.backend == 'raw':
+                            ring_buffers[0] = writers[0].start(setups[0])
+
+                        ring_buffers, tile_frames = loops.run(cams, writers, ring_buffers,
+                                                              session, setups, tile)
+                        for stats in tile_frames:
+                            frames.add(stats)
+                        acquire_end = timer.perf_counter()
+                        telemetry.acquisition(acquire_end - acquire_start, tile_frames,
+                                              writers, writer_stats)
 
                         waveformGenerator.ao_task.stop()
-                        waveformGenerator.write_zeros(daq=daq)
+                        waveforms.write_zeros(waveformGenerator, daq)
                         # For some reason this write_zeros works but the above doesn't?
                         # laser stops and starts appropriately with this one active
                         # and the top write_zeros() commented out
 
-                        skyraLaser.turnOff(laser.names_to_channels[list(experiment.wavelengths)[ch]])
-                        cam.stop()
+                        for wave_str in waves:
+                            skyraLaser.turnOff(laser.names_to_channels[wave_str])
+                        for cam in cams:
+                            cam.stop()
+                        if experiment.backend == 'raw':
+                            writers[0].end()
 
                         tile_end_time = timer.time()
                         tile_time = tile_end_time - tile_start_time
+                        telemetry.span('tile_end', timer.perf_counter() - acquire_end,
+                                       critical=True)
+                        telemetry.span('tile', tile_time)
                         print('Tile time: ' + str(round((tile_time/60), 3)) + " min")
-                        tiles_remaining = session.nWavelengths * session.zTiles * \
-                            session.yTiles - (tile * session.nWavelengths + ch + 1)
-
+                        for writer in writers:
+                            writer.print_stats()
+                        for name, device in (('Stage', xyzStage),
+                                             ('Laser', skyraLaser),
+                                             ('Filter wheel', fWheel)):
+                            device.printLatencyStats(name)
+                            device.resetLatencyStats()
+                        tiles_remaining = len(order) - (n + 1)
+
+                        # from the average time of the tiles so far, not just the last
+                        average_time = (timer.time() - start_time)/(n + 1)
                         if tiles_remaining != 0:
                             print('Estimated time remaining: ',
-                                  str(round((tile_time*tiles_remaining/3600), 3)),
+                                  str(round((average_time*tiles_remaining/3600), 3)),
                                   " hrs")
-
-                    tile += 1
-
-            end_time = timer.time()
-
-            print("Total time = ",
-                  str(round((end_time - start_time)/3600, 3)),
-                  " hrs")
-
-            response = xyzStage.getMotorStatus()
-            while response[0] == 'B':
-                response = xyzStage.getMotorStatus()
-
-            cam.close()
-            etl.close(soft_close=True)
-            # waveformGenerator.counter_task.close()
-            waveformGenerator.ao_task.close()
-            xyzStage.shutDown()
+                except BaseException:
+                    failed = True
+                    # the devices may not have the settings their drivers cached
+                    hardware.invalidate_caches()
+                    raise
+                finally:
+                    transition.close()
+                    telemetry.set_tags()
+                    telemetry.event('scan_end', elapsed=timer.time() - start_time,
+                                    frames_expected=frames.expected,
+                                    frames_acquired=frames.acquired)
+                    telemetry.close()
+                    loops.close()
+                    # the error of a failed well is the one raised
+                    close_writers(writers, reraise=not failed)
+
+                end_time = timer.time()
+
+                print("Total time = ",
+                      str(round((end_time - start_time)/3600, 3)),
+                      " hrs")
+                print('Telemetry: ' + telemetry.path)
+                transition.print_summary()
+                frames.print_stats()
+                waveforms.print_stats()
+                waveformGenerator.print_stats()
+                for name, device in (('Stage', xyzStage),
+                                     ('Laser', skyraLaser),
+                                     ('Filter wheel', fWheel)):
+                    print(name + ': ' + str(device.skipped_total) +
+                          ' redundant commands skipped')
+
+                if experiment.backend == 'raw':
+                    print('Convert the staging files with: python raw_staging.py ' +
+                          staging + ' ' + dest + ' --workers N')
+
+                xyzStage.waitUntilIdle()
+        finally:
+            # also after a failed well: camera, DAQ task, serial ports
+            if owner:
+                hardware.close()
 
 
 def write_voltages(daq,
@@ -681,133 +824,48 @@ def write_voltages(daq,
     return voltages, (camera.expTime/1e3-2*roll_time)*1000
 
 
+def write_interleaved_voltages(daq,
+                               laser,
+                               camera,
+                               experiment):
+    """
+    Voltages for one frame of every wavelength in turn, for interleaved
+    acquisition (see interleave.py). Each frame uses the galvo and ETL
+    settings of its own wavelength.
+    """
+    frames = []
+    for ch in range(len(experiment.wavelengths)):
+        voltages, rep_time = write_voltages(daq, laser, camera, experiment, ch)
+        frames.append(voltages)
+    return interleave_voltages(frames, frame_period(daq, camera)), rep_time
+
+
+def write_simultaneous_voltages(daq,
+                                laser,
+                                camera,
+                                experiment,
+                                chs):
+    """
+    Voltages with the lasers of all channels chs on in every frame, for
+    dual camera acquisition. The galvos and the ETL follow the settings of
+    the first channel, the cameras share the light sheet.
+    """
+    chs = list(chs)
+    voltages, rep_time = write_voltages(daq, laser, camera, experiment, chs[0])
+    n2c = daq.names_to_channels
+    for ch in chs[1:]:
+        wave_key = list(experiment.wavelengths)[ch]
+        other, rep_time = write_voltages(daq, laser, camera, experiment, ch)
+        voltages[n2c[wave_key], :] = other[n2c[wave_key], :]
+    return voltages, rep_time
+
+
 def zero_voltages(daq, camera):
     # samples = int(daq.rate*camera.expTime/1e3)  # number of samples for DAQ
     voltages = np.zeros((daq.num_channels, 2))  # create voltages array
     return voltages
 
 
-def h5init(dest, camera, scan, experiment):
-
-    f = h5py.File(dest, 'a')
-
-    res_list = [1, 2, 4, 8]
-
-    res_np = np.zeros((len(res_list), 3), dtype='float64')
-
-    res_np[:, 0] = res_list
-    res_np[:, 1] = res_list
-    res_np[:, 2] = res_list
-
-    subdiv_np = np.zeros((len(res_list), 3), dtype='uint32')
-
-    subdiv_np[:, 0] = scan.chunkSize1
-    subdiv_np[:, 1] = scan.chunkSize2
-    subdiv_np[:, 2] = scan.chunkSize3
-
-    tgroup = f.create_group('/t00000')
-
-    tile = 0
-
-    for j in range(scan.zTiles):
-
-        for k in range(scan.yTiles):
-
-            for ch in range(scan.nWavelengths):
-
-                idx = tile + scan.zTiles*scan.yTiles*ch
-
-                sgroup = f.create_group('/s' + str(idx).zfill(2))
-                resolutions = f.require_dataset('/s' + str(idx).zfill(2) + '/resolutions',
-                                                chunks=(res_np.shape),
-                                                dtype='float64',
-                                                shape=(res_np.shape),
-                                                data=res_np)
-
-                subdivisions = f.require_dataset('/s' + str(idx).zfill(2) + '/subdivisions',
-                                                 chunks=(res_np.shape),
-                                                 dtype='uint32',
-                                                 shape=(subdiv_np.shape),
-                                                 data=subdiv_np)
-
-                for z in range(len(res_list)-1, -1, -1):
-
-                    res = res_list[z]
-
-                    resgroup = f.create_group('/t00000/s' + str(idx).zfill(2) + '/' + str(z))
-
-                    if camera.quantSigma[list(experiment.wavelengths)[ch]] == 0:
-
-                        data = f.require_dataset('/t00000/s' + str(idx).zfill(2) + '/' + str(z) + '/cells', 
-                                                 chunks=(scan.chunkSize1,
-                                                         scan.chunkSize2,
-                                                         scan.chunkSize3),
-                                                 dtype='int16',
-                                                 shape=np.ceil(np.divide([scan.nFrames,
-                                                                          camera.Y,
-                                                                          camera.X],
-                                                                          res)
-                                                                          )
-                                                                          )
-                    else:
-                        if ((camera.B3Denv != '') and
-                            (camera.B3Denv != os.environ['CONDA_DEFAULT_ENV'])
-                            ):
-                            print('Warning: B3D is active but the ' +
-                                  'current conda environment is: ' +
-                                  os.environ['CONDA_DEFAULT_ENV'])
-                            print('Press CTRL + C to exit and run \'conda' +
-                                  ' activate ' + camera.B3Denv + '\' before ' +
-                                  'running lsm-python-main.py')
-                            input('Press Enter to override this warning' +
-                                  ' and continue anyways')
-
-                        data = f.require_dataset('/t00000/s' + str(idx).zfill(2) + '/' + str(z) + '/cells',
-                                chunks=(scan.chunkSize1,
-                                        scan.chunkSize2,
-                                        scan.chunkSize3),
-                                dtype='int16',
-                                shape=np.ceil(np.divide([scan.nFrames,
-                                                        camera.Y,
-                                                        camera.X],
-                                                        res)),
-                                compression=32016,
-                                compression_opts=(round(camera.quantSigma[list(experiment.wavelengths)[ch]]*1000),
-                                                    camera.compressionMode,
-                                                    round(2.1845*1000),
-                                                    0, 
-                                                    round(1.5*1000))
-                                                 )
-
-            tile += 1
-
-    f.close()
-
-
-def h5write(dest, img_3d, idx, ind1, ind2):
-
-    f = h5py.File(dest, 'a')
-
-    res_list = [1, 2, 4, 8]
-
-    for z in range(len(res_list)):
-        res = res_list[z]
-        if res > 1:
-            img_3d = skimage.transform.downscale_local_mean(img_3d,
-                                                            (2, 2, 2)
-                                                            ).astype('uint16')
-
-        if ind1 == 0:
-            ind1_r = ind1
-        else:
-            ind1_r = np.ceil((ind1 + 1)/res - 1)
-
-        data = f['/t00000/s' + str(idx).zfill(2) + '/' + str(z) + '/cells']
-        data[int(ind1_r):int(ind1_r+img_3d.shape[0])] = img_3d.astype('int16')
-
-    f.close()
-
-
 def write_xml(experiment, camera, scan):
 
     print("Writing BigDataViewer XML file...")
@@ -835,7 +893,7 @@ def write_xml(experiment, camera, scan):
     # shearing based on theta and y/z pixel sizes
     shear = -np.tan(experiment.theta*np.pi/180.0)*sy/sz
 
-    f = open(experiment.drive + ':\\' + experiment.fname + '\\data.xml', 'w')
+    f = open(experiment.path('data.xml'), 'w')
     f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
     f.write('<SpimData version="0.2">\n')
     f.write('\t<BasePath type="relative">.</BasePath>\n')
@@ -952,6 +1010,17 @@ def write_xml(experiment, camera, scan):
                             + ' 1.0 0.0</affine>\n')
                     f.write('\t\t\t</ViewTransform>\n')
 
+                    # tiles scanned backwards in X (bidirectional):
+                    # mirror the frame axis before everything else
+                    if ind in scan.reversed:
+                        f.write('\t\t\t<ViewTransform type="affine">\n')
+                        f.write('\t\t\t\t<Name>Scan direction</Name>\n')
+                        f.write('\t\t\t\t<affine>1.0 0.0 0.0 0.0 0.0 1.0 '
+                                + '0.0 0.0 0.0 0.0 -1.0 '
+                                + str(float(scan.nFrames - 1))
+                                + '</affine>\n')
+                        f.write('\t\t\t</ViewTransform>\n')
+
                     f.write('\t\t</ViewRegistration>\n')
 
     f.write('\t</ViewRegistrations>\n')
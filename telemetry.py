@@ -0,0 +1,246 @@
+#!/usr/bin/python
+
+"""
+Per-tile telemetry of scan3D, and its summary
+
+Telemetry appends one JSON record per timed span to telemetry.jsonl
+next to data.h5, so a run can be analysed (or followed) without parsing
+the print output:
+
+    {"time": 1718000000.1, "name": "stage", "duration": 0.84,
+     "critical": false, "group": "transition",
+     "tile": 3, "j": 0, "k": 3, "ch": 0, "waves": ["488"]}
+
+time is the wall clock time the record was written, duration is in s.
+The tile tags (tile = position in the acquisition order, j = z tile,
+k = y tile, ch = channel or pass, waves = wavelengths) are added to every
+record of the tile.
+
+Spans on the critical path of the scan (critical: true) follow each
+other without overlapping: the tile transition (dead time), the frame
+loop and the end of the tile. Their time is credited to the phase that
+held the scan up (credit, e.g. the slowest of the stage, filter and
+laser changes that ran concurrently, or the time the frame loop waited
+for the writer). The other spans (stage, motor_wait, wheel, laser,
+voltages, daq, write) overlap them and are kept for their percentiles.
+
+    python telemetry.py A:\\sample\\telemetry.jsonl
+
+prints the percentiles of every span and names the bottleneck phase.
+
+"""
+import argparse
+import json
+import threading
+import time as timer
+
+import numpy as np
+
+from camera_loop import FrameStats
+
+
+class Telemetry(object):
+    """
+    JSONL telemetry file of one scan. Records can be written from any
+    thread, each one is on disk once span() returns.
+
+    Parameters
+    ----------
+
+    path
+        telemetry.jsonl, appended to; None writes nothing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        if path is not None:
+            self.f = open(path, 'a', buffering=1)
+        self.lock = threading.Lock()
+        self.tags = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def set_tags(self, **tags):
+        """
+        Tags added to every following record, e.g. the tile.
+        """
+        self.tags = tags
+
+    def event(self, name, **fields):
+        """
+        Record without a duration, e.g. the start of the scan.
+        """
+        record = {'time': timer.time(), 'name': name}
+        record.update(self.tags)
+        record.update(fields)
+        self._write(record)
+
+    def span(self, name, duration, critical=False, credit=None, **fields):
+        """
+        Record a span of duration s.
+
+        Parameters
+        ----------
+
+        critical
+            the scan waited for the span (see module docstring)
+
+        credit
+            {phase: s} the critical time is attributed to, {name:
+            duration} if None
+        """
+        record = {'time': timer.time(), 'name': name,
+                  'duration': float(duration), 'critical': critical}
+        if credit is not None:
+            record['credit'] = {phase: float(credit[phase])
+                                for phase in credit}
+        record.update(self.tags)
+        record.update(fields)
+        self._write(record)
+
+    def transition(self, transition, settle_time):
+        """
+        Record the operations of a TileTransition that has been waited
+        for, and its dead time credited to the slowest of them.
+        """
+        durations = transition.durations
+        for name in durations:
+            self.span(name, durations[name], group='transition')
+        self.span('motor_wait', settle_time, group='transition')
+        slowest = max(durations, key=durations.get) if durations \
+            else 'transition'
+        self.span('transition', transition.dead_time, critical=True,
+                  credit={slowest: transition.dead_time})
+
+    def acquisition(self, duration, frame_stats, writers, before):
+        """
+        Record the frame loop of a tile, its time split between the
+        cameras and waiting for a free ring buffer (the writer), and what
+        every writer did meanwhile.
+
+        Parameters
+        ----------
+
+        frame_stats
+            FrameStats of every camera (CameraLoops.run)
+
+        writers
+            BackgroundWriter or RawStaging of every camera
+
+        before
+            writer.stats() of every writer when the frame loop started
+        """
+        after = [writer.stats() for writer in writers]
+        wait = max(stats['producer_wait'] - start['producer_wait']
+                   for stats, start in zip(after, before))
+        frames = FrameStats()
+        for stats in frame_stats:
+            frames.add(stats)
+        self.span('acquire', duration, critical=True,
+                  credit={'acquire': duration - wait, 'writer_wait': wait},
+                  **{'frames_' + key: value
+                     for key, value in frames.attrs().items()})
+        for camera, (stats, start) in enumerate(zip(after, before)):
+            self.span('write', stats['write_time'] - start['write_time'],
+                      camera=camera,
+                      frames_written=stats['frames_written'] -
+                      start['frames_written'],
+                      queue_depth=stats.get('queue_depth', 0),
+                      max_queue_depth=stats.get('max_queue_depth', 0),
+                      frames_behind=stats.get('frames_behind', 0),
+                      lag=stats.get('lag', 0.0),
+                      max_lag=stats.get('max_lag', 0.0))
+
+    def _write(self, record):
+        if self.f is None:
+            return
+        line = json.dumps(record)
+        with self.lock:
+            self.f.write(line + '\n')
+
+    def close(self):
+        if self.f is not None:
+            with self.lock:
+                self.f.close()
+                self.f = None
+
+
+def read_records(path):
+    """
+    Records of a telemetry file, skipping a line cut off by a crash.
+    """
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def summarize(records):
+    """
+    Return ({name: durations}, {phase: critical s}) of the records.
+    """
+    spans = {}
+    critical = {}
+    for record in records:
+        if 'duration' not in record:
+            continue
+        spans.setdefault(record['name'], []).append(record['duration'])
+        if record.get('critical'):
+            credit = record.get('credit',
+                                {record['name']: record['duration']})
+            for phase in credit:
+                critical[phase] = critical.get(phase, 0.0) + credit[phase]
+    return spans, critical
+
+
+def print_summary(records):
+    spans, critical = summarize(records)
+    tiles = len(set(record['tile'] for record in records
+                    if 'tile' in record))
+    print('%d tiles' % tiles)
+    print('%-12s %6s %9s %9s %9s %9s %9s %10s' %
+          ('span', 'count', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms',
+           'max ms', 'total s'))
+    for name in sorted(spans, key=lambda name: -sum(spans[name])):
+        durations = np.array(spans[name])*1000
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        print('%-12s %6d %9.1f %9.1f %9.1f %9.1f %9.1f %10.2f' %
+              (name, len(durations), durations.mean(), p50, p90, p99,
+               durations.max(), durations.sum()/1000))
+
+    total = sum(critical.values())
+    if total == 0:
+        return None
+    print('Critical path (s, share of the scan):')
+    for phase in sorted(critical, key=lambda phase: -critical[phase]):
+        print('  %-12s %10.2f %5.1f%%' % (phase, critical[phase],
+                                          100*critical[phase]/total))
+    bottleneck = max(critical, key=critical.get)
+    print('Bottleneck: ' + bottleneck + ' (' +
+          str(round(100*critical[bottleneck]/total, 1)) +
+          '% of the scan)')
+    return bottleneck
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Summarize the telemetry.jsonl of a scan')
+    parser.add_argument('path', help='telemetry.jsonl')
+    parser.add_argument('--tiles', type=int, nargs=2, default=None,
+                        metavar=('FIRST', 'LAST'),
+                        help='only tiles FIRST to LAST of the order')
+    args = parser.parse_args()
+    records = read_records(args.path)
+    if args.tiles is not None:
+        records = [record for record in records
+                   if args.tiles[0] <= record.get('tile', -1) <= args.tiles[1]]
+    print_summary(records)
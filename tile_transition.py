@@ -0,0 +1,176 @@
+#!/usr/bin/python
+
+"""
+Concurrent hardware preparation between tiles
+
+Stage, filter wheel and laser sit on separate serial ports, so the stage
+move, the filter change and the laser current change of a tile
+transition can run at the same time while the main thread computes and
+writes the DAQ voltages. Only the true dependencies are waited for:
+everything has to be in place before ao_task.start().
+
+"""
+import concurrent.futures
+import time as timer
+
+
+class TileTransition(object):
+    """
+    Runs the device operations of one tile transition on a thread pool
+    and times them.
+
+    Parameters
+    ----------
+
+    max_workers
+        number of threads, one per device that is prepared concurrently
+
+    Usage (once per tile)::
+
+        transition.start()
+        transition.submit('stage', stage_to_tile, xyzStage, ...)
+        transition.submit('wheel', fWheel.setPosition, 2)
+        transition.run('daq', waveformGenerator.ao_task.write, voltages)
+        transition.wait()
+        transition.print_stats()
+    """
+
+    def __init__(self, max_workers=3):
+
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='TileTransition')
+        self.futures = {}
+        self.durations = {}
+        self.start_time = None
+        self.dead_time = 0.0
+
+        # totals over the scan
+        self.transitions = 0
+        self.total_dead_time = 0.0
+        self.total_sequential = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """
+        Start timing a new transition.
+        """
+        self.futures = {}
+        self.durations = {}
+        self.start_time = timer.perf_counter()
+
+    def _timed(self, name, fn, args, kwds):
+        start = timer.perf_counter()
+        try:
+            return fn(*args, **kwds)
+        finally:
+            self.durations[name] = timer.perf_counter() - start
+
+    def submit(self, name, fn, *args, **kwds):
+        """
+        Run fn(*args, **kwds) on the pool. Operations on the same device
+        must go into one function, they are not ordered otherwise.
+        """
+        self.futures[name] = self.pool.submit(self._timed, name, fn,
+                                              args, kwds)
+        return self.futures[name]
+
+    def run(self, name, fn, *args, **kwds):
+        """
+        Run fn(*args, **kwds) in the calling thread, timed like submit.
+        """
+        return self._timed(name, fn, args, kwds)
+
+    def wait(self, *names):
+        """
+        Wait for the named operations (all if none are given) and return
+        their results. An exception raised by an operation is raised
+        here. Waiting for all of them ends the transition.
+        """
+        if not names:
+            names = list(self.futures)
+            done = True
+        else:
+            done = False
+        results = [self.futures[name].result() for name in names]
+        if done:
+            self.dead_time = timer.perf_counter() - self.start_time
+            self.transitions += 1
+            self.total_dead_time += self.dead_time
+            self.total_sequential += sum(self.durations.values())
+        return results
+
+    def print_stats(self):
+        """
+        Print the dead time of the last transition next to the time its
+        operations would have taken one after the other.
+        """
+        print('Tile transition: ' + str(round(self.dead_time, 3)) +
+              ' s (sequential ' +
+              str(round(sum(self.durations.values()), 3)) + ' s: ' +
+              ', '.join(name + ' ' + str(round(self.durations[name], 3))
+                        for name in self.durations) + ')')
+
+    def print_summary(self):
+        """
+        Print the dead time over all transitions.
+        """
+        if self.transitions:
+            print('Tile transitions: ' + str(self.transitions) + ', ' +
+                  str(round(self.total_dead_time, 3)) +
+                  ' s dead time (sequential ' +
+                  str(round(self.total_sequential, 3)) + ' s)')
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+def stage_to_tile(xyzStage, xPos, yPos, zPos, xLength, scanSpeed,
+                  reverse=False):
+    """
+    Move the stage to the start of a tile, set up the scan and wait for
+    the stage to settle. Returns the settle time in s.
+
+    Parameters
+    ----------
+
+    xPos, yPos, zPos
+        tile position in mm, the scan runs from -xPos to -xPos + xLength
+
+    scanSpeed
+        stage velocity during the scan, in mm/s
+
+    reverse
+        scan from -xPos + xLength back to -xPos (bidirectional scanning)
+    """
+    start, stop = -xPos, -xPos + xLength
+    if reverse:
+        start, stop = stop, start
+    xyzStage.setVelocities({'X': 1.0, 'Y': 1.0, 'Z': 0.1})
+    xyzStage.goAbsoluteAxes({'X': start, 'Y': yPos, 'Z': zPos}, False)
+    xyzStage.setScanR(start, stop)
+    xyzStage.setScanV(yPos)
+    settle_time = xyzStage.waitUntilIdle()
+    xyzStage.setVelocities({'X': scanSpeed,
+                            'Y': scanSpeed,
+                            'Z': scanSpeed})
+    return settle_time
+
+
+def laser_currents(skyraLaser, currents):
+    """
+    Set the modulation high current of several laser channels, one after
+    the other on the laser port.
+
+    Parameters
+    ----------
+
+    currents
+        {Skyra channel: current in mA}
+    """
+    for channel in currents:
+        skyraLaser.setModulationHighCurrent(channel, currents[channel])
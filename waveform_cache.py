@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+"""
+Waveform cache for the DAQ voltages of scan3D
+
+The voltages of a tile only depend on its wavelength(s) and on the DAQ,
+camera and laser settings, which do not change during a scan, but
+write_voltages used to rebuild and check the full num_channels x samples
+array for every tile. WaveformCache builds (and validates) each waveform
+once, keeps the most recently used ones keyed by everything they depend
+on, and only writes a waveform to the AO task if it is not the one
+already loaded. The waveforms are kept as written to the task, i.e.
+after waveformGenerator.prepare (task channels only, int16 DAC codes
+with daq.dtype 'int16').
+
+write_zeros replaces the loaded waveform, so it goes through the cache
+too (WaveformCache.write_zeros) and the next tile writes its voltages
+again. scan3D parks the outputs at 0 V after every tile (a stopped task
+holds its last sample, which could leave the laser modulated), so in a
+scan the cache saves building the waveforms, not the writes to the DAQ:
+the "already loaded" count only grows when a waveform is written twice
+without write_zeros in between.
+
+"""
+import collections
+
+
+def waveform_key(build, daq, laser, camera, experiment, kwds):
+    """
+    Everything the waveform built by build(daq, laser, camera, experiment,
+    **kwds) depends on, as a hashable tuple.
+    """
+    waves = tuple(experiment.wavelengths)
+    per_wave = tuple(tuple(getattr(daq, name)[wave] for wave in waves)
+                     for name in ('xmin', 'xmax', 'xpp',
+                                  'ymin', 'ymax', 'ypp', 'econst'))
+    args = tuple((name, tuple(value) if isinstance(value, range) else value)
+                 for name, value in sorted(kwds.items()))
+    return (build.__name__, args, waves, per_wave,
+            daq.rate, daq.num_channels, tuple(daq.channels), daq.dtype,
+            tuple(sorted(daq.names_to_channels.items())),
+            camera.expTime, camera.Y, laser.strobing)
+
+
+class WaveformCache(object):
+    """
+    LRU cache of DAQ waveforms, and the waveform loaded in the AO task.
+
+    Parameters
+    ----------
+
+    maxsize
+        number of waveforms kept, one per channel (or pass) of a scan is
+        enough
+
+    prepare
+        function applied to the voltages before they are cached, e.g.
+        waveformGenerator.prepare
+    """
+
+    def __init__(self, maxsize=8, prepare=None):
+        self.maxsize = maxsize
+        self.prepare = prepare
+        self.waveforms = collections.OrderedDict()
+        self.active = None  # key of the waveform loaded in the AO task
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped = 0
+
+    def get(self, build, daq, laser, camera, experiment, **kwds):
+        """
+        Return (key, voltages, rep_time) of build(daq, laser, camera,
+        experiment, **kwds), e.g. write_voltages(..., ch=ch), building it
+        (and applying prepare) only if it is not cached. The voltages must
+        not be modified.
+        """
+        key = waveform_key(build, daq, laser, camera, experiment, kwds)
+        if key in self.waveforms:
+            self.waveforms.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            voltages, rep_time = build(daq, laser, camera, experiment,
+                                       **kwds)
+            if self.prepare is not None:
+                voltages = self.prepare(voltages)
+            self.waveforms[key] = (voltages, rep_time)
+            while len(self.waveforms) > self.maxsize:
+                self.waveforms.popitem(last=False)
+        voltages, rep_time = self.waveforms[key]
+        return key, voltages, rep_time
+
+    def write(self, waveformGenerator, key, voltages):
+        """
+        Load voltages (of key) into the AO task with
+        waveformGenerator.write, unless they already are.
+        """
+        if key is not None and key == self.active:
+            self.skipped += 1
+            return
+        waveformGenerator.write(voltages)
+        self.writes += 1
+        self.active = key
+
+    def write_zeros(self, waveformGenerator, daq):
+        """
+        waveformGenerator.write_zeros, which unloads the active waveform.
+        """
+        self.active = None
+        waveformGenerator.write_zeros(daq=daq)
+
+    def invalidate(self):
+        """
+        Forget every waveform, e.g. after changing the DAQ settings.
+        """
+        self.waveforms.clear()
+        self.active = None
+
+    def print_stats(self):
+        print('Waveforms: ' + str(self.misses) + ' built, ' +
+              str(self.hits) + ' cached, ' + str(self.writes) +
+              ' written to the DAQ, ' + str(self.skipped) +
+              ' already loaded')
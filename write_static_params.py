@@ -13,6 +13,8 @@ static_params_write = {
         'triggerMode': 'auto sequence',
         'acquireMode': 'external',
         'compressionMode': 1,
+        'compressionWorkers': 0,  # B3D in worker processes, 0 = off
+        'codec': 'b3d',  # 'b3d', or 'gzip' / 'zstd' / 'blosc' for testing
         'B3Denv': ''  # name of required conda env when B3D is active.
         			  # e.g. 'image'. Leave as empty string to allow any env.
     },
@@ -26,6 +28,7 @@ static_params_write = {
         'rate': 4e5,  # Hz
         'board': '',  # board number e.g. 'Dev0'
         'num_channels': 32,  # AO channels
+        'dtype': 'float64',  # AO writes, 'float64' (V) or 'int16' (DAC codes)
         'names_to_channels': {
             'xgalvo': 0,
             'ygalvo': 1,
@@ -93,6 +96,11 @@ static_params_write = {
         'model': '',  # must be 'tiger' or 'ms2000'
         'port': '', # e.g. 'COM1'
         'rate': 0 # 115200 for Tiger or 9600 for MS2000
+    },
+    'simulation': {
+        'enabled': False,  # True to run scan3D on simulated hardware
+        'realtime': True,  # frames arrive one expTime apart
+        'latency': 1.0  # factor on simulated device latencies, 0 = instant
     }
 }
 
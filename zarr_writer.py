@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+"""
+Zarr v3 / OME-NGFF output backend
+
+Alternative to the monolithic data.h5: every tile / channel (setup sNN) is
+an OME-NGFF multiscale image in data.ome.zarr with one sharded array per
+resolution level. Each shard is a separate file holding one row of chunks
+(chunkSize1 frames), so blocks from several threads or processes go to
+different files without a global HDF5 lock, and downstream stitching can
+read tiles in parallel.
+
+    data.ome.zarr/
+        sNN/            multiscales metadata (ome, otls attributes)
+            0/ 1/ 2/ 3/ resolution levels (frames, Y, X), uint16
+
+Setups are numbered as in data.h5 / data.xml:
+idx = tile + zTiles*yTiles*ch with tile = j*yTiles + k.
+
+"""
+import numpy as np
+
+from pyramid import PyramidBuilder, to_output
+from compression import RowStager
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+
+res_list = [1, 2, 4, 8]
+
+
+def _require_zarr():
+    if zarr is None or int(zarr.__version__.split('.')[0]) < 3:
+        raise Exception('the zarr backend needs zarr >= 3 ' +
+                        '(pip install "zarr>=3")')
+
+
+def multiscales(name, layout, j, k):
+    """
+    OME-NGFF 0.5 multiscales metadata of one setup. Axes are the array
+    axes (scan direction, camera Y, camera X); the tile translation is the
+    same offset write_xml uses. The deskew shear cannot be expressed in
+    NGFF 0.5 and is stored in the otls attributes instead.
+    """
+    sx = layout['sampling']
+    sy = layout['sampling']*np.cos(layout['theta']*np.pi/180.0)
+    sz = layout['xWidth']
+    scale = [sz, sy, sx]
+    translation = [0.0, -layout['zWidth']*1000*j, layout['yWidth']*1000*k]
+
+    datasets = []
+    for z in range(len(res_list)):
+        res = res_list[z]
+        datasets.append({
+            'path': str(z),
+            'coordinateTransformations': [
+                {'type': 'scale',
+                 'scale': [float(s*res) for s in scale]},
+                {'type': 'translation',
+                 'translation': [float(t + s*(res - 1)/2.0)
+                                 for t, s in zip(translation, scale)]}]})
+
+    return {'version': '0.5',
+            'multiscales': [{
+                'name': name,
+                'axes': [{'name': 'z', 'type': 'space', 'unit': 'micrometer'},
+                         {'name': 'y', 'type': 'space', 'unit': 'micrometer'},
+                         {'name': 'x', 'type': 'space', 'unit': 'micrometer'}],
+                'datasets': datasets}]}
+
+
+def zarrinit(dest, camera, scan, experiment):
+    """
+    Create data.ome.zarr and declare its layout in the otls attributes of
+    the root group. As with h5init, the setups are created by zarrsetup
+    when they are first written.
+    """
+    _require_zarr()
+
+    root = zarr.open_group(dest, mode='w-')
+
+    shear = -np.tan(experiment.theta*np.pi/180.0) * \
+        camera.sampling*np.cos(experiment.theta*np.pi/180.0)/experiment.xWidth
+
+    root.attrs['otls'] = {'shape': [int(scan.nFrames),
+                                    int(camera.Y),
+                                    int(camera.X)],
+                          'chunks': [int(scan.chunkSize1),
+                                     int(scan.chunkSize2),
+                                     int(scan.chunkSize3)],
+                          'yTiles': int(scan.yTiles),
+                          'zTiles': int(scan.zTiles),
+                          'wavelengths': list(experiment.wavelengths),
+                          'sampling': camera.sampling,
+                          'xWidth': experiment.xWidth,
+                          'yWidth': experiment.yWidth,
+                          'zWidth': experiment.zWidth,
+                          'theta': experiment.theta,
+                          'shear': float(shear),
+                          'reversed': [int(idx) for idx in scan.reversed]}
+
+
+def zarrsetup(root, idx, layout=None):
+    """
+    Create the multiscale group of setup idx (the same sNN numbering as
+    data.h5 / data.xml) if it does not exist yet.
+    """
+    name = 's' + str(idx).zfill(2)
+    if name in root:
+        return
+
+    if layout is None:
+        layout = dict(root.attrs['otls'])
+
+    tiles = layout['zTiles']*layout['yTiles']
+    ch = idx // tiles
+    tile = idx % tiles
+    j = tile // layout['yTiles']
+    k = tile % layout['yTiles']
+    chunks = tuple(layout['chunks'])
+
+    group = root.create_group(name)
+
+    for z in range(len(res_list)):
+
+        res = res_list[z]
+        shape = tuple(int(n) for n in
+                      np.ceil(np.divide(layout['shape'], res)))
+        # one shard = one row of chunks across the whole frame
+        shards = (chunks[0],
+                  int(np.ceil(shape[1]/chunks[1]))*chunks[1],
+                  int(np.ceil(shape[2]/chunks[2]))*chunks[2])
+
+        group.create_array(str(z),
+                           shape=shape,
+                           chunks=chunks,
+                           shards=shards,
+                           dtype='uint16',
+                           fill_value=0,
+                           dimension_names=('z', 'y', 'x'))
+
+    group.attrs['ome'] = multiscales(name, layout, j, k)
+    group.attrs['otls'] = {'tile': tile,
+                           'channel': ch,
+                           'wavelength': layout['wavelengths'][ch],
+                           'zTile': j,
+                           'yTile': k,
+                           # -1: frame 0 at the end of X (bidirectional)
+                           'scan_direction':
+                               -1 if idx in layout.get('reversed', []) else 1}
+
+
+class ShardStager(RowStager):
+    """
+    Collects frames until a whole shard (row of chunks) can be written, so
+    lower levels never rewrite a shard once per block.
+    """
+
+    def __init__(self, array):
+        RowStager.__init__(self, array.shape, array.shards[0], array.dtype)
+        self.array = array
+
+    def flush_row(self, start, filled):
+        self.array[start:start + filled] = self.buffer[0:filled]
+
+
+class ZarrWriter(object):
+    """
+    Writer for data.ome.zarr with the same interface as h5_writer.H5Writer
+    (write(img_3d, idx, ind1, ind2), finish(idx), close()), so it can be
+    used directly or behind a BackgroundWriter.
+
+    Parameters
+    ----------
+
+    dest
+        path to data.ome.zarr, already initialized by zarrinit
+    """
+
+    res_list = res_list
+
+    def __init__(self, dest):
+        _require_zarr()
+        self.dest = dest
+        self.root = zarr.open_group(dest, mode='r+')
+        self.layout = dict(self.root.attrs['otls'])
+        self.arrays = {}
+        self.pyramids = {}
+        self.stagers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def array(self, idx, z):
+        key = (idx, z)
+        if key not in self.arrays:
+            zarrsetup(self.root, idx, self.layout)
+            self.arrays[key] = self.root['s' + str(idx).zfill(2) + '/' + str(z)]
+        return self.arrays[key]
+
+    def write(self, img_3d, idx, ind1, ind2):
+        """
+        Write frames ind1 - ind2 of setup idx at all resolution levels.
+        Blocks of a setup must arrive in order (see H5Writer.write).
+        """
+        pyramid = self.pyramids.get(idx)
+        if pyramid is None or pyramid.next[0] != ind1:
+            self.finish(idx)
+            pyramid = PyramidBuilder(len(self.res_list), start=ind1)
+            self.pyramids[idx] = pyramid
+
+        self._write_pieces(idx, pyramid.push(img_3d))
+
+        if ind2 >= self.array(idx, 0).shape[0]:
+            self.finish(idx)
+
+    def annotate(self, idx, attrs):
+        """
+        Store attrs (e.g. the frame accounting of camera_loop.FrameStats)
+        as 'frames' in the otls attributes of setup idx.
+        """
+        zarrsetup(self.root, idx, self.layout)
+        group = self.root['s' + str(idx).zfill(2)]
+        otls = dict(group.attrs['otls'])
+        otls['frames'] = dict(attrs)
+        group.attrs['otls'] = otls
+
+    def finish(self, idx):
+        pyramid = self.pyramids.pop(idx, None)
+        if pyramid is not None:
+            self._write_pieces(idx, pyramid.finish())
+        for z in range(len(self.res_list)):
+            stager = self.stagers.pop((idx, z), None)
+            if stager is not None:
+                stager.flush()
+
+    def _write_pieces(self, idx, pieces):
+        for z, ind1_r, img_3d in pieces:
+            key = (idx, z)
+            if key not in self.stagers:
+                self.stagers[key] = ShardStager(self.array(idx, z))
+            self.stagers[key].write(ind1_r, to_output(img_3d, 'uint16'))
+
+    def close(self):
+        if self.root is not None:
+            try:
+                for idx in set(self.pyramids) | set(i for i, z in self.stagers):
+                    self.finish(idx)
+            finally:
+                self.arrays = {}
+                self.root = None